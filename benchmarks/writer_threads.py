@@ -0,0 +1,57 @@
+"""
+Writer Threads Benchmark
+
+Measures the records per second a Writer accepts from 1, 4 and 16
+producer threads, using append and append_many, with and without
+committing on write. The partitions are discarded by the null_writer,
+so this measures the Writer rather than the storage.
+
+    python benchmarks/writer_threads.py
+"""
+import os
+import sys
+import time
+import threading
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from orwell import Writer
+from orwell.writers.null_writer import null_writer
+
+RECORDS_PER_THREAD = 20000
+BATCH_SIZE = 100
+RECORD = {'user': 'bob', 'action': 'login', 'status': 200, 'latency': 0.125, 'tags': ['a', 'b']}
+
+
+def _producer(writer: Writer, use_append_many: bool):
+    if use_append_many:
+        for _ in range(RECORDS_PER_THREAD // BATCH_SIZE):
+            writer.append_many([RECORD] * BATCH_SIZE)
+    else:
+        for _ in range(RECORDS_PER_THREAD):
+            writer.append(RECORD)
+
+
+def run(threads: int, use_append_many: bool, commit_on_write: bool) -> float:
+    """ returns the records written per second """
+    writer = Writer(
+            writer=null_writer,
+            commit_on_write=commit_on_write,
+            use_worker_thread=False)
+    producers = [threading.Thread(target=_producer, args=(writer, use_append_many))
+                 for _ in range(threads)]
+    start = time.perf_counter()
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    writer.finalize()
+    return (threads * RECORDS_PER_THREAD) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    print(F"{'threads':>8} {'method':>12} {'commit':>7} {'records/s':>12}")
+    for commit_on_write in (False, True):
+        for use_append_many in (False, True):
+            for threads in (1, 4, 16):
+                rate = run(threads, use_append_many, commit_on_write)
+                method = 'append_many' if use_append_many else 'append'
+                print(F"{threads:>8} {method:>12} {str(commit_on_write):>7} {rate:>12,.0f}")
@@ -1,2 +1,3 @@
 from .readers.reader import Reader
 from .writers.writer import Writer
+from .query import Query
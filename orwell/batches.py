@@ -0,0 +1,377 @@
+"""
+COLUMN BATCHES
+
+The dictset functions handle a record at a time, so every step pays the
+cost of Python handling each value of each record. A ColumnBatch holds
+a batch of records as a NumPy array per column, so steps can work on a
+whole column at once.
+
+Columns of numbers and booleans are held as arrays of those types, other
+columns (strings, lists, dictionaries and mixed types) are held as arrays
+of objects. Nulls are held in a separate mask for each column; records
+which don't have a column have a null for it. Columns with both integers
+and floats are held as floats.
+
+Converting between records and batches is explicit, so the steps which
+benefit from it can be run on batches and the rest on records:
+
+    batches = to_batches(Reader(from_path='logs'), 10000)
+    batches = select_from_batches(batches, ['user', 'latency'], "status == 500")
+    for record in to_dictset(batches):
+        ...
+
+Conditions are expressions (see expressions.py), which are tested on
+whole columns. Functions can also be used but are run on each record.
+
+NumPy must be installed to use ColumnBatches.
+"""
+from typing import Iterable, Iterator, Any, List, Union, Callable, Dict, Optional
+from .dictset import (
+        generator_chunker, merge_groups, select_all, _serialize,
+        AGGREGATIONS, PARTIAL_STATES)
+from .expressions import Expression, parse
+try:
+    import numpy  # type:ignore
+except ImportError:
+    numpy = None  # type:ignore
+
+
+def _to_array(values: list):
+    """ converts a list of values to an array and a mask of the nulls """
+    nulls = numpy.fromiter((value is None for value in values), dtype=bool, count=len(values))
+    kinds = {type(value) for value in values if value is not None}
+    if kinds and kinds <= {bool}:
+        return numpy.array([bool(value) for value in values], dtype=bool), nulls
+    if kinds and kinds <= {int, float}:
+        dtype = numpy.int64 if kinds == {int} else numpy.float64
+        try:
+            return numpy.array([0 if value is None else value for value in values], dtype=dtype), nulls
+        except OverflowError:  # integers too big for int64
+            pass
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array, nulls
+
+
+class ColumnBatch():
+
+    def __init__(self, columns: Dict[str, Any], nulls: Dict[str, Any]):
+        """
+        A batch of records as a dictionary of arrays, 'nulls' has a boolean
+        array for each column which is True where the value is null. Use
+        from_records or from_columns to create batches.
+        """
+        if numpy is None:
+            raise ImportError("NumPy must be installed to use ColumnBatch")
+        self.columns = columns
+        self.nulls = nulls
+        self.length = len(next(iter(columns.values()))) if columns else 0
+
+    @staticmethod
+    def from_columns(columns: Dict[str, list]) -> 'ColumnBatch':
+        """ creates a batch from a dictionary of lists (see Reader.iter_batches) """
+        arrays: Dict[str, Any] = {}
+        nulls: Dict[str, Any] = {}
+        for name, values in columns.items():
+            arrays[name], nulls[name] = _to_array(list(values))
+        return ColumnBatch(arrays, nulls)
+
+    @staticmethod
+    def from_records(records: List[dict]) -> 'ColumnBatch':
+        names = dict.fromkeys(name for record in records for name in record)
+        return ColumnBatch.from_columns({name: [record.get(name) for record in records] for name in names})
+
+    def __len__(self) -> int:
+        return self.length
+
+    def get(self, name: str, default: Any = None) -> Any:
+        """ the array of values of a column, nulls have placeholder values """
+        return self.columns.get(name, default)
+
+    def column(self, name: str) -> list:
+        """ the values of a column as a list, with None for nulls """
+        values = self.columns[name].tolist()
+        for index in numpy.flatnonzero(self.nulls[name]):
+            values[index] = None
+        return values
+
+    def to_columns(self) -> Dict[str, list]:
+        return {name: self.column(name) for name in self.columns}
+
+    def to_records(self) -> List[dict]:
+        names = list(self.columns)
+        return [dict(zip(names, row)) for row in zip(*(self.column(name) for name in names))]
+
+    def filter(self, mask: Any) -> 'ColumnBatch':
+        """ the records where 'mask' is True """
+        mask = numpy.asarray(mask, dtype=bool)
+        return ColumnBatch(
+                {name: values[mask] for name, values in self.columns.items()},
+                {name: nulls[mask] for name, nulls in self.nulls.items()})
+
+    def slice(self, start: int, stop: Optional[int] = None) -> 'ColumnBatch':
+        return ColumnBatch(
+                {name: values[start:stop] for name, values in self.columns.items()},
+                {name: nulls[start:stop] for name, nulls in self.nulls.items()})
+
+    def select(self, names: List[str]) -> 'ColumnBatch':
+        """ the columns in 'names', missing columns are null """
+        if names == ['*']:
+            return self
+        columns: Dict[str, Any] = {}
+        nulls: Dict[str, Any] = {}
+        for name in names:
+            if name in self.columns:
+                columns[name], nulls[name] = self.columns[name], self.nulls[name]
+            else:
+                columns[name], nulls[name] = _to_array([None] * self.length)
+        return ColumnBatch(columns, nulls)
+
+    def set_column(self, name: str, values: Any) -> 'ColumnBatch':
+        """
+        Sets a column to a single value, a list of values or an array,
+        returning a new batch.
+        """
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            array, nulls = values, numpy.zeros(self.length, dtype=bool)
+            if values.dtype == object:
+                array, nulls = _to_array(values.tolist())
+        elif isinstance(values, (list, tuple)):
+            array, nulls = _to_array(list(values))
+        else:
+            array, nulls = _to_array([values] * self.length)
+        if len(array) != self.length:
+            raise ValueError(F"Column '{name}' has {len(array)} values, the batch has {self.length} records")
+        return ColumnBatch({**self.columns, name: array}, {**self.nulls, name: nulls})
+
+
+def to_batches(
+        dictset: Iterable[dict],
+        batch_size: int = 10000) -> Iterator[ColumnBatch]:
+    for records in generator_chunker(dictset, batch_size):
+        yield ColumnBatch.from_records(records)
+
+
+def to_dictset(batches: Iterable[ColumnBatch]) -> Iterator[dict]:
+    for batch in batches:
+        yield from batch.to_records()
+
+
+def _batch_mask(batch: ColumnBatch, condition: Callable):
+    if isinstance(condition, Expression):
+        return condition.mask(batch)
+    return [bool(condition(record)) for record in batch.to_records()]
+
+
+def select_from_batches(
+        batches: Iterable[ColumnBatch],
+        columns: List[str] = ['*'],
+        condition: Union[Callable, str] = select_all) -> Iterator[ColumnBatch]:
+    """
+    Filters and selects columns from batches, see select_from_dictset.
+    Empty batches aren't returned.
+    """
+    if isinstance(condition, str):
+        condition = parse(condition)
+    for batch in batches:
+        if condition is not select_all:
+            batch = batch.filter(_batch_mask(batch, condition))
+        if len(batch):
+            yield batch.select(columns)
+
+
+def set_batch_column(
+        batches: Iterable[ColumnBatch],
+        column_name: str,
+        setter: Any) -> Iterator[ColumnBatch]:
+    """
+    Sets a column in each batch, see set_column. If 'setter' is a function
+    it is called with the batch and returns the values for the column:
+
+        set_batch_column(batches, 'seconds', lambda batch: batch.get('latency') / 1000)
+    """
+    for batch in batches:
+        values = setter(batch) if callable(setter) else setter
+        yield batch.set_column(column_name, values)
+
+
+def _hashable(value: Any) -> Any:
+    if isinstance(value, (list, dict)):
+        return _serialize(value)
+    return value
+
+
+def _first_keys(batch: ColumnBatch, names: List[str]):
+    """
+    The position of the first record with each key in a batch, and the
+    keys. Where the columns are numbers or booleans, each value is given
+    a code with numpy.unique and the codes of the columns are combined,
+    so the keys in the batch are found without testing each record.
+    """
+    present = [name for name in names if name in batch.columns]
+    combined = numpy.zeros(len(batch), dtype=numpy.int64)
+    radix = 1
+    for name in present:
+        values, nulls = batch.columns[name], batch.nulls[name]
+        if values.dtype == object:
+            break
+        codes = numpy.unique(values, return_inverse=True)[1].reshape(-1) + 1
+        codes[nulls] = 0
+        radix *= len(batch) + 1
+        if radix >= 2 ** 62:  # the combined codes may not fit
+            break
+        combined = combined * (len(batch) + 1) + codes
+    else:
+        positions = numpy.sort(numpy.unique(combined, return_index=True)[1])
+        keys = zip(*([None if null else value for value, null in
+                      zip(batch.columns[name][positions].tolist(), batch.nulls[name][positions].tolist())]
+                     if name in batch.columns else [None] * len(positions) for name in names))
+        return positions.tolist(), keys
+    keys = zip(*(batch.column(name) if name in batch.columns else [None] * len(batch) for name in names))
+    return range(len(batch)), keys
+
+
+def distinct_batches(
+        batches: Iterable[ColumnBatch],
+        columns: List[str] = ['*']) -> Iterator[ColumnBatch]:
+    """
+    Removes duplicate records from batches, see distinct.
+
+    Unlike distinct, values are compared as they are in the batches: a
+    missing value is a null, so is the same as None (distinct treats it
+    as ''), and values which are equal are the same, so 1, 1.0 and True
+    are one value (distinct keeps them apart).
+    """
+    seen: set = set()
+    for batch in batches:
+        names = list(batch.columns) if columns == ['*'] else columns
+        positions, keys = _first_keys(batch, names)
+        mask = numpy.zeros(len(batch), dtype=bool)
+        for index, key in zip(positions, keys):
+            try:
+                hash(key)
+            except TypeError:
+                key = tuple(_hashable(value) for value in key)
+            if key not in seen:
+                seen.add(key)
+                mask[index] = True
+        batch = batch.filter(mask)
+        if len(batch):
+            yield batch
+
+
+def limit_batches(
+        batches: Iterable[ColumnBatch],
+        limit: int) -> Iterator[ColumnBatch]:
+    """
+    Returns batches with up to 'limit' records in total
+    """
+    remaining = limit
+    for batch in batches:
+        if remaining <= 0:
+            return
+        if len(batch) > remaining:
+            batch = batch.slice(0, remaining)
+        remaining -= len(batch)
+        yield batch
+
+
+def _group_indices(batch: ColumnBatch, columns: List[str]):
+    """ the keys of the groups in a batch, and the group of each record """
+    if len(columns) == 1 and columns[0] in batch.columns:
+        values, nulls = batch.columns[columns[0]], batch.nulls[columns[0]]
+        if values.dtype != object and not nulls.any():
+            keys, inverse = numpy.unique(values, return_inverse=True)
+            return [(key,) for key in keys.tolist()], inverse.reshape(-1)
+    groups: Dict[Any, int] = {}
+    key_columns = [batch.column(name) if name in batch.columns else [None] * len(batch) for name in columns]
+    inverse = numpy.fromiter(
+            (groups.setdefault(key, len(groups)) for key in zip(*key_columns)),
+            dtype=numpy.int64, count=len(batch))
+    return list(groups), inverse
+
+
+def _batch_states(batch: ColumnBatch, field: str, function: str, inverse, group_count: int) -> list:
+    """ the aggregation states for each group in a batch """
+    if field == '*':
+        counts = numpy.bincount(inverse, minlength=group_count)
+        return counts.tolist()
+    if field not in batch.columns:
+        return [AGGREGATIONS[function][0]() for i in range(group_count)]
+
+    values, nulls = batch.columns[field], batch.nulls[field]
+    valid = ~nulls
+    groups = inverse[valid]
+    counts = numpy.bincount(groups, minlength=group_count)
+
+    if function == 'COUNT':
+        return counts.tolist()
+    if function in ('FIRST', 'LAST'):
+        # nulls are included in FIRST and LAST
+        positions = numpy.arange(len(batch))
+        if function == 'FIRST':
+            chosen = numpy.full(group_count, len(batch))
+            numpy.minimum.at(chosen, inverse, positions)
+        else:
+            chosen = numpy.full(group_count, -1)
+            numpy.maximum.at(chosen, inverse, positions)
+        column = batch.column(field)
+        return [[True, column[index]] for index in chosen.tolist()]
+
+    if values.dtype.kind in 'iuf':
+        valid_values = values[valid]
+        if function in ('SUM', 'MEAN'):
+            sums = numpy.zeros(group_count, dtype=values.dtype)
+            numpy.add.at(sums, groups, valid_values)
+            if function == 'SUM':
+                return sums.tolist()
+            return [list(state) for state in zip(sums.tolist(), counts.tolist())]
+        if function in ('MIN', 'MAX'):
+            if function == 'MIN':
+                extremes = numpy.full(group_count, numpy.inf if values.dtype.kind == 'f' else numpy.iinfo(values.dtype).max, dtype=values.dtype)
+                numpy.minimum.at(extremes, groups, valid_values)
+            else:
+                extremes = numpy.full(group_count, -numpy.inf if values.dtype.kind == 'f' else numpy.iinfo(values.dtype).min, dtype=values.dtype)
+                numpy.maximum.at(extremes, groups, valid_values)
+            return [value if count else None for value, count in zip(extremes.tolist(), counts.tolist())]
+
+    # other types are aggregated a value at a time
+    initial, update = AGGREGATIONS[function][0], AGGREGATIONS[function][1]
+    states = [initial() for i in range(group_count)]
+    for group, value in zip(inverse.tolist(), batch.column(field)):
+        states[group] = update(states[group], value)
+    return states
+
+
+def group_batches(
+        batches: Iterable[ColumnBatch],
+        columns: Union[str, List[str]],
+        aggregations: List[tuple],
+        partial: bool = False,
+        max_groups: int = 1000000,
+        partitions: int = 16) -> Iterator[dict]:
+    """
+    Groups and aggregates batches, see group_by. Each batch is aggregated
+    a column at a time and the results for the batches are combined with
+    merge_groups, so the results are records.
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    functions = [aggregation[0].upper() for aggregation in aggregations]
+    for function in functions:
+        if function not in AGGREGATIONS:
+            raise ValueError(F"Unknown aggregation '{function}'")
+
+    def _partials():
+        for batch in batches:
+            if not len(batch):
+                continue
+            keys, inverse = _group_indices(batch, columns)
+            states = [_batch_states(batch, aggregation[1], function, inverse, len(keys))
+                      for aggregation, function in zip(aggregations, functions)]
+            for index, key in enumerate(keys):
+                partial_record = dict(zip(columns, key))
+                partial_record[PARTIAL_STATES] = [state[index] for state in states]
+                yield partial_record
+
+    yield from merge_groups(_partials(), columns, aggregations, partial, max_groups, partitions)
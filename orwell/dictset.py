@@ -13,8 +13,11 @@ Methods provide a limited approximation of SQL functionality:
 SELECT   - select_from_dictset
 UNION    - union_dictsets
 WHERE    - select_from_dictset
-JOIN     - join_dictsets
+JOIN     - join_dictsets (INNER, LEFT, SEMI and ANTI), merge_join
+ORDER BY - sort_dictset, top_n (with LIMIT)
+GROUP BY - group_by (COUNT, SUM, MIN, MAX, MEAN, FIRST, LAST)
 DISTINCT - disctinct
+EXCEPT   - diff_dictsets, diff_partitions
 LIMIT    - limit
 
 All methods return generators, which mean they can only be iterated once, to
@@ -39,14 +42,26 @@ for record in join_dictsets(filtered_list1, filtered_list2, 'id'):
     print(record)
 
 """
-from typing import Iterator, Any, List, Union, Callable
+from typing import Iterable, Iterator, Any, List, Union, Callable, Dict, Tuple, Optional, Mapping
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import tempfile
+import hashlib
+import heapq
 import json
+from .helpers.bloom_filter import BloomFilter
+from .expressions import parse
 json_parser: Callable = json.loads
-json_dumper: Callable = json.dumps
+# compact, like orjson, so most records serialize the same with or without
+# orjson - some floats don't, orjson writes 1e16 where json writes 1e+16
+json_dumper: Callable = functools.partial(json.dumps, separators=(',', ':'), ensure_ascii=False)
+# keys are sorted at every level, for digests which don't depend on key order
+sorted_dumper: Callable = functools.partial(json_dumper, sort_keys=True)
 try:
     import orjson
     json_parser = orjson.loads
     json_dumper = orjson.dumps
+    sorted_dumper = functools.partial(orjson.dumps, option=orjson.OPT_SORT_KEYS)
 except ImportError:
     pass
 try:
@@ -56,9 +71,15 @@ except ImportError:
     pass
 
 
+# one in this many records are measured to estimate the size of a join
+JOIN_SAMPLE_RATE = 64
+
+
 class JOINS(object):
     INNER_JOIN = 'INNER'
     LEFT_JOIN = 'LEFT'
+    SEMI_JOIN = 'SEMI'
+    ANTI_JOIN = 'ANTI'
 
 
 def select_all(dummy: Any) -> bool:
@@ -85,37 +106,525 @@ def order(record: Union[dict, list]) -> Union[dict, list]:
     return record
 
 
+def _serialize(record: Any) -> bytes:
+    serialized = json_dumper(record)
+    if isinstance(serialized, str):
+        serialized = serialized.encode()
+    return serialized
+
+
+def _spill_file():
+    """ a temporary file for records which don't fit in memory """
+    return tempfile.TemporaryFile(mode='w+b')
+
+
+def _read_spill_file(spill_file) -> Iterator[Any]:
+    spill_file.seek(0)
+    for line in spill_file:
+        yield json_parser(line)
+    spill_file.close()
+
+
+def _key_getter(columns: Union[str, List[str]]) -> Callable:
+    """
+    Creates a function to get the key from a record, composite keys are
+    tuples. Keys with missing (None) values are None.
+    """
+    if isinstance(columns, str):
+        return lambda record: record.get(columns)
+    columns = list(columns)
+
+    def _composite_key(record):
+        key = tuple(record.get(column) for column in columns)
+        return None if None in key else key
+
+    return _composite_key
+
+
+def _joined_records(
+        record: dict,
+        matches: Optional[List[dict]],
+        join_type: str) -> Iterator[dict]:
+    """ the records resulting from joining a record to its matches """
+    if join_type == JOINS.SEMI_JOIN:
+        if matches:
+            yield record
+    elif join_type == JOINS.ANTI_JOIN:
+        if not matches:
+            yield record
+    elif matches:
+        for match in matches:
+            yield {**record, **match}
+    elif join_type == JOINS.LEFT_JOIN:
+        yield record
+
+
+def _join_matches(
+        left: Iterator[dict],
+        index: Dict[Any, List[dict]],
+        get_key: Callable,
+        join_type: str) -> Iterator[dict]:
+    for record in left:
+        key = get_key(record)
+        matches = index.get(key) if key is not None else None
+        yield from _joined_records(record, matches, join_type)
+
+
 def join_dictsets(
         left: Iterator[dict],
         right: Iterator[dict],
-        column: str,
-        join_type=JOINS.INNER_JOIN) -> Iterator[dict]:
+        column: Union[str, List[str]],
+        join_type=JOINS.INNER_JOIN,
+        memory_limit: int = 256*1024*1024,
+        partitions: int = 16) -> Iterator[dict]:
     """
     Iterates over the left table, matching records fron the right table.
 
     INNER_JOIN, the default, will discard records unless they appear in both
     tables, LEFT_JOIN will keep all the records fron the left table and add
-    records for the right table if a match is found.
+    records for the right table if a match is found. SEMI_JOIN returns the
+    records from the left table which have a match, ANTI_JOIN returns the
+    ones which don't. Where a record matches more than one record in the
+    right table, a record is returned for each match.
+
+    'column' can be a list of columns to join on more than one column.
+    Records with missing values in the join columns don't match.
 
     It is recommended that the left table be the larger of the two tables as
     the right table is loaded into memory to perform the matching and look ups.
+    If the right table is larger than 'memory_limit' (approximately, in bytes,
+    estimated from the size of a sample of the records) both tables are split
+    into 'partitions' temporary files by the join key and joined a partition
+    at a time (a grace hash join). When this happens the records have been
+    through JSON, and are not returned in the order of the left table.
 
     NOTES:
-    - where columns are in both tables - I don't know what happens.
-    - resultant records may have inconsistent columns (same as 
+    - where columns are in both tables, the value from the right table is
+      used.
+    - resultant records may have inconsistent columns (same as
       source lists)
 
     Approximate SQL:
 
     SELECT * FROM left JOIN right ON left.column = right.column
     """
-    index = create_index(right, column)
+    get_key = _key_getter(column)
+
+    # build an index of the right table, the memory used is estimated from
+    # the size of a sample of the records
+    index: Dict[Any, List[dict]] = {}
+    indexed = sampled = sampled_bytes = 0
+    right = iter(right)
+    for record in right:
+        key = get_key(record)
+        if key is None:
+            continue
+        index.setdefault(key, []).append(record)
+        indexed += 1
+        if (indexed - 1) % JOIN_SAMPLE_RATE == 0:
+            sampled += 1
+            sampled_bytes += len(_serialize(record))
+            if sampled_bytes * indexed > memory_limit * sampled:
+                break
+    else:
+        yield from _join_matches(left, index, get_key, join_type)
+        return
+
+    # the right table doesn't fit in memory, partition both tables
+    right_partitions = [_spill_file() for i in range(partitions)]
+    left_partitions = [_spill_file() for i in range(partitions)]
+
+    def _spill(records, spill_files):
+        for record in records:
+            key = get_key(record)
+            if key is None:
+                continue
+            spill_files[hash(key) % partitions].write(_serialize(record) + b'\n')
+
+    _spill((match for matches in index.values() for match in matches), right_partitions)
+    index = {}
+    _spill(right, right_partitions)
+
     for record in left:
-        value = record.get('QID')
-        if index.get(value):
-            yield {**record, **index[value]}
-        elif join_type == JOINS.LEFT_JOIN:
-            yield record
+        key = get_key(record)
+        if key is None:
+            # these can't match anything
+            if join_type in (JOINS.LEFT_JOIN, JOINS.ANTI_JOIN):
+                yield record
+            continue
+        left_partitions[hash(key) % partitions].write(_serialize(record) + b'\n')
+
+    for right_partition, left_partition in zip(right_partitions, left_partitions):
+        index = {}
+        for record in _read_spill_file(right_partition):
+            index.setdefault(get_key(record), []).append(record)
+        yield from _join_matches(_read_spill_file(left_partition), index, get_key, join_type)
+
+
+def _sort_value(value: Any) -> Tuple[int, Any]:
+    """
+    Values of different types can't be compared, sort them by type and
+    then by value; nulls sort last.
+    """
+    if value is None:
+        return (3, 0)
+    if isinstance(value, (bool, int, float)):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+    return (2, _serialize(order(value)))
+
+
+def _sort_key_getter(columns: Union[str, List[str]], descending: bool = False) -> Callable:
+    """
+    Keys to sort records by, nulls sort last in either direction - when
+    sorting in descending order (reversing the keys) they sort first.
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    columns = list(columns)
+    if descending:
+        return lambda record: tuple(
+                (-1, 0) if record.get(column) is None else _sort_value(record.get(column))
+                for column in columns)
+    return lambda record: tuple(_sort_value(record.get(column)) for column in columns)
+
+
+def sort_dictset(
+        dictset: Iterator[dict],
+        columns: Union[str, List[str]],
+        descending: bool = False,
+        memory_limit: int = 256*1024*1024) -> Iterator[dict]:
+    """
+    Sorts a dictset by one or more columns. Nulls sort after other values,
+    values of different types are sorted by type (numbers, then strings,
+    then everything else).
+
+    Records are sorted in memory until 'memory_limit' (approximately, in
+    bytes) is reached, the sorted run is then written to a temporary file.
+    The runs are merged when the dictset has been read (an external merge
+    sort). Records which have been written to a run have been through JSON.
+
+    Approximate SQL:
+
+    SELECT * FROM dictset ORDER BY columns
+    """
+    get_key = _sort_key_getter(columns, descending)
+    runs: list = []
+    run: List[dict] = []
+    memory_used = 0
+
+    for record in dictset:
+        run.append(record)
+        memory_used += len(_serialize(record))
+        if memory_used > memory_limit:
+            run.sort(key=get_key, reverse=descending)
+            spill_file = _spill_file()
+            for sorted_record in run:
+                spill_file.write(_serialize(sorted_record) + b'\n')
+            runs.append(_read_spill_file(spill_file))
+            run = []
+            memory_used = 0
+
+    run.sort(key=get_key, reverse=descending)
+    if not runs:
+        yield from run
+        return
+    runs.append(iter(run))
+    yield from heapq.merge(*runs, key=get_key, reverse=descending)
+
+
+class _Descending():
+    """ reverses the order of a value, to use a min-heap as a max-heap """
+    __slots__ = ('value',)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __lt__(self, other: '_Descending') -> bool:
+        return other.value < self.value
+
+
+def top_n(
+        dictset: Iterable[dict],
+        columns: Union[str, List[str]],
+        n: int,
+        descending: bool = True) -> Iterator[dict]:
+    """
+    The first 'n' records, in order, if the dictset was sorted by
+    'columns' - the same records as sorting and then limiting, but only
+    'n' records are held in memory.
+
+    Records are kept in a heap of 'n' records, the record at the top of
+    the heap is the one which would be the first to be dropped. Records
+    which sort equally are returned in the order they were read, records
+    with null values are last whichever the order.
+
+    Approximate SQL:
+
+    SELECT * FROM dictset ORDER BY columns DESC LIMIT n
+    """
+    if n <= 0:
+        return
+    get_key = _sort_key_getter(columns, descending)
+    heap: list = []
+    for counter, record in enumerate(dictset):
+        if descending:
+            # the smallest key is dropped first, the latest if equal
+            entry: Any = (get_key(record), -counter, record)
+        else:
+            entry = (_Descending((get_key(record), counter)), record)
+        if len(heap) < n:
+            heapq.heappush(heap, entry)
+        elif heap[0][:-1] < entry[:-1]:
+            heapq.heapreplace(heap, entry)
+    if descending:
+        heap.sort(key=lambda entry: (entry[0], entry[1]), reverse=True)
+    else:
+        heap.sort(key=lambda entry: entry[0].value)
+    for entry in heap:
+        yield entry[-1]
+
+
+def merge_top_n(
+        top_ns: Iterable[Iterable[dict]],
+        columns: Union[str, List[str]],
+        n: int,
+        descending: bool = True) -> Iterator[dict]:
+    """
+    Combines the results of top_n, for example from different files or
+    processes, into the top 'n' of all of them.
+    """
+    return top_n((record for records in top_ns for record in records), columns, n, descending)
+
+
+def merge_join(
+        left: Iterator[dict],
+        right: Iterator[dict],
+        column: Union[str, List[str]],
+        join_type=JOINS.INNER_JOIN) -> Iterator[dict]:
+    """
+    Joins two dictsets which are both already sorted by the join columns
+    (in ascending order, as sort_dictset does).
+
+    Only the records from the right table with the same key as the current
+    left record are held in memory, so two large tables can be joined.
+    The join types and handling of missing values are the same as for
+    join_dictsets.
+
+    Approximate SQL:
+
+    SELECT * FROM left JOIN right ON left.column = right.column
+    """
+    get_key = _key_getter(column)
+    get_sort_key = _sort_key_getter(column)
+
+    def _groups(records):
+        """ group consecutive records with the same key """
+        group: List[dict] = []
+        group_key = None
+        for record in records:
+            key = get_sort_key(record)
+            if group and key != group_key:
+                yield group_key, group
+                group = []
+            group_key = key
+            group.append(record)
+        if group:
+            yield group_key, group
+
+    right_groups = _groups(right)
+    right_key, right_group = next(right_groups, (None, []))
+
+    for record in left:
+        matches: List[dict] = []
+        if get_key(record) is not None:
+            key = get_sort_key(record)
+            while right_group and right_key < key:
+                right_key, right_group = next(right_groups, (None, []))
+            if right_group and right_key == key:
+                matches = right_group
+        yield from _joined_records(record, matches, join_type)
+
+
+def _min_state(state, value):
+    if value is None or (state is not None and _sort_value(state) <= _sort_value(value)):
+        return state
+    return value
+
+
+def _max_state(state, value):
+    if value is None or (state is not None and _sort_value(state) >= _sort_value(value)):
+        return state
+    return value
+
+
+def _sum_state(state, value):
+    return state if value is None else state + value
+
+
+def _mean_state(state, value):
+    return state if value is None else [state[0] + value, state[1] + 1]
+
+
+def _first_state(state, value):
+    return state if state[0] else [True, value]
+
+
+def _last_state(state, value):
+    return [True, value]
+
+
+"""
+Each aggregation has:
+- a function to create the initial state
+- a function to update the state with a value
+- a function to merge two states
+- a function to get the result from the state
+
+States are JSON serializable, so they can be saved or sent between
+processes and merged later (see group_by's 'partial' parameter).
+"""
+AGGREGATIONS: Dict[str, Tuple[Callable, Callable, Callable, Callable]] = {
+    'COUNT': (lambda: 0, lambda state, value: state if value is None else state + 1, lambda a, b: a + b, lambda state: state),
+    'SUM': (lambda: 0, _sum_state, lambda a, b: a + b, lambda state: state),
+    'MIN': (lambda: None, _min_state, _min_state, lambda state: state),
+    'MAX': (lambda: None, _max_state, _max_state, lambda state: state),
+    'MEAN': (lambda: [0, 0], _mean_state, lambda a, b: [a[0] + b[0], a[1] + b[1]], lambda state: state[0] / state[1] if state[1] else None),
+    'FIRST': (lambda: [False, None], _first_state, lambda a, b: a if a[0] else b, lambda state: state[1]),
+    'LAST': (lambda: [False, None], _last_state, lambda a, b: b if b[0] else a, lambda state: state[1]),
+}
+PARTIAL_STATES = '__partial__'
+
+
+def _aggregation_name(aggregation: tuple) -> str:
+    if len(aggregation) > 2:
+        return aggregation[2]
+    return F"{aggregation[0].upper()}({aggregation[1]})"
+
+
+def _spill_groups(groups: dict, spill_files: list, columns: List[str]):
+    for key, states in groups.items():
+        partial = dict(zip(columns, key))
+        partial[PARTIAL_STATES] = states
+        spill_files[hash(key) % len(spill_files)].write(_serialize(partial) + b'\n')
+
+
+def _grouped(
+        records: Iterator[dict],
+        columns: List[str],
+        aggregations: List[tuple],
+        merge_partials: bool,
+        max_groups: int,
+        partitions: int) -> Iterator[Tuple[tuple, list]]:
+    """
+    Groups records, returning the key and the states of each group. If
+    there are more than 'max_groups', the groups are written to temporary
+    files partitioned by their key and merged a partition at a time.
+    """
+    functions = [AGGREGATIONS[aggregation[0].upper()] for aggregation in aggregations]
+    initials = [function[0] for function in functions]
+    updaters = [function[2 if merge_partials else 1] for function in functions]
+    # COUNT(*) counts every record, so '*' is never null
+    fields = [None if aggregation[1] == '*' else aggregation[1] for aggregation in aggregations]
+    spill_files: list = []
+    groups: Dict[tuple, list] = {}
+
+    for record in records:
+        key = tuple(record.get(column) for column in columns)
+        states = groups.get(key)
+        if states is None:
+            states = [initial() for initial in initials]
+            groups[key] = states
+        if merge_partials:
+            values = record[PARTIAL_STATES]
+        else:
+            values = [1 if field is None else record.get(field) for field in fields]
+        for index, updater in enumerate(updaters):
+            states[index] = updater(states[index], values[index])
+        if len(groups) > max_groups:
+            if not spill_files:
+                spill_files = [_spill_file() for i in range(partitions)]
+            _spill_groups(groups, spill_files, columns)
+            groups = {}
+
+    if not spill_files:
+        yield from groups.items()
+        return
+
+    _spill_groups(groups, spill_files, columns)
+    for spill_file in spill_files:
+        # each partition has all of the partial states for its groups
+        yield from _grouped(_read_spill_file(spill_file), columns, aggregations, True, max_groups=2**62, partitions=1)
+
+
+def group_by(
+        dictset: Iterator[dict],
+        columns: Union[str, List[str]],
+        aggregations: List[tuple],
+        partial: bool = False,
+        max_groups: int = 1000000,
+        partitions: int = 16) -> Iterator[dict]:
+    """
+    Groups the records by the values in 'columns' and aggregates each
+    group, returning a record per group.
+
+    'aggregations' is a list of (function, column) tuples, e.g.
+    [('count', '*'), ('sum', 'amount')], the results are named after the
+    aggregation - 'COUNT(*)' and 'SUM(amount)'. A third value in the tuple
+    is used as the name instead. The functions are COUNT, SUM, MIN, MAX,
+    MEAN, FIRST and LAST, nulls are ignored by all except FIRST and LAST.
+
+    If 'partial' is set, the records returned hold the states of the
+    aggregations rather than their results. Partial results, for example
+    from different files or processes, can be combined with merge_groups.
+
+    If there are more than 'max_groups' groups, groups are written to
+    temporary files, partitioned by their key, and then merged a partition
+    at a time.
+
+    Approximate SQL:
+
+    SELECT columns, COUNT(*), SUM(amount) FROM dictset GROUP BY columns
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    groups = _grouped(dictset, columns, aggregations, False, max_groups, partitions)
+    yield from _group_records(groups, columns, aggregations, partial)
+
+
+def merge_groups(
+        partials: Iterator[dict],
+        columns: Union[str, List[str]],
+        aggregations: List[tuple],
+        partial: bool = False,
+        max_groups: int = 1000000,
+        partitions: int = 16) -> Iterator[dict]:
+    """
+    Combines partial results from group_by, the 'columns' and 'aggregations'
+    must be the same as those used to create the partial results.
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    groups = _grouped(partials, columns, aggregations, True, max_groups, partitions)
+    yield from _group_records(groups, columns, aggregations, partial)
+
+
+def _group_records(
+        groups: Iterator[Tuple[tuple, list]],
+        columns: List[str],
+        aggregations: List[tuple],
+        partial: bool) -> Iterator[dict]:
+    names = [_aggregation_name(aggregation) for aggregation in aggregations]
+    results = [AGGREGATIONS[aggregation[0].upper()][3] for aggregation in aggregations]
+    for key, states in groups:
+        record = dict(zip(columns, key))
+        if partial:
+            record[PARTIAL_STATES] = states
+        else:
+            for name, result, state in zip(names, results, states):
+                record[name] = result(state)
+        yield record
 
 
 def union_dictsets(
@@ -141,7 +650,9 @@ def create_index(
         dictset: Iterator[dict],
         index_column: str) -> dict:
     """
-    Create an index of a file to speed up look-ups.
+    Create an index of a file to speed up look-ups, only the last record
+    for each value is kept. See index.Index for an index which keeps
+    every record, can look up ranges and can be saved.
     """
     index = {}
     for record in dictset:
@@ -153,16 +664,19 @@ def create_index(
 def select_from_dictset(
         dictset: Iterator[dict],
         columns: List[str] = ['*'],
-        condition: Callable = select_all) -> Iterator[dict]:
+        condition: Union[Callable, str] = select_all) -> Iterator[dict]:
     """
     Scan a dictset, filtering rows and selecting columns.
 
-    Basic implementation of SQL SELECT statement for a single table
+    Basic implementation of SQL SELECT statement for a single table,
+    'condition' is a function or an expression (see expressions.py).
 
     Approximate SQL:
 
     SELECT columns FROM dictset WHERE condition
     """
+    if isinstance(condition, str):
+        condition = parse(condition)
     for record in dictset:
         if condition(record):
             if columns != ['*']:
@@ -196,31 +710,93 @@ def set_value(
     return record
 
 
+def _digest(entry: Any) -> bytes:
+    """ a stable, 128 bit digest of a record """
+    return hashlib.blake2b(_serialize(entry), digest_size=16).digest()
+
+
+class _DigestSet():
+    """
+    A set of 16 byte digests, held in a single bytearray using open
+    addressing - tens of bytes per digest rather than the hundred or so
+    bytes for each Python set or dictionary entry and its objects.
+    """
+    EMPTY = bytes(16)
+
+    def __init__(self, capacity: int = 1024):
+        self.slots = 1024
+        while self.slots * 0.7 < capacity:
+            self.slots *= 2
+        self.table = bytearray(self.slots * 16)
+        self.count = 0
+        self.has_empty = False
+
+    def add(self, digest: bytes) -> bool:
+        """ adds a digest, returns True if it was already in the set """
+        if digest == self.EMPTY:
+            # the empty digest marks unused slots, so is tracked separately
+            present, self.has_empty = self.has_empty, True
+            return present
+        mask = self.slots - 1
+        table = self.table
+        index = hash(digest) & mask
+        while True:
+            offset = index << 4
+            if table.startswith(digest, offset):
+                return True
+            if table.startswith(self.EMPTY, offset):
+                table[offset:offset + 16] = digest
+                self.count += 1
+                if self.count > self.slots * 0.7:
+                    self._grow()
+                return False
+            index = (index + 1) & mask
+
+    def _grow(self):
+        old_table = bytes(self.table)
+        self.slots *= 4
+        self.table = bytearray(self.slots * 16)
+        self.count = 0
+        for offset in range(0, len(old_table), 16):
+            digest = old_table[offset:offset + 16]
+            if digest != self.EMPTY:
+                self.add(digest)
+
+
 def distinct(
         dictset: Iterator[dict],
-        columns: List[str] = ['*']):
+        columns: List[str] = ['*'],
+        approximate: bool = False,
+        expected_records: int = 1000000,
+        false_positive_rate: float = 0.001):
     """
     Removes duplicate records from a dictset
+
+    Records are tracked by a 128 bit digest, held in a compact set. If
+    'approximate' is set, a Bloom filter sized for 'expected_records' is
+    used instead - this uses a fixed amount of memory but some distinct
+    records (about 'false_positive_rate' of them) will be removed.
     """
 
     def _noop(x):
         return x
-    
+
     def _filter(x):
         return {k: x.get(k, '') for k in columns}
 
-    seen_hashes: dict = {}
+    seen: Union[_DigestSet, BloomFilter]
+    if approximate:
+        seen = BloomFilter(capacity=expected_records, false_positive_rate=false_positive_rate)
+    else:
+        seen = _DigestSet()
     selector = _noop
     if columns != ['*']:
         selector = _filter
 
     for record in dictset:
         entry = selector(record)
-        entry = json_dumper(entry)
-        _hash = hash(entry)
-        if seen_hashes.get(_hash):
+        if seen.add(_digest(entry)):
             continue
-        seen_hashes[_hash] = 1
         yield record
 
 
@@ -238,26 +814,144 @@ def limit(
         yield record
 
 
+FINGERPRINT_MODULUS = 1 << 128
+
+
+def _sorted_digest(record: Any) -> bytes:
+    """ a 128 bit digest of a record, the order of the keys doesn't change it """
+    serialized = sorted_dumper(record)
+    if isinstance(serialized, str):
+        serialized = serialized.encode()
+    return hashlib.blake2b(serialized, digest_size=16).digest()
+
+
+def _fingerprint_record(record: Any) -> int:
+    return int.from_bytes(_sorted_digest(record), 'little')
+
+
+def fingerprint(dictset: Iterator[dict]) -> str:
+    """
+    A stable fingerprint of the records in a dictset, the sum of the 128
+    bit digests of the records. The order of the records doesn't change
+    the fingerprint, duplicate records do; fingerprints are the same in
+    every process, so can be saved and compared later - but records with
+    floats may have different fingerprints with and without orjson.
+    """
+    total = 0
+    for record in dictset:
+        total += _fingerprint_record(record)
+    return format(total % FINGERPRINT_MODULUS, '032x')
+
+
+def combine_fingerprints(fingerprints: Iterable[str]) -> str:
+    """
+    The fingerprint of a dictset from the fingerprints of its parts, for
+    example the files in a partition.
+    """
+    total = sum(int(part, 16) for part in fingerprints)
+    return format(total % FINGERPRINT_MODULUS, '032x')
+
+
 def dictsets_match(
         dictset_1: Iterator[dict],
         dictset_2: Iterator[dict]):
     """
     Tests if two sets match - this terminates generators
     """
-    def _hash_set(dictset: Iterator[dict]):
-        xor = 0
-        for record in dictset:
-            entry = order(record)
-            entry = json_dumper(entry)
-            _hash = hash(entry)
-            xor = xor ^ _hash
-        return xor
+    return fingerprint(dictset_1) == fingerprint(dictset_2)
+
+
+def _fingerprint_partition(source: Callable[[], Iterator[dict]]) -> str:
+    return fingerprint(source())
+
+
+def fingerprint_partitions(
+        partitions: Dict[str, Callable[[], Iterator[dict]]],
+        workers: int = 0) -> Dict[str, str]:
+    """
+    Fingerprints a set of partitions, 'partitions' is a dictionary of the
+    partition names and functions which return the records in them:
+
+        partitions = {day: functools.partial(Reader, from_path=path, date_range=(day, day))
+                      for day in days}
+
+    If 'workers' is set, the partitions are fingerprinted in that many
+    processes, so the functions must be able to be pickled.
+    """
+    if not workers:
+        return {name: _fingerprint_partition(source) for name, source in partitions.items()}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(_fingerprint_partition, source) for name, source in partitions.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def diff_dictsets(
+        dictset_1: Iterable[dict],
+        dictset_2: Iterable[dict]) -> Iterator[Tuple[str, dict]]:
+    """
+    The records which differ between two dictsets, records only in the
+    second are returned as ('+', record) as they are found, then records
+    only in the first as ('-', record). Duplicates are counted, so a record
+    appearing twice in one and once in the other is returned once.
+
+    The distinct records in the first dictset are held in memory, use
+    diff_partitions to find the partitions which differ first.
+    """
+    removed: Dict[bytes, list] = {}
+    for record in dictset_1:
+        digest = _sorted_digest(record)
+        entry = removed.get(digest)
+        if entry:
+            entry[0] += 1
+        else:
+            removed[digest] = [1, record]
+
+    for record in dictset_2:
+        entry = removed.get(_sorted_digest(record))
+        if entry and entry[0]:
+            entry[0] -= 1
+        else:
+            yield '+', record
 
-    return _hash_set(dictset_1) == _hash_set(dictset_2)
+    for count, record in removed.values():
+        for i in range(count):
+            yield '-', record
+
+
+def diff_partitions(
+        partitions_1: Dict[str, Callable[[], Iterator[dict]]],
+        partitions_2: Dict[str, Callable[[], Iterator[dict]]],
+        workers: int = 0,
+        fingerprints_1: Optional[Mapping[str, Optional[str]]] = None,
+        fingerprints_2: Optional[Mapping[str, Optional[str]]] = None) -> Iterator[Tuple[str, str, dict]]:
+    """
+    The records which differ between two partitioned datasets, returned
+    as (partition, '+' or '-', record).
+
+    The partitions are fingerprinted (see fingerprint_partitions) and only
+    the partitions with different fingerprints are compared record by
+    record. Fingerprints which are already known, for example from the
+    partition manifests (see helpers.manifest.partition_fingerprint), can
+    be provided rather than being calculated, partitions with a fingerprint
+    of None are compared record by record.
+    """
+    if fingerprints_1 is None:
+        fingerprints_1 = fingerprint_partitions(partitions_1, workers)
+    if fingerprints_2 is None:
+        fingerprints_2 = fingerprint_partitions(partitions_2, workers)
+
+    for name in sorted(set(partitions_1) | set(partitions_2)):
+        known = fingerprints_1.get(name)
+        if name in partitions_1 and name in partitions_2 and known and known == fingerprints_2.get(name):
+            continue
+        records_1 = partitions_1[name]() if name in partitions_1 else []
+        records_2 = partitions_2[name]() if name in partitions_2 else []
+        for change, record in diff_dictsets(records_1, records_2):
+            yield name, change, record
 
 
 def generator_chunker(
-        generator: Iterator,
+        generator: Iterable,
         chunk_size: int) -> Iterator:
     chunk: list = []
     for item in generator:
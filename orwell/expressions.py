@@ -0,0 +1,468 @@
+"""
+Expressions
+
+A small language for filter conditions. Unlike a lambda, an expression
+can be inspected - the Reader uses the columns and values in it to build
+a prefilter for the raw lines and to skip partitions using manifests -
+and it can be applied to batches of columns as well as to records.
+
+Expressions can be built from conditions:
+
+    expression = Condition('status', '==', 500) & ('latency', '>', 2.0)
+
+or parsed from a string:
+
+    expression = parse("status == 500 and (latency > 2.0 or user in ('bob', 'alice'))")
+
+The operators are ==, !=, <, <=, >, >=, in and not in; conditions are
+combined with and, or and not (&, | and ~ when building them in code).
+Comparisons with missing or null values, or with values of a different
+type, are False rather than errors - except for != which is True.
+
+Expressions are callable, so can be used anywhere a 'where' function can:
+
+    Reader(from_path='logs', where="status == 500")
+    select_from_dictset(dictset, condition=expression)
+
+Column names which aren't identifiers can be written in backticks.
+"""
+import re
+import ast
+import operator
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+try:
+    import numpy  # type:ignore
+except ImportError:
+    numpy = None  # type:ignore
+
+COMPARISONS: Dict[str, Callable] = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda value, values: value in values,
+    'not in': lambda value, values: value not in values
+}
+
+
+class Expression():
+    """
+    The base for conditions and the combinations of them.
+    """
+    _compiled: Optional[Callable] = None
+
+    def __and__(self, other: Any) -> 'Expression':
+        return And([self, to_expression(other)])
+
+    def __rand__(self, other: Any) -> 'Expression':
+        return And([to_expression(other), self])
+
+    def __or__(self, other: Any) -> 'Expression':
+        return Or([self, to_expression(other)])
+
+    def __ror__(self, other: Any) -> 'Expression':
+        return Or([to_expression(other), self])
+
+    def __invert__(self) -> 'Expression':
+        return Not(self)
+
+    def __call__(self, record: dict) -> bool:
+        if self._compiled is None:
+            self._compiled = self.compile()
+        return self._compiled(record)
+
+    def __getstate__(self):
+        # compiled functions can't be pickled, they're recreated when needed
+        state = dict(self.__dict__)
+        state.pop('_compiled', None)
+        return state
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Expression) and repr(self) == repr(other)
+
+    def __hash__(self):
+        return hash(repr(self))
+
+    def compile(self) -> Callable[[dict], bool]:
+        """ a function which tests a record """
+        raise NotImplementedError()
+
+    def mask(self, columns: Any) -> Any:
+        """
+        Tests a batch of records held as a dictionary of columns (see
+        Reader.iter_batches) or a ColumnBatch, returns a list of booleans,
+        one per record, or a NumPy array if the columns are NumPy arrays.
+        """
+        raise NotImplementedError()
+
+    def columns(self) -> set:
+        """ the columns the expression uses """
+        raise NotImplementedError()
+
+    def literals(self) -> list:
+        """ the values the expression compares columns to """
+        raise NotImplementedError()
+
+    def conditions(self) -> List[Tuple[str, str, Any]]:
+        """
+        The conditions which must all be true for the expression to be
+        true, in the form used to test partition manifests.
+        """
+        return []
+
+    def equalities(self) -> dict:
+        """
+        The columns which must have a specific value for the expression to
+        be true, in the form used to build a prefilter.
+        """
+        return {column: value for column, op, value in self.conditions() if op == '=='}
+
+
+class Condition(Expression):
+
+    def __init__(self, column: str, op: str, value: Any):
+        if op not in COMPARISONS:
+            raise ValueError(F"Unknown operator '{op}'")
+        if op in ('in', 'not in'):
+            if not isinstance(value, (list, tuple, set, frozenset)):
+                raise ValueError(F"'{op}' must be used with a list of values")
+            value = tuple(value)
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def compile(self) -> Callable[[dict], bool]:
+        column, value = self.column, self.value
+        if self.op == '==':
+            return lambda record: record.get(column) == value
+        if self.op == '!=':
+            return lambda record: record.get(column) != value
+        compare = COMPARISONS[self.op]
+        if self.op in ('in', 'not in'):
+            try:
+                value = frozenset(value)
+            except TypeError:  # unhashable values, keep the tuple
+                pass
+
+        def _compare(record: dict) -> bool:
+            try:
+                return compare(record.get(column), value)
+            except TypeError:
+                return False
+
+        return _compare
+
+    def mask(self, columns: Any) -> Any:
+        values = columns.get(self.column)
+        if values is None:
+            values = [None] * _batch_length(columns)
+        result: Any = None
+        if numpy is not None and isinstance(values, numpy.ndarray) and values.dtype.kind in 'biuf':
+            # numeric columns compared to numbers can be tested in one step
+            if self.op in ('in', 'not in'):
+                if all(isinstance(value, (int, float)) for value in self.value):
+                    result = numpy.isin(values, self.value, invert=self.op == 'not in')
+            elif isinstance(self.value, (int, float)):
+                result = numpy.asarray(COMPARISONS[self.op](values, self.value), dtype=bool)
+        test = self.compile()
+        if result is None:
+            column = self.column
+            result = [test({column: value}) for value in values]
+        # ColumnBatches hold nulls separately from the values
+        nulls = getattr(columns, 'nulls', {}).get(self.column)
+        if nulls is not None:
+            result = numpy.asarray(result, dtype=bool)
+            result[nulls] = test({})
+        return result
+
+    def columns(self) -> set:
+        return {self.column}
+
+    def literals(self) -> list:
+        if self.op in ('in', 'not in'):
+            return list(self.value)
+        return [self.value]
+
+    def conditions(self) -> List[Tuple[str, str, Any]]:
+        if self.op in ('in', 'not in'):
+            return []
+        return [(self.column, self.op, self.value)]
+
+    def __repr__(self) -> str:
+        return F'{_format_column(self.column)} {self.op} {_format_value(self.value)}'
+
+
+class And(Expression):
+
+    def __init__(self, parts: List[Expression]):
+        # flatten nested ands, so they're tested in a single loop
+        self.parts: List[Expression] = []
+        for part in parts:
+            self.parts.extend(part.parts if isinstance(part, And) else [part])
+
+    def compile(self) -> Callable[[dict], bool]:
+        tests = [part.compile() for part in self.parts]
+        if len(tests) == 2:
+            first, second = tests
+            return lambda record: first(record) and second(record)
+
+        def _all(record: dict) -> bool:
+            for test in tests:
+                if not test(record):
+                    return False
+            return True
+
+        return _all
+
+    def mask(self, columns: Any) -> Any:
+        masks = [part.mask(columns) for part in self.parts]
+        if numpy is not None and all(isinstance(mask, numpy.ndarray) for mask in masks):
+            return numpy.logical_and.reduce(masks)
+        return [all(values) for values in zip(*masks)]
+
+    def columns(self) -> set:
+        return set().union(*(part.columns() for part in self.parts))
+
+    def literals(self) -> list:
+        return [literal for part in self.parts for literal in part.literals()]
+
+    def conditions(self) -> List[Tuple[str, str, Any]]:
+        return [condition for part in self.parts for condition in part.conditions()]
+
+    def __repr__(self) -> str:
+        return ' and '.join(F'({part!r})' if isinstance(part, Or) else repr(part) for part in self.parts)
+
+
+class Or(Expression):
+
+    def __init__(self, parts: List[Expression]):
+        self.parts: List[Expression] = []
+        for part in parts:
+            self.parts.extend(part.parts if isinstance(part, Or) else [part])
+
+    def compile(self) -> Callable[[dict], bool]:
+        tests = [part.compile() for part in self.parts]
+        if len(tests) == 2:
+            first, second = tests
+            return lambda record: first(record) or second(record)
+
+        def _any(record: dict) -> bool:
+            for test in tests:
+                if test(record):
+                    return True
+            return False
+
+        return _any
+
+    def mask(self, columns: Any) -> Any:
+        masks = [part.mask(columns) for part in self.parts]
+        if numpy is not None and all(isinstance(mask, numpy.ndarray) for mask in masks):
+            return numpy.logical_or.reduce(masks)
+        return [any(values) for values in zip(*masks)]
+
+    def columns(self) -> set:
+        return set().union(*(part.columns() for part in self.parts))
+
+    def literals(self) -> list:
+        return [literal for part in self.parts for literal in part.literals()]
+
+    def __repr__(self) -> str:
+        return ' or '.join(repr(part) for part in self.parts)
+
+
+class Not(Expression):
+
+    def __init__(self, part: Expression):
+        self.part = part
+
+    def compile(self) -> Callable[[dict], bool]:
+        test = self.part.compile()
+        return lambda record: not test(record)
+
+    def mask(self, columns: Any) -> Any:
+        mask = self.part.mask(columns)
+        if numpy is not None and isinstance(mask, numpy.ndarray):
+            return ~mask
+        return [not value for value in mask]
+
+    def columns(self) -> set:
+        return self.part.columns()
+
+    def literals(self) -> list:
+        return self.part.literals()
+
+    def __repr__(self) -> str:
+        if isinstance(self.part, Condition):
+            return F'not {self.part!r}'
+        return F'not ({self.part!r})'
+
+
+def _batch_length(columns: Any) -> int:
+    if hasattr(columns, 'nulls'):
+        return len(columns)
+    for values in columns.values():
+        return len(values)
+    return 0
+
+
+def _format_column(column: str) -> str:
+    if re.fullmatch(r'[A-Za-z_][\w.]*', column) and column not in _KEYWORDS:
+        return column
+    return F'`{column}`'
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, tuple):
+        return '(' + ', '.join(_format_value(item) for item in value) + (',)' if len(value) == 1 else ')')
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return repr(value)
+
+
+def to_expression(value: Union[Expression, str, tuple, dict, list]) -> Expression:
+    """
+    Creates an expression from a string, a (column, operator, value)
+    tuple, a list of tuples (which must all be true) or a dictionary of
+    columns and values.
+    """
+    if isinstance(value, Expression):
+        return value
+    if isinstance(value, str):
+        return parse(value)
+    if isinstance(value, tuple) and len(value) == 3:
+        return Condition(*value)
+    if isinstance(value, dict):
+        value = [(column, '==', item) for column, item in value.items()]
+    if isinstance(value, list) and value:
+        parts = [to_expression(item) for item in value]
+        return parts[0] if len(parts) == 1 else And(parts)
+    raise ValueError(F'Unable to create an expression from {value!r}')
+
+
+"""
+Parser
+
+expression := term ('or' term)*
+term       := factor ('and' factor)*
+factor     := 'not' factor | '(' expression ')' | column operator value
+"""
+_KEYWORDS = {'and', 'or', 'not', 'in', 'null', 'none', 'true', 'false'}
+_TOKENS = re.compile(r'''
+    \s*(?:
+        (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|
+        (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|
+        (?P<operator>==|!=|<=|>=|<|>|&|\||~|\(|\)|\[|\]|,)|
+        (?P<quoted>`[^`]+`)|
+        (?P<word>[A-Za-z_][\w.]*)|
+        (?P<error>\S)
+    )''', re.VERBOSE)
+_WORDS = {'&': 'and', '|': 'or', '~': 'not'}
+_CONSTANTS = {'null': None, 'none': None, 'true': True, 'false': False}
+
+
+def _tokenize(text: str) -> List[Tuple[str, Any]]:
+    tokens: List[Tuple[str, Any]] = []
+    for match in _TOKENS.finditer(text):
+        kind = match.lastgroup
+        token = match.group(kind)  # type:ignore
+        if kind == 'error':
+            raise ValueError(F"Unexpected '{token}' in expression: {text}")
+        if kind in ('string', 'number'):
+            tokens.append(('value', ast.literal_eval(token)))
+        elif kind == 'quoted':
+            tokens.append(('column', token[1:-1]))
+        elif kind == 'word' and token.lower() in _CONSTANTS:
+            tokens.append(('value', _CONSTANTS[token.lower()]))
+        elif kind == 'word' and token.lower() in _KEYWORDS:
+            tokens.append(('keyword', token.lower()))
+        elif kind == 'word':
+            tokens.append(('column', token))
+        elif token in _WORDS:
+            tokens.append(('keyword', _WORDS[token]))
+        else:
+            tokens.append(('operator', token))
+    return tokens
+
+
+class _Parser():
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def peek(self) -> Tuple[Optional[str], Any]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, kind: Optional[str] = None, token: Any = None) -> Any:
+        found_kind, found = self.peek()
+        if found_kind is None or (kind and found_kind != kind) or (token is not None and found != token):
+            expected = token or kind or 'more'
+            raise ValueError(F"Expected {expected} but found '{found}' in expression: {self.text}")
+        self.position += 1
+        return found
+
+    def expression(self) -> Expression:
+        parts = [self.term()]
+        while self.peek() == ('keyword', 'or'):
+            self.take()
+            parts.append(self.term())
+        return parts[0] if len(parts) == 1 else Or(parts)
+
+    def term(self) -> Expression:
+        parts = [self.factor()]
+        while self.peek() == ('keyword', 'and'):
+            self.take()
+            parts.append(self.factor())
+        return parts[0] if len(parts) == 1 else And(parts)
+
+    def factor(self) -> Expression:
+        if self.peek() == ('keyword', 'not'):
+            self.take()
+            return Not(self.factor())
+        if self.peek() == ('operator', '('):
+            self.take()
+            expression = self.expression()
+            self.take('operator', ')')
+            return expression
+        column = self.take('column')
+        kind, op = self.peek()
+        if (kind, op) == ('keyword', 'not'):
+            self.take()
+            self.take('keyword', 'in')
+            return Condition(column, 'not in', self.values())
+        if (kind, op) == ('keyword', 'in'):
+            self.take()
+            return Condition(column, 'in', self.values())
+        op = self.take('operator')
+        if op not in COMPARISONS:
+            raise ValueError(F"Expected a comparison but found '{op}' in expression: {self.text}")
+        return Condition(column, op, self.take('value'))
+
+    def values(self) -> list:
+        opening = self.take('operator')
+        if opening not in ('(', '['):
+            raise ValueError(F"Expected a list of values but found '{opening}' in expression: {self.text}")
+        closing = ')' if opening == '(' else ']'
+        values = []
+        while self.peek() != ('operator', closing):
+            values.append(self.take('value'))
+            if self.peek() == ('operator', ','):
+                self.take()
+        self.take('operator', closing)
+        return values
+
+
+def parse(text: str) -> Expression:
+    """ creates an expression from a string """
+    parser = _Parser(text)
+    expression = parser.expression()
+    if parser.peek()[0] is not None:
+        raise ValueError(F"Unexpected '{parser.peek()[1]}' in expression: {text}")
+    return expression
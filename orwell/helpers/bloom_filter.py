@@ -0,0 +1,85 @@
+"""
+Bloom Filter
+
+A fixed size, probabilistic set membership test. A Bloom filter can
+say a value is definitely not in the set, or that it probably is; the
+rate of false positives is set when the filter is created.
+
+Values are hashed with blake2b so the filter gives the same answers
+in every process and can be saved and reloaded.
+"""
+import math
+import base64
+import hashlib
+import json
+from typing import Any
+
+
+def _value_to_bytes(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, float) and value.is_integer():
+        # 1.0 == 1, so they should hash the same
+        value = int(value)
+    return json.dumps(value, sort_keys=True, default=str).encode()
+
+
+class BloomFilter():
+
+    def __init__(
+            self,
+            capacity: int = 10000,
+            false_positive_rate: float = 0.01):
+        """
+        Parameters:
+        - capacity: the number of values the filter is sized to hold
+        - false_positive_rate: the probability of a false positive when
+          the filter holds 'capacity' values
+        """
+        capacity = max(1, capacity)
+        self.size = math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: Any):
+        digest = hashlib.blake2b(_value_to_bytes(value), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value: Any) -> bool:
+        """
+        Adds a value to the filter, returns True if the value was probably
+        already in the filter.
+        """
+        present = True
+        bits = self.bits
+        for position in self._positions(value):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                present = False
+                bits[position >> 3] |= mask
+        return present
+
+    def __contains__(self, value: Any) -> bool:
+        for position in self._positions(value):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            "size": self.size,
+            "hashes": self.hashes,
+            "bits": base64.b64encode(self.bits).decode()
+        }
+
+    @staticmethod
+    def from_dict(dictionary: dict):
+        bloom_filter = BloomFilter.__new__(BloomFilter)
+        bloom_filter.size = dictionary['size']
+        bloom_filter.hashes = dictionary['hashes']
+        bloom_filter.bits = bytearray(base64.b64decode(dictionary['bits']))
+        return bloom_filter
@@ -0,0 +1,74 @@
+"""
+Helpers for turning a stream of chunks of bytes, such as ranged downloads
+or file reads, into a stream of lines.
+"""
+import lzma
+from typing import Iterable, Iterator, Optional
+
+
+def lzma_decompress(
+        chunks: Iterator[bytes],
+        max_length: int = 16*1024*1024) -> Iterator[bytes]:
+    """
+    Decompresses a stream of LZMA compressed chunks, chunk by chunk.
+
+    No more than 'max_length' bytes are decompressed at a time, so memory
+    is bounded regardless of how well the data compressed. Concatenated
+    streams are decompressed one after the other.
+    """
+    decompressor = lzma.LZMADecompressor()
+    started = False
+    for data in chunks:
+        while True:
+            if decompressor.eof:
+                if not data:
+                    break
+                decompressor = lzma.LZMADecompressor()
+            started = True
+            output = decompressor.decompress(data, max_length)
+            if output:
+                yield output
+            data = decompressor.unused_data if decompressor.eof else b''
+            if not decompressor.eof and decompressor.needs_input:
+                break
+    if started and not decompressor.eof:
+        raise EOFError('Compressed data ended before the end-of-stream marker was reached')
+
+
+def chunks_to_lines(
+        chunks: Iterator[bytes],
+        delimiter: bytes = b'\n') -> Iterator[bytes]:
+    """
+    Splits a stream of chunks into lines, the incomplete line at the end
+    of each chunk is carried forward to the start of the next one.
+    """
+    carry_forward = b''
+    for chunk in chunks:
+        lines = (carry_forward + chunk).split(delimiter)
+        carry_forward = lines.pop()
+        yield from lines
+    if carry_forward:
+        yield carry_forward
+
+
+def track_offsets(
+        lines: Iterable[bytes],
+        cursor: Optional[dict] = None,
+        delimiter_length: int = 1,
+        start: int = 0,
+        skip_to: int = 0) -> Iterator[bytes]:
+    """
+    Records the offset of the line after the one being returned in the
+    cursor, so reading can be resumed from that point.
+
+    'start' is the offset of the first line, for streams which can't be
+    seeked (e.g. compressed) the lines before 'skip_to' are skipped.
+    """
+    position = start
+    for line in lines:
+        position += len(line) + delimiter_length
+        if position <= skip_to:
+            continue
+        if cursor is not None:
+            cursor['offset'] = position
+        yield line
@@ -0,0 +1,182 @@
+"""
+Partition Manifests
+
+A manifest is a small JSON file saved alongside a partition which
+describes what is in it: the number of records, the size of the
+partition and, for selected fields, the minimum and maximum values
+and the number of nulls (a zone map). Fields can also have a Bloom
+filter of their values. The manifest also has the fingerprint of the
+records (see dictset.fingerprint), so datasets can be compared without
+being read.
+
+Readers can test a manifest against a set of conditions and skip
+partitions which can't contain matching records. Conditions are a
+list of (field, operator, value) tuples which must all be true, the
+operators are ==, !=, <, <=, > and >=.
+
+    [('timestamp', '>=', '2021-03-01T00:00'), ('user', '==', 'bob')]
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .bloom_filter import BloomFilter, _value_to_bytes
+from ..dictset import _fingerprint_record, combine_fingerprints, FINGERPRINT_MODULUS
+
+MANIFEST_SUFFIX = '.manifest'
+
+
+def _kind(value: Any) -> Optional[str]:
+    """ values can only be compared to values of the same kind """
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    return None
+
+
+class _FieldStatistics():
+
+    def __init__(self):
+        self.minimum: Any = None
+        self.maximum: Any = None
+        self.nulls = 0
+        self.kind: Optional[str] = None
+        self.comparable = True
+
+    def add(self, value: Any):
+        if value is None:
+            self.nulls += 1
+            return
+        if not self.comparable:
+            return
+        kind = _kind(value)
+        if kind is None or (self.kind and kind != self.kind):
+            self.comparable = False
+            self.minimum = self.maximum = None
+            return
+        if self.kind is None:
+            self.kind = kind
+            self.minimum = self.maximum = value
+        elif value < self.minimum:
+            self.minimum = value
+        elif value > self.maximum:
+            self.maximum = value
+
+    def to_dict(self) -> dict:
+        statistics: Dict[str, Any] = {"nulls": self.nulls}
+        if self.comparable and self.kind:
+            statistics["min"] = self.minimum
+            statistics["max"] = self.maximum
+        return statistics
+
+
+class ManifestBuilder():
+    """
+    Collects the statistics for a partition as records are written to it.
+    """
+    def __init__(
+            self,
+            fields: Optional[List[str]] = None,
+            bloom_fields: Optional[List[str]] = None,
+            false_positive_rate: float = 0.01):
+        self.records = 0
+        self.bytes = 0
+        self.fingerprint = 0
+        self.fields = {field: _FieldStatistics() for field in fields or []}
+        self.bloom_values: Dict[str, set] = {field: set() for field in bloom_fields or []}
+        self.false_positive_rate = false_positive_rate
+
+    def add(self, record: dict, size: int = 0, fingerprint: Optional[int] = None):
+        """ 'fingerprint' is the record's fingerprint, if already known """
+        self.records += 1
+        self.bytes += size
+        self.fingerprint += _fingerprint_record(record) if fingerprint is None else fingerprint
+        for field, statistics in self.fields.items():
+            statistics.add(record.get(field))
+        for field, values in self.bloom_values.items():
+            value = record.get(field)
+            if value is not None:
+                values.add(_value_to_bytes(value))
+
+    def to_dict(self) -> dict:
+        manifest: Dict[str, Any] = {
+            "records": self.records,
+            "bytes": self.bytes,
+            "fingerprint": format(self.fingerprint % FINGERPRINT_MODULUS, '032x'),
+            "fields": {field: statistics.to_dict() for field, statistics in self.fields.items()}
+        }
+        if self.bloom_values:
+            blooms = {}
+            for field, values in self.bloom_values.items():
+                bloom_filter = BloomFilter(capacity=len(values), false_positive_rate=self.false_positive_rate)
+                for value in values:
+                    bloom_filter.add(value)
+                blooms[field] = bloom_filter.to_dict()
+            manifest["bloom"] = blooms
+        return manifest
+
+
+def _condition_may_match(manifest: dict, condition: Tuple[str, str, Any]) -> bool:
+    field, operator, value = condition
+    statistics = manifest.get('fields', {}).get(field)
+    records = manifest.get('records', 0)
+
+    if statistics is not None:
+        nulls = statistics.get('nulls', 0)
+        if value is None:
+            if operator == '==':
+                return nulls > 0
+            if operator == '!=':
+                return nulls < records
+            return True
+        # every value is null, only != can match
+        if nulls == records and operator != '!=':
+            return False
+
+        minimum = statistics.get('min')
+        maximum = statistics.get('max')
+        if minimum is not None and _kind(value) == _kind(minimum):
+            if operator == '==' and (value < minimum or value > maximum):
+                return False
+            if operator == '!=' and minimum == maximum == value and nulls == 0:
+                return False
+            if operator == '<' and not minimum < value:
+                return False
+            if operator == '<=' and not minimum <= value:
+                return False
+            if operator == '>' and not maximum > value:
+                return False
+            if operator == '>=' and not maximum >= value:
+                return False
+
+    # True == 1 and False == 0 but they are hashed differently, so the
+    # filter can't be used for them
+    bloom = manifest.get('bloom', {}).get(field)
+    if bloom and operator == '==' and value is not None and not (isinstance(value, bool) or value in (0, 1)):
+        return value in BloomFilter.from_dict(bloom)
+
+    return True
+
+
+def partition_fingerprint(manifests: Iterable[dict]) -> Optional[str]:
+    """
+    The fingerprint of a partition from the manifests of its files, to
+    use with dictset.diff_partitions. None if a manifest doesn't have a
+    fingerprint.
+    """
+    fingerprints: List[str] = []
+    for manifest in manifests:
+        if manifest.get('fingerprint') is None:
+            return None
+        fingerprints.append(manifest['fingerprint'])
+    return combine_fingerprints(fingerprints)
+
+
+def manifest_may_match(
+        manifest: dict,
+        conditions: List[Tuple[str, str, Any]]) -> bool:
+    """
+    Tests if a partition may contain records matching all of the
+    conditions, False means the partition can be skipped.
+    """
+    return all(_condition_may_match(manifest, condition) for condition in conditions)
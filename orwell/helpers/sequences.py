@@ -0,0 +1,57 @@
+"""
+Sequences
+
+Partitions are named with a sequence number, 'data-0000.jsonl',
+'data-0001.jsonl' and so on. Checking each name in turn to find one which
+hasn't been used needs a call to the storage for every partition which has
+already been written, the sequences are found by listing the partitions
+once and are then counted in memory.
+
+Other processes may be writing to the same path, so the writers still
+create the partitions in a way which fails if the name has been used
+(rather than overwriting it); when it fails, the sequence is forgotten so
+it is found again by listing the partitions.
+"""
+import re
+import threading
+from typing import Callable, Dict, Iterable, Tuple
+
+
+def highest_sequence(names: Iterable[str], prefix: str, suffix: str) -> int:
+    """
+    The highest sequence number in names of the form prefix + number +
+    suffix, -1 if there aren't any
+    """
+    pattern = re.compile(re.escape(prefix) + r'(\d+)' + re.escape(suffix) + '$')
+    highest = -1
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            highest = max(highest, int(match.group(1)))
+    return highest
+
+
+class SequenceCache():
+
+    def __init__(self):
+        self._sequences: Dict[Tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def next(self, key: Tuple, find_highest: Callable[[], int]) -> int:
+        """
+        The next sequence number for a key, 'find_highest' is called to
+        find the highest sequence used the first time the key is seen.
+        """
+        with self._lock:
+            if key not in self._sequences:
+                self._sequences[key] = find_highest()
+            self._sequences[key] += 1
+            return self._sequences[key]
+
+    def forget(self, key: Tuple):
+        with self._lock:
+            self._sequences.pop(key, None)
+
+    def reset(self):
+        with self._lock:
+            self._sequences.clear()
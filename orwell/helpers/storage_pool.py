@@ -0,0 +1,63 @@
+"""
+Storage Pool
+
+Creating a GCS client and looking up a bucket are both slow, and were
+being done for every day and every blob read or written. The pool
+creates a client per project and a bucket reference per bucket the
+first time they're needed and reuses them after that.
+
+Bucket references are created without a metadata call - the bucket is
+only contacted when it is used.
+
+A stand-in client (for example, for testing) can be registered for a
+project:
+
+    StoragePool.set_client('project', local_client)
+"""
+import threading
+from typing import Any, Dict, Tuple
+try:
+    from google.cloud import storage  # type:ignore
+except ImportError:
+    pass
+
+
+class StoragePool():
+
+    _clients: Dict[str, Any] = {}
+    _buckets: Dict[Tuple[str, str], Any] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_client(project: str):
+        with StoragePool._lock:
+            client = StoragePool._clients.get(project)
+            if client is None:
+                client = storage.Client(project=project)
+                StoragePool._clients[project] = client
+            return client
+
+    @staticmethod
+    def get_bucket(project: str, bucket: str):
+        client = StoragePool.get_client(project)
+        with StoragePool._lock:
+            gcs_bucket = StoragePool._buckets.get((project, bucket))
+            if gcs_bucket is None:
+                gcs_bucket = client.bucket(bucket)
+                StoragePool._buckets[(project, bucket)] = gcs_bucket
+            return gcs_bucket
+
+    @staticmethod
+    def set_client(project: str, client: Any):
+        """ use a specific client for a project """
+        with StoragePool._lock:
+            StoragePool._clients[project] = client
+            for key in [key for key in StoragePool._buckets if key[0] == project]:
+                del StoragePool._buckets[key]
+
+    @staticmethod
+    def reset():
+        """ forget all of the clients and buckets """
+        with StoragePool._lock:
+            StoragePool._clients.clear()
+            StoragePool._buckets.clear()
@@ -0,0 +1,224 @@
+"""
+INDEX
+
+An index of a dictset on a column, for looking up records by their value
+in that column. Unlike create_index, which keeps the last record for each
+value in a dictionary, an Index:
+
+- keeps every record for each value
+- keeps the values sorted, so can look up ranges of values and strings
+  starting with a prefix
+- can be saved to a file and reopened without reading the records again,
+  the file is memory-mapped so only the parts which are used are read
+
+    index = Index.build(Reader(from_path='reference/users'), 'user_id')
+    index.get('bob')                  # the records for 'bob'
+    index.range(100, 200)             # the records with values 100 to 200
+    index.prefix('bo')                # the records with values starting 'bo'
+    index.save('users.index')
+
+    index = Index.open('users.index')
+
+build_file writes the index file directly, using an external sort, so the
+index can be larger than memory.
+
+Values are sorted as sort_dictset sorts them - numbers, then strings, then
+other values. Records with a null value aren't indexed.
+
+The file is a header, the offsets of the values and records, and the
+values and records as JSON. The offsets are written in the byte order of
+the machine writing the file.
+"""
+import os
+import bisect
+import mmap
+import shutil
+import struct
+from array import array
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+from .dictset import sort_dictset, json_parser, _serialize, _sort_value, _spill_file
+
+MAGIC = b'ORWLIDX1'
+_HEADER = struct.Struct('<8sQQQQ')  # magic, count, values start, records start, offsets start
+
+
+class Index():
+
+    def __init__(self):
+        """
+        Use Index.build, Index.build_file or Index.open to create an Index.
+        """
+        self._count = 0
+        self._values: List[Any] = []
+        self._sort_values: Optional[List[Tuple[int, Any]]] = None
+        self._records: List[dict] = []
+        self._file: Any = None
+        self._map: Any = None
+        self._value_offsets: Any = None
+        self._record_offsets: Any = None
+        self._values_start = 0
+        self._records_start = 0
+
+    @staticmethod
+    def build(dictset: Iterable[dict], column: str) -> 'Index':
+        """ builds an index in memory """
+        entries = [(_sort_value(record.get(column)), record.get(column), record)
+                   for record in dictset if record.get(column) is not None]
+        entries.sort(key=lambda entry: entry[0])
+        index = Index()
+        index._count = len(entries)
+        index._sort_values = [entry[0] for entry in entries]
+        index._values = [entry[1] for entry in entries]
+        index._records = [entry[2] for entry in entries]
+        return index
+
+    @staticmethod
+    def build_file(
+            dictset: Iterable[dict],
+            column: str,
+            path: str,
+            memory_limit: int = 256*1024*1024) -> 'Index':
+        """
+        Writes an index to a file without holding the records in memory,
+        the records are sorted with sort_dictset, and opens it.
+        """
+        records = (record for record in dictset if record.get(column) is not None)
+        sorted_records = sort_dictset(records, column, memory_limit=memory_limit)
+        _write_index(((record[column], record) for record in sorted_records), path)
+        return Index.open(path)
+
+    def save(self, path: str):
+        _write_index(((self._value(i), self._record(i)) for i in range(self._count)), path)
+
+    @staticmethod
+    def open(path: str) -> 'Index':
+        """ opens a saved index, the file is memory-mapped rather than read """
+        index = Index()
+        index._file = open(path, 'rb')
+        index._map = mmap.mmap(index._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, values_start, records_start, offsets_start = _HEADER.unpack_from(index._map, 0)
+        if magic != MAGIC:
+            index.close()
+            raise ValueError(F"'{path}' is not an index file")
+        index._count = count
+        index._values_start = values_start
+        index._records_start = records_start
+        view = memoryview(index._map)
+        size = (count + 1) * 8
+        index._value_offsets = view[offsets_start:offsets_start + size].cast('Q')
+        index._record_offsets = view[offsets_start + size:offsets_start + 2 * size].cast('Q')
+        return index
+
+    def close(self):
+        if self._map is not None:
+            self._value_offsets.release()
+            self._record_offsets.release()
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _value(self, position: int) -> Any:
+        if self._map is None:
+            return self._values[position]
+        start = self._values_start + self._value_offsets[position]
+        end = self._values_start + self._value_offsets[position + 1]
+        return json_parser(self._map[start:end])
+
+    def _record(self, position: int) -> dict:
+        if self._map is None:
+            return self._records[position]
+        start = self._records_start + self._record_offsets[position]
+        end = self._records_start + self._record_offsets[position + 1]
+        return json_parser(self._map[start:end])
+
+    def _bisect(self, value: Any, right: bool = False) -> int:
+        """ the position of a value, as bisect_left (or bisect_right) """
+        target = _sort_value(value)
+        if self._sort_values is not None:
+            if right:
+                return bisect.bisect_right(self._sort_values, target)
+            return bisect.bisect_left(self._sort_values, target)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            found = _sort_value(self._value(middle))
+            if found < target or (right and found == target):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, value: Any) -> List[dict]:
+        """ the records with a value, in the order they were indexed """
+        start = self._bisect(value)
+        end = self._bisect(value, right=True)
+        return [self._record(position) for position in range(start, end)]
+
+    def __contains__(self, value: Any) -> bool:
+        position = self._bisect(value)
+        return position < self._count and _sort_value(self._value(position)) == _sort_value(value)
+
+    def range(
+            self,
+            low: Any = None,
+            high: Any = None,
+            include_low: bool = True,
+            include_high: bool = True) -> Iterator[dict]:
+        """
+        The records with values between 'low' and 'high', in value order.
+        If 'low' or 'high' aren't set the range is open at that end.
+        """
+        start = 0 if low is None else self._bisect(low, right=not include_low)
+        end = self._count if high is None else self._bisect(high, right=include_high)
+        for position in range(start, end):
+            yield self._record(position)
+
+    def prefix(self, prefix: str) -> Iterator[dict]:
+        """ the records with string values starting with 'prefix' """
+        for position in range(self._bisect(prefix), self._count):
+            value = self._value(position)
+            if not isinstance(value, str) or not value.startswith(prefix):
+                return
+            yield self._record(position)
+
+
+def _write_index(entries: Iterator[Tuple[Any, dict]], path: str):
+    """
+    Writes sorted (value, record) pairs to an index file. The values and
+    records are written to temporary files first, as the offsets, which
+    are written before them, aren't known until they've all been written.
+    """
+    value_offsets = array('Q', [0])
+    record_offsets = array('Q', [0])
+    with _spill_file() as values_file, _spill_file() as records_file:
+        for value, record in entries:
+            serialized_value = _serialize(value)
+            serialized_record = _serialize(record)
+            values_file.write(serialized_value)
+            records_file.write(serialized_record)
+            value_offsets.append(value_offsets[-1] + len(serialized_value))
+            record_offsets.append(record_offsets[-1] + len(serialized_record))
+
+        count = len(value_offsets) - 1
+        offsets_start = _HEADER.size
+        values_start = offsets_start + 16 * (count + 1)
+        records_start = values_start + value_offsets[-1]
+        temporary_path = path + '.partial'
+        with open(temporary_path, 'wb') as index_file:
+            index_file.write(_HEADER.pack(MAGIC, count, values_start, records_start, offsets_start))
+            index_file.write(value_offsets.tobytes())
+            index_file.write(record_offsets.tobytes())
+            for spill_file in (values_file, records_file):
+                spill_file.seek(0)
+                shutil.copyfileobj(spill_file, index_file)
+        # replace any existing index in one step, so it's never half written
+        os.replace(temporary_path, path)
@@ -0,0 +1,430 @@
+"""
+Query
+
+Chaining the dictset functions builds a pipeline of generators, each
+stage only sees the records passed to it, so a limit at the end of the
+pipeline can't stop the reader early and a filter can't be applied
+before the records are changed by earlier stages.
+
+A Query describes the whole pipeline before anything is read:
+
+    query = (Query(from_path='logs', reader=file_reader)
+             .where({'status': 500})
+             .set_column('slow', lambda r: r['latency'] > 2, depends_on=['latency'])
+             .select(['user', 'slow'])
+             .limit(10))
+
+    for record in query:
+        print(record)
+
+Before the query runs, the plan is rewritten:
+
+- filters are moved toward the start of the pipeline, filters at the
+  start are run by the Reader and dictionary filters also prefilter the
+  raw lines before they are parsed
+- limits are moved toward the start, so reading stops as soon as enough
+  records have been found
+- when the columns a query uses are known, only those columns are kept
+  by the Reader, this stops at distincts and joins
+- consecutive filters, selects and set_columns are run in a single loop
+  rather than a generator each
+
+The optimizer can only move a filter or set_column when it knows which
+columns they use, dictionary filters declare their columns, functions
+can declare them with the 'columns' or 'depends_on' parameters.
+
+explain() describes the plan, explain(analyze=True) runs the query and
+includes the number of records from, and the time spent in, each step.
+"""
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+from .readers.reader import Reader, _accepts
+from .readers.blob_reader import blob_reader
+from .readers.prefilter import EqualityPredicate
+from .dictset import select_record_fields, set_value, distinct, join_dictsets, JOINS
+from .expressions import Expression, And, parse, to_expression
+
+
+class _AllOf():
+    """ a 'where' filter from a set of filters, all must be True """
+    def __init__(self, predicates: List[Callable]):
+        self.predicates = predicates
+
+    def __call__(self, record: dict) -> bool:
+        for predicate in self.predicates:
+            if not predicate(record):
+                return False
+        return True
+
+
+class _Operator():
+
+    def __init__(self, kind: str, **arguments):
+        self.kind = kind
+        self.arguments = arguments
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self.__dict__['arguments'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def describe(self) -> str:
+        if self.kind == 'where':
+            if self.conditions is not None:
+                return F'Filter({self.conditions})'
+            return F'Filter({getattr(self.predicate, "__name__", type(self.predicate).__name__)})'
+        if self.kind == 'select':
+            return F'Select({self.columns})'
+        if self.kind == 'set':
+            return F'SetColumn({self.name})'
+        if self.kind == 'distinct':
+            return F'Distinct({self.columns})'
+        if self.kind == 'limit':
+            return F'Limit({self.count})'
+        if self.kind == 'join':
+            return F'Join({self.join_type}, {self.column})'
+        return 'Fused[' + ', '.join(step.describe() for step in self.steps) + ']'
+
+
+class _Statistics():
+    """ the records returned by, and the time spent in, a step """
+    def __init__(self, description: str, children: List['_Statistics']):
+        self.description = description
+        self.children = children
+        self.records = 0
+        self.seconds = 0.0
+
+    def own_seconds(self) -> float:
+        return self.seconds - sum(child.seconds for child in self.children)
+
+
+def _measure(records: Iterable[dict], statistics: _Statistics) -> Iterator[dict]:
+    records = iter(records)
+    while True:
+        start = time.perf_counter()
+        try:
+            record = next(records)
+        except StopIteration:
+            statistics.seconds += time.perf_counter() - start
+            return
+        statistics.seconds += time.perf_counter() - start
+        statistics.records += 1
+        yield record
+
+
+def _step_function(operator: _Operator) -> Callable[[dict], Optional[dict]]:
+    """ a fusable step as a function which returns None to drop a record """
+    if operator.kind == 'where':
+        predicate = operator.predicate
+        return lambda record: record if predicate(record) else None
+    if operator.kind == 'select':
+        columns = operator.columns
+        return lambda record: select_record_fields(record, columns)
+    name, setter = operator.name, operator.setter
+    return lambda record: set_value(record, name, setter)
+
+
+def _fused(records: Iterable[dict], steps: List[Callable]) -> Iterator[dict]:
+    for record in records:
+        for step in steps:
+            record = step(record)
+            if record is None:
+                break
+        else:
+            yield record
+
+
+def _limit(records: Iterable[dict], count: int) -> Iterator[dict]:
+    if count <= 0:
+        return
+    for record in records:
+        yield record
+        count -= 1
+        if count == 0:
+            return
+
+
+def _can_swap(operator: _Operator, previous: _Operator) -> bool:
+    """ can 'operator' be run before 'previous' without changing the result """
+    if operator.kind == 'where':
+        columns = operator.columns
+        if previous.kind == 'set':
+            return columns is not None and previous.name not in columns
+        if previous.kind == 'select':
+            return columns is not None and columns <= set(previous.columns)
+        if previous.kind == 'distinct':
+            return previous.columns == ['*']
+    if operator.kind == 'limit':
+        return previous.kind in ('set', 'select')
+    return False
+
+
+class Query():
+
+    def __init__(self, **kwargs):
+        """
+        A lazy query over a Reader, 'kwargs' are the parameters for the
+        Reader. 'where', 'select' and 'limit' parameters are treated as if
+        they were the first steps of the query.
+        """
+        self.operators: List[_Operator] = []
+        where = kwargs.pop('where', None)
+        select = kwargs.pop('select', ['*'])
+        limit = kwargs.pop('limit', -1)
+        self.reader_arguments = kwargs
+        if where is not None:
+            self.operators.append(self._where_operator(where, None))
+        if select != ['*']:
+            self.operators.append(_Operator('select', columns=list(select)))
+        if limit >= 0:
+            self.operators.append(_Operator('limit', count=limit))
+
+    def _extend(self, operator: _Operator) -> 'Query':
+        query = Query.__new__(Query)
+        query.reader_arguments = self.reader_arguments
+        query.operators = self.operators + [operator]
+        return query
+
+    @staticmethod
+    def _where_operator(condition: Union[Callable, dict, str], columns: Optional[List[str]]) -> _Operator:
+        if isinstance(condition, dict):
+            return _Operator('where', predicate=EqualityPredicate(condition),
+                             conditions=dict(condition), columns=set(condition))
+        if isinstance(condition, str):
+            condition = parse(condition)
+        if isinstance(condition, Expression):
+            return _Operator('where', predicate=condition, conditions=None, columns=condition.columns())
+        return _Operator('where', predicate=condition, conditions=None,
+                         columns=set(columns) if columns is not None else None)
+
+    """
+    Fluent API
+
+    Each method returns a new Query with the step added to the end.
+    """
+    def where(self, condition: Union[Callable, dict, str], columns: Optional[List[str]] = None) -> 'Query':
+        """
+        Filter the records, 'condition' is a function, a dictionary of
+        field names and values or an expression (see expressions.py).
+        'columns' are the columns a function uses, if they're not provided
+        the filter won't be moved.
+        """
+        return self._extend(self._where_operator(condition, columns))
+
+    def select(self, columns: List[str]) -> 'Query':
+        if columns == ['*']:
+            return self
+        return self._extend(_Operator('select', columns=list(columns)))
+
+    def set_column(self, name: str, setter: Any, depends_on: Optional[List[str]] = None) -> 'Query':
+        """
+        Set a column to a value, or the result of a function of the record.
+        'depends_on' are the columns the function uses.
+        """
+        if not callable(setter):
+            depends_on = []
+        return self._extend(_Operator('set', name=name, setter=setter,
+                                      depends_on=set(depends_on) if depends_on is not None else None))
+
+    def distinct(self, columns: List[str] = ['*']) -> 'Query':
+        return self._extend(_Operator('distinct', columns=list(columns)))
+
+    def limit(self, count: int) -> 'Query':
+        return self._extend(_Operator('limit', count=count))
+
+    def join(
+            self,
+            right: Union['Query', Iterable[dict]],
+            column: Union[str, List[str]],
+            join_type: str = JOINS.INNER_JOIN) -> 'Query':
+        return self._extend(_Operator('join', right=right, column=column, join_type=join_type))
+
+    """
+    Optimizer
+    """
+    def _optimize(self):
+        """
+        Returns the parameters for the Reader and the steps to run after it.
+        """
+        operators = list(self.operators)
+
+        # predicate and limit pushdown - bubble filters and limits toward
+        # the start of the query, merging consecutive limits
+        moved = True
+        while moved:
+            moved = False
+            for index in range(1, len(operators)):
+                operator, previous = operators[index], operators[index - 1]
+                if operator.kind == 'limit' and previous.kind == 'limit':
+                    operators[index - 1:index + 1] = [_Operator('limit', count=min(operator.count, previous.count))]
+                    moved = True
+                    break
+                if _can_swap(operator, previous):
+                    operators[index - 1], operators[index] = operator, previous
+                    moved = True
+
+        # the Reader runs the filters at the start, then a select, then a limit
+        reader_arguments = dict(self.reader_arguments)
+        conditions: Dict[str, Any] = {}
+        predicates: List[Callable] = []
+        expressions: List[Expression] = []
+        while operators and operators[0].kind == 'where':
+            operator = operators.pop(0)
+            mergable = operator.conditions is not None and all(
+                    conditions.get(field, value) == value for field, value in operator.conditions.items())
+            if mergable:
+                conditions.update(operator.conditions)
+            elif isinstance(operator.predicate, Expression):
+                expressions.append(operator.predicate)
+            else:
+                predicates.append(operator.predicate)
+        if expressions:
+            # the Reader gets the prefilter and partition filter from expressions
+            if conditions:
+                expressions.insert(0, to_expression(conditions))
+                conditions = {}
+            predicates.insert(0, expressions[0] if len(expressions) == 1 else And(expressions))
+        if conditions or predicates:
+            if not predicates:
+                reader_arguments['where'] = conditions
+            elif len(predicates) == 1 and not conditions:
+                reader_arguments['where'] = predicates[0]
+            else:
+                if conditions:
+                    predicates.insert(0, EqualityPredicate(conditions))
+                    if reader_arguments.get('data_format', 'json').lower() == 'json':
+                        reader_arguments.setdefault('prefilter', conditions)
+                elif isinstance(predicates[0], Expression):
+                    if reader_arguments.get('data_format', 'json').lower() == 'json':
+                        reader_arguments.setdefault('prefilter', predicates[0].equalities() or None)
+                    if _accepts(reader_arguments.get('reader', blob_reader), 'partition_filter'):
+                        reader_arguments.setdefault('partition_filter', predicates[0].conditions() or None)
+                reader_arguments['where'] = _AllOf(predicates)
+        # selects and limits can be run in either order
+        while operators and operators[0].kind in ('select', 'limit'):
+            operator = operators[0]
+            name = 'select' if operator.kind == 'select' else 'limit'
+            if name in reader_arguments:
+                break
+            reader_arguments[name] = operator.columns if name == 'select' else operator.count
+            operators.pop(0)
+
+        # projection pruning - if the steps up to the last select only
+        # use known columns, the Reader only needs to keep those
+        if 'select' not in reader_arguments:
+            selects = [index for index, operator in enumerate(operators) if operator.kind == 'select']
+            needed: Optional[set] = None
+            if selects:
+                needed = set(operators[selects[-1]].columns)
+                for operator in reversed(operators[:selects[-1]]):
+                    if operator.kind == 'select':
+                        needed = set(operator.columns)
+                    elif operator.kind == 'where':
+                        needed = None if operator.columns is None else needed | operator.columns
+                    elif operator.kind == 'set':
+                        needed = None if operator.depends_on is None else (needed - {operator.name}) | operator.depends_on
+                    elif operator.kind in ('distinct', 'join'):
+                        # the Reader fills missing columns with None, which
+                        # distinct treats differently to a missing value
+                        needed = None
+                    if needed is None:
+                        break
+            if needed:
+                reader_arguments['select'] = sorted(needed)
+
+        # operator fusion - consecutive row by row steps run in one loop
+        fused: List[_Operator] = []
+        for operator in operators:
+            if operator.kind in ('where', 'select', 'set'):
+                if fused and fused[-1].kind == 'fused':
+                    fused[-1].steps.append(operator)
+                    continue
+                operator = _Operator('fused', steps=[operator])
+            fused.append(operator)
+        for index, operator in enumerate(fused):
+            if operator.kind == 'fused' and len(operator.steps) == 1:
+                fused[index] = operator.steps[0]
+
+        return reader_arguments, fused
+
+    """
+    Execution
+    """
+    def _execute(self, measure: bool = False, run: bool = True):
+        """
+        Builds the pipeline of generators, and the statistics for each step.
+        If 'run' isn't set, only the statistics are built.
+        """
+        reader_arguments, operators = self._optimize()
+        source: Any = Reader(**reader_arguments) if run else None
+        statistics = _Statistics(_describe_reader(reader_arguments), [])
+        if measure:
+            source = _measure(source, statistics)
+
+        for operator in operators:
+            children = [statistics]
+            if operator.kind == 'join' and isinstance(operator.right, Query):
+                right, right_statistics = operator.right._execute(measure, run)
+                children.append(right_statistics)
+            else:
+                right = operator.arguments.get('right')
+            if not run:
+                pass
+            elif operator.kind == 'fused':
+                source = _fused(source, [_step_function(step) for step in operator.steps])
+            elif operator.kind in ('where', 'select', 'set'):
+                source = _fused(source, [_step_function(operator)])
+            elif operator.kind == 'distinct':
+                source = distinct(source, operator.columns)
+            elif operator.kind == 'limit':
+                source = _limit(source, operator.count)
+            elif operator.kind == 'join':
+                source = join_dictsets(source, right, operator.column, operator.join_type)
+            statistics = _Statistics(operator.describe(), children)
+            if measure:
+                source = _measure(source, statistics)
+
+        return source, statistics
+
+    def __iter__(self) -> Iterator[dict]:
+        records, statistics = self._execute()
+        return iter(records)
+
+    def explain(self, analyze: bool = False) -> str:
+        """
+        Describes the plan, the last step first. If 'analyze' is set, the
+        query is run and the number of records from each step and the
+        time spent in each step are included.
+        """
+        records, statistics = self._execute(measure=analyze, run=analyze)
+        if analyze:
+            for record in records:
+                pass
+        lines: List[str] = []
+        _describe_statistics(statistics, 0, analyze, lines)
+        return '\n'.join(lines)
+
+
+def _describe_reader(reader_arguments: dict) -> str:
+    details = []
+    for name in ('from_path', 'where', 'select', 'limit', 'prefilter', 'partition_filter'):
+        if reader_arguments.get(name) is not None:
+            value = reader_arguments[name]
+            if isinstance(value, Expression):
+                value = F'"{value!r}"'
+            elif callable(value):
+                value = getattr(value, '__name__', type(value).__name__)
+            else:
+                value = repr(value)
+            details.append(F'{name}={value}')
+    return 'Reader(' + ', '.join(details) + ')'
+
+
+def _describe_statistics(statistics: _Statistics, depth: int, analyze: bool, lines: List[str]):
+    line = '  ' * depth + statistics.description
+    if analyze:
+        line += F'  (records={statistics.records}, time={statistics.own_seconds() * 1000:.2f}ms)'
+    lines.append(line)
+    for child in statistics.children:
+        _describe_statistics(child, depth + 1, analyze, lines)
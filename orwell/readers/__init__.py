@@ -1,3 +1,4 @@
 from .reader import Reader
 from .file_reader import file_reader
 from .blob_reader import blob_reader
+from .threaded import threaded_reader
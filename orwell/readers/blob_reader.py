@@ -2,10 +2,15 @@ try:
     from google.cloud import storage  # type:ignore
 except ImportError:
     pass
-import lzma
+import json
 import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from ..helpers.blob_paths import BlobPaths
-from typing import Tuple, Union, Optional
+from ..helpers.storage_pool import StoragePool
+from ..helpers.chunked_lines import lzma_decompress, chunks_to_lines, track_offsets
+from ..helpers.manifest import MANIFEST_SUFFIX, manifest_may_match
+from typing import Tuple, Union, Optional, Any
 import gva.logging  # type:ignore
 
 
@@ -14,10 +19,26 @@ def blob_reader(
         project: str,
         date_range: Tuple[Optional[datetime.date], Optional[datetime.date]] = (None, None),
         chunk_size=16*1024*1024,
+        partition_filter: Optional[list] = None,
+        cursor: Optional[dict] = None,
+        read_ahead: int = 2,
         **kwargs):
 
     """
     Blob reader, will iterate over as set of blobs in a path.
+
+    'read_ahead' is the number of ranges of 'chunk_size' to download in the
+    background while the current range is being read, up to read_ahead + 1
+    ranges are held in memory at a time. Set to 0 to download ranges only
+    when they are needed.
+
+    'partition_filter' is a list of conditions (see helpers/manifest.py),
+    blobs with a manifest which shows they can't contain records meeting
+    the conditions are skipped.
+
+    'cursor' is a dictionary which is updated with the partition, blob and
+    offset of the next line as lines are read. If it has values when the
+    reader starts, reading resumes from that point.
     """
     # validate request
     if not project:
@@ -25,6 +46,53 @@ def blob_reader(
     if not path:
         raise ValueError('Blob Reader requires Path to be set')
 
+    # where to resume reading from
+    resume_partition, resume_blob, resume_offset = '', '', 0
+    if cursor:
+        resume_partition = cursor.get('partition', '')
+        resume_blob = cursor.get('file', '')
+        resume_offset = cursor.get('offset', 0)
+
+    blobs = find_blobs_in_date_range(
+            path=path,
+            project=project,
+            date_range=date_range,
+            partition_filter=partition_filter,
+            from_partition=resume_partition)
+    for partition, blob in blobs:
+        offset = 0
+        if partition == resume_partition:
+            if blob.name < resume_blob:
+                continue
+            if blob.name == resume_blob:
+                offset = resume_offset
+        if cursor is not None:
+            cursor.update({'partition': partition, 'file': blob.name, 'offset': offset})
+        yield from _inner_blob_reader(
+                blob_name=blob.name,
+                project=project,
+                bucket=blob.bucket.name,
+                chunk_size=chunk_size,
+                offset=offset,
+                cursor=cursor,
+                blob=blob,
+                read_ahead=read_ahead)
+
+
+def find_blobs_in_date_range(
+        path: str,
+        project: str,
+        date_range: Tuple[Optional[datetime.date], Optional[datetime.date]] = (None, None),
+        partition_filter: Optional[list] = None,
+        from_partition: str = ''):
+    """
+    Lists the blobs in the folders for each of the days in the date range,
+    returning the partition (the ISO formatted date) and the blob.
+
+    If a 'partition_filter' is provided, blobs with manifests which show
+    they can't contain matching records are skipped. Days before
+    'from_partition' are skipped.
+    """
     # if dates aren't provided, use today
     start_date, end_date = date_range
     if not end_date:
@@ -34,15 +102,22 @@ def blob_reader(
 
     bucket, blob_path, name, extention = BlobPaths.get_parts(path)
 
-    # cycle through the days, loading each days' file
+    # cycle through the days, listing each days' files
     for cycle in range(int((end_date - start_date).days) + 1):
         cycle_date = start_date + datetime.timedelta(cycle)
+        partition = cycle_date.isoformat()[:10]
+        if partition < from_partition:
+            continue
         cycle_path = BlobPaths.build_path(path=blob_path, date=cycle_date)
-        blobs_at_path = find_blobs_at_path(project=project, bucket=bucket, path=cycle_path, extention=extention)
-        blobs_at_path = list(blobs_at_path)
-        for blob in blobs_at_path:
-            reader = _inner_blob_reader(blob_name=blob.name, project=project, bucket=bucket, chunk_size=chunk_size)
-            yield from reader
+        blobs_at_path = list(_list_blobs_at_path(project=project, bucket=bucket, path=cycle_path))
+        manifests = {blob.name: blob for blob in blobs_at_path if blob.name.endswith(MANIFEST_SUFFIX)}
+        for blob in _data_blobs(blobs_at_path, extention):
+            manifest_blob = manifests.get(blob.name + MANIFEST_SUFFIX)
+            if partition_filter and manifest_blob:
+                manifest = json.loads(manifest_blob.download_as_string())
+                if not manifest_may_match(manifest, partition_filter):
+                    continue
+            yield partition, blob
 
 
 def find_blobs_at_path(
@@ -51,12 +126,28 @@ def find_blobs_at_path(
         path: str,
         extention: str):
 
-    client = storage.Client(project=project)
-    gcs_bucket = client.get_bucket(bucket)
-    blobs = client.list_blobs(bucket_or_name=gcs_bucket, prefix=path)
-    if extention:
-        blobs = [blob for blob in blobs if extention in blob.name]
-    yield from blobs
+    blobs = _list_blobs_at_path(project=project, bucket=bucket, path=path)
+    yield from _data_blobs(blobs, extention)
+
+
+def _list_blobs_at_path(
+        project: str,
+        bucket: str,
+        path: str):
+
+    client = StoragePool.get_client(project)
+    gcs_bucket = StoragePool.get_bucket(project, bucket)
+    return client.list_blobs(bucket_or_name=gcs_bucket, prefix=path)
+
+
+def _data_blobs(blobs, extention: str):
+    """ filter out manifests and blobs without the extention """
+    for blob in blobs:
+        if blob.name.endswith(MANIFEST_SUFFIX):
+            continue
+        if extention and extention not in blob.name:
+            continue
+        yield blob
 
 
 def _inner_blob_reader(
@@ -64,33 +155,43 @@ def _inner_blob_reader(
         bucket: str,
         blob_name: str,
         chunk_size: int = 16*1024*1024,
-        delimiter: str = '\n'):
+        delimiter: str = '\n',
+        offset: int = 0,
+        cursor: Optional[dict] = None,
+        blob: Any = None,
+        read_ahead: int = 0):
 
     """
     Reads lines from an arbitrarily long blob, line by line.
 
-    Automatically detecting if the blob is compressed.
+    Automatically detecting if the blob is compressed, compressed blobs
+    are decompressed as they are downloaded.
+
+    Reading starts at 'offset', for compressed blobs this is an offset in
+    the decompressed data so the blob is read from the start and the lines
+    before the offset are skipped.
+
+    If the 'blob' is provided (e.g. from a listing) it is used rather
+    than looking up its details again.
     """
-    blob = get_blob(project=project, bucket=bucket, blob_name=blob_name)
+    if blob is None:
+        blob = get_blob(project=project, bucket=bucket, blob_name=blob_name)
     if blob:
         blob_size = blob.size
     else:
         blob_size = 0
 
-    carry_forward = ''
-    cursor = 0
-    while (cursor < blob_size):
-        chunk = _download_chunk(blob=blob, start=cursor, end=min(blob_size, cursor+chunk_size-1))
-        cursor += chunk_size   # was previously +len(chunk)
-        chunk = chunk.decode('utf-8')
-        # add the last line from the previous cycle
-        chunk += carry_forward
-        lines = chunk.split(delimiter)
-        # the list line is likely to be incomplete, save it to carry forward
-        carry_forward = lines.pop()
-        yield from lines
-    if len(carry_forward) > 0:
-        yield carry_forward
+    separator = delimiter.encode()
+    if blob_name.endswith('.lzma'):
+        chunks = _download_chunks(blob=blob, blob_size=blob_size, chunk_size=chunk_size, read_ahead=read_ahead)
+        lines = chunks_to_lines(lzma_decompress(chunks, max_length=chunk_size), separator)
+        yield from track_offsets(lines, cursor, len(separator), skip_to=offset)
+        return
+
+    chunks = _download_chunks(blob=blob, blob_size=blob_size, chunk_size=chunk_size, start=offset, read_ahead=read_ahead)
+    lines = chunks_to_lines(chunks, separator)
+    for line in track_offsets(lines, cursor, len(separator), start=offset):
+        yield line.decode('utf8')
 
 
 def _download_chunk(
@@ -98,17 +199,39 @@ def _download_chunk(
         start: int,
         end: int):
 
+    return blob.download_as_string(start=start, end=end)
+
+
+def _download_chunks(
+        blob: storage.blob,
+        blob_size: int,
+        chunk_size: int,
+        start: int = 0,
+        read_ahead: int = 0):
     """
-    Detects if a chunk is compressed by looking for a magic string
+    Downloads a blob as a series of ranges, the next 'read_ahead' ranges
+    are downloaded in background threads while the current one is used.
     """
-    chunk = blob.download_as_string(start=start, end=end)
-    if blob.name.endswith('.lzma'):
-        try:
-            return lzma.decompress(chunk)
-        except lzma.LZMAError:
-            # if we fail maybe we're not compressed
-            pass
-    return chunk
+    ranges = ((cursor, min(blob_size, cursor+chunk_size-1)) for cursor in range(start, blob_size, chunk_size))
+
+    if read_ahead <= 0:
+        for range_start, range_end in ranges:
+            yield _download_chunk(blob=blob, start=range_start, end=range_end)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=read_ahead)
+    pending: deque = deque()
+    try:
+        for range_start, range_end in ranges:
+            pending.append(executor.submit(_download_chunk, blob=blob, start=range_start, end=range_end))
+            if len(pending) > read_ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
 
 
 def get_blob(
@@ -116,7 +239,6 @@ def get_blob(
         bucket: str,
         blob_name: str):
 
-    client = storage.Client(project=project)
-    gcs_bucket = client.get_bucket(bucket)
+    gcs_bucket = StoragePool.get_bucket(project, bucket)
     blob = gcs_bucket.get_blob(blob_name)
     return blob
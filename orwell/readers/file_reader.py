@@ -8,8 +8,13 @@ of the files in those folders and present the content back, line by line.
 """
 from typing import Iterator, Tuple, Optional, List
 import datetime
+import json
+from functools import partial
+from os.path import exists
 from ..helpers.blob_paths import BlobPaths
-import lzma
+from ..helpers.manifest import MANIFEST_SUFFIX, manifest_may_match
+from ..helpers.chunked_lines import lzma_decompress, chunks_to_lines, track_offsets
+import mmap
 
 
 def _find_files_at_path(path: str, extention: str) -> List[str]:
@@ -17,35 +22,101 @@ def _find_files_at_path(path: str, extention: str) -> List[str]:
     from os import listdir
     from os.path import isfile, join, exists
     if exists(path):  # skip non-existant folders
-        return [join(path, f) for f in listdir(path) if isfile(join(path, f)) and extention in f]
+        return sorted(join(path, f) for f in listdir(path) if isfile(join(path, f)) and extention in f and not f.endswith(MANIFEST_SUFFIX))
     return []
 
 
+def _file_may_match(file_name: str, partition_filter: list) -> bool:
+    """ Test the manifest for a file, files without manifests may match """
+    manifest_name = file_name + MANIFEST_SUFFIX
+    if not exists(manifest_name):
+        return True
+    with open(manifest_name, 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    return manifest_may_match(manifest, partition_filter)
+
+
 def _inner_file_reader(
         file_name: str,
         chunk_size: int,
-        delimiter: str = "\n"):
+        delimiter: str = "\n",
+        offset: int = 0,
+        cursor: Optional[dict] = None):
     """
     This is the guts of the reader - it opens a file and reads through it
     chunk by chunk. This allows huge files to be processed as only a chunk
     at a time is in memory.
     """
-    with open(file_name, 'r', encoding="utf8") as f:
-        carry_forward = ""
-        chunk = "INITIALIZED"
-        while len(chunk) > 0:
-            chunk = f.read(chunk_size)
-            augmented_chunk = carry_forward + chunk
-            lines = augmented_chunk.split(delimiter)
-            carry_forward = lines.pop()
-            yield from lines
-        if carry_forward:
-            yield carry_forward
+    separator = delimiter.encode()
+    with open(file_name, 'rb') as f:
+        f.seek(offset)
+        chunks = iter(partial(f.read, chunk_size), b'')
+        lines = chunks_to_lines(chunks, separator)
+        for line in track_offsets(lines, cursor, len(separator), start=offset):
+            yield line.decode('utf8')
+
+
+def _inner_mmap_file_reader(
+        file_name: str,
+        chunk_size: int,
+        delimiter: str = "\n",
+        offset: int = 0,
+        cursor: Optional[dict] = None):
+    """
+    Reads a file by memory mapping it. Each line is found in the mapped
+    file and sliced from it, so is only copied once, and is returned as
+    bytes, without being decoded. 'chunk_size' isn't used, the operating
+    system decides how much of the file to read at a time.
 
+    Empty lines are skipped.
+    """
+    separator = delimiter.encode()
+    with open(file_name, 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files can't be mapped
+            return
+        with buffer:
+            if hasattr(buffer, 'madvise'):
+                buffer.madvise(mmap.MADV_SEQUENTIAL)
+            size = len(buffer)
+            start = offset
+            while start < size:
+                end = buffer.find(separator, start)
+                if end == -1:
+                    end = size
+                if end > start:
+                    line = buffer[start:end]
+                    if cursor is not None:
+                        cursor['offset'] = end + len(separator)
+                    yield line
+                start = end + len(separator)
 
-def _inner_compressed_file_reader(file_name: str):
-    with lzma.open(file_name, 'r') as f:
-        yield from f.readlines()
+
+def _inner_compressed_file_reader(
+        file_name: str,
+        chunk_size: int,
+        delimiter: str = "\n",
+        offset: int = 0,
+        cursor: Optional[dict] = None):
+    """
+    Reads an LZMA compressed file, the file is read and decompressed a
+    chunk at a time so only a chunk of the file is in memory.
+
+    Compressed files can't be seeked, the offset is in the decompressed
+    data and the lines before it are skipped.
+    """
+    def _read_chunks():
+        with open(file_name, 'rb') as f:
+            chunk = f.read(chunk_size)
+            while chunk:
+                yield chunk
+                chunk = f.read(chunk_size)
+
+    separator = delimiter.encode()
+    decompressed = lzma_decompress(_read_chunks(), max_length=chunk_size)
+    lines = chunks_to_lines(decompressed, separator)
+    yield from track_offsets(lines, cursor, len(separator), skip_to=offset)
 
 
 def file_reader(
@@ -53,7 +124,26 @@ def file_reader(
         chunk_size: int = 8*1024*1024,  # 8Mb
         date_range: Tuple[Optional[datetime.date], Optional[datetime.date]] = (None, None),
         extention: str = '.jsonl',
-        delimiter: str = "\n") -> Iterator:
+        delimiter: str = "\n",
+        use_mmap: bool = False,
+        partition_filter: Optional[list] = None,
+        cursor: Optional[dict] = None,
+        **kwargs) -> Iterator:
+    """
+    File reader, will iterate over a set of files in a path.
+
+    'use_mmap' reads uncompressed files by memory mapping them, lines are
+    returned as bytes rather than strings, which the json parsers can read
+    without decoding them first.
+
+    'partition_filter' is a list of conditions (see helpers/manifest.py),
+    files with a manifest which shows they can't contain records meeting
+    the conditions are skipped.
+
+    'cursor' is a dictionary which is updated with the partition, file and
+    offset of the next line as lines are read. If it has values when the
+    reader starts, reading resumes from that point.
+    """
 
     # if dates aren't provided, use today
     start_date, end_date = date_range
@@ -62,17 +152,44 @@ def file_reader(
     if not start_date:
         start_date = datetime.date.today()
 
+    # where to resume reading from
+    resume_partition, resume_file, resume_offset = '', '', 0
+    if cursor:
+        resume_partition = cursor.get('partition', '')
+        resume_file = cursor.get('file', '')
+        resume_offset = cursor.get('offset', 0)
+
     # cycle through each day in the range
     for cycle in range(int((end_date - start_date).days) + 1):
         cycle_date = start_date + datetime.timedelta(cycle)
+        partition = cycle_date.isoformat()[:10]
+        if partition < resume_partition:
+            continue
         # build the path name - it says 'blob' but works for filesystems
         cycle_path = BlobPaths.build_path(path=path, date=cycle_date)
         # get the list of files at that path
         files_at_path = _find_files_at_path(path=cycle_path, extention=extention)
         # for each file, read it and return the rows
         for file in files_at_path:
+            offset = 0
+            if partition == resume_partition:
+                if file < resume_file:
+                    continue
+                if file == resume_file:
+                    offset = resume_offset
+            if partition_filter and not _file_may_match(file, partition_filter):
+                continue
+            if cursor is not None:
+                cursor.update({'partition': partition, 'file': file, 'offset': offset})
             if file.endswith('.lzma'):
-                reader = _inner_compressed_file_reader(file_name=file)
+                reader = _inner_compressed_file_reader
+            elif use_mmap:
+                reader = _inner_mmap_file_reader
             else:
-                reader = _inner_file_reader(file_name=file, chunk_size=chunk_size)
-            yield from reader
+                reader = _inner_file_reader
+            yield from reader(
+                    file_name=file,
+                    chunk_size=chunk_size,
+                    delimiter=delimiter,
+                    offset=offset,
+                    cursor=cursor)
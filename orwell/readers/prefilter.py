@@ -0,0 +1,110 @@
+"""
+Raw Line Prefilters
+
+Most queries are looking for a small number of records in a large
+set of data, parsing each line only to discard it is most of the
+cost of these queries. A prefilter is a cheap test on the raw line,
+before it is parsed, to discard lines which can't match.
+
+Prefilters can be false positive but never false negative, the
+'where' filter still runs on the lines which pass the prefilter.
+
+Prefilters can be:
+- a string (or bytes), the line must contain it
+- a list of strings (or bytes), the line must contain all of them
+- a compiled regular expression, the line must match it
+- a dictionary of field names and values, as used for equality
+  filters, values which can be reliably found in JSON text are
+  used as substrings
+"""
+import re
+from typing import Any, Callable, List, Optional, Union
+
+
+class EqualityPredicate():
+    """
+    A 'where' filter from a dictionary of field names and values,
+    all of the fields must equal their values.
+
+    Unlike a lambda this can be sent to worker processes and used to
+    create a prefilter.
+    """
+    def __init__(self, conditions: dict):
+        self.conditions = conditions
+
+    def __call__(self, record: dict) -> bool:
+        for field, value in self.conditions.items():
+            if record.get(field) != value:
+                return False
+        return True
+
+
+def _json_needle(value: Any) -> Optional[str]:
+    """
+    The text for a value as it would appear in a JSON line, if it can
+    be reliably predicted.
+    """
+    # a missing field equals None, so there may be nothing to find
+    if value is None:
+        return None
+    # True == 1 and False == 0, so these could appear as either
+    if isinstance(value, bool) or value in (0, 1):
+        return None
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, str):
+        # values which may be escaped by the serializer can't be
+        # reliably found in the raw text
+        if value.isascii() and value.isprintable() and '"' not in value and '\\' not in value and '/' not in value:
+            return F'"{value}"'
+    return None
+
+
+def _alternate_pattern(pattern: re.Pattern) -> re.Pattern:
+    """ the str version of a bytes pattern, and vice versa """
+    if isinstance(pattern.pattern, bytes):
+        return re.compile(pattern.pattern.decode(), pattern.flags)
+    return re.compile(pattern.pattern.encode(), pattern.flags & ~re.UNICODE)
+
+
+def build_prefilter(
+        prefilter: Union[str, bytes, list, dict, re.Pattern, None]) -> Optional[Callable[[Any], bool]]:
+    """
+    Creates a function to test raw lines, lines can be str or bytes
+    depending on the reader.
+    """
+    if prefilter is None:
+        return None
+
+    if isinstance(prefilter, re.Pattern):
+        patterns = {type(prefilter.pattern): prefilter}
+        alternate = _alternate_pattern(prefilter)
+        patterns[type(alternate.pattern)] = alternate
+
+        def _regex_prefilter(line):
+            return patterns[type(line)].search(line) is not None
+
+        return _regex_prefilter
+
+    needles: List[Union[str, bytes]]
+    if isinstance(prefilter, dict):
+        needles = [needle for needle in map(_json_needle, prefilter.values()) if needle]
+    elif isinstance(prefilter, (str, bytes)):
+        needles = [prefilter]
+    elif isinstance(prefilter, (list, tuple, set)):
+        needles = list(prefilter)
+    else:
+        raise TypeError(F"prefilter unsupported: {type(prefilter).__name__}.")
+
+    if not needles:
+        return None
+
+    str_needles = [n.decode() if isinstance(n, bytes) else n for n in needles]
+    bytes_needles = [n.encode() if isinstance(n, str) else n for n in needles]
+
+    def _substring_prefilter(line):
+        if isinstance(line, str):
+            return all(needle in line for needle in str_needles)
+        return all(needle in line for needle in bytes_needles)
+
+    return _substring_prefilter
@@ -19,12 +19,18 @@ it is a log reader and returns log entries. The reader can convert a set
 into Pandas dataframe, or the dictset helper library can perform some 
 activities on the set in a more memory efficient manner.
 """
-from typing import Callable, Tuple, Optional
-from ..dictset import select_all, select_record_fields
+from typing import Callable, Tuple, Optional, Iterator, Union, Any, List
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from ..dictset import select_all, select_record_fields, generator_chunker, sort_dictset, top_n
 from .blob_reader import blob_reader
+from .prefilter import build_prefilter, EqualityPredicate
+from ..expressions import Expression, parse
 import xmltodict  # type:ignore
 import logging
+import inspect
 import datetime
+import pickle  # nosec - only used to check 'where' can be sent to workers
 import json
 json_parser: Callable = json.loads
 json_dumper: Callable = json.dumps
@@ -44,7 +50,7 @@ logger = logging.getLogger("GVA")
 
 FORMATTERS = {
     "json": json_parser,
-    "text": lambda x: x,
+    "text": lambda x: x.decode() if isinstance(x, bytes) else x,
     "xml": lambda x: xmltodict.parse(x)
 }
 
@@ -55,12 +61,18 @@ class Reader():
         self,
         select: list = ['*'],
         from_path: str = None,
-        where: Callable = select_all,
+        where: Union[Callable, dict, str] = select_all,
         limit: int = -1,
         reader: Callable = blob_reader,
         data_format: str = "json",
         date_range: Tuple[Optional[datetime.date], Optional[datetime.date]] = (None, None),
-        cursor: str = '',  # __
+        cursor: Union[str, dict, None] = None,
+        workers: int = 0,
+        preserve_order: bool = True,
+        batch_size: int = 1000,
+        prefilter: Any = None,
+        order_by: Union[str, List[str], None] = None,
+        descending: bool = False,
         **kwargs):
         """
         Reader accepts a method which iterates over a data source and provides
@@ -80,15 +92,98 @@ class Reader():
         )
 
         It's the data is automatically partitioned by date.
+
+        Parsing and filtering can be spread over a pool of processes by
+        setting 'workers', batches of 'batch_size' raw lines are sent to
+        the pool and only the records which survive the 'where' filter
+        are returned. 'preserve_order' returns records in the order they
+        were read, turning it off returns batches as soon as they are
+        ready. When using workers, 'where' must be picklable - a function
+        defined at the top level of a module, not a lambda.
+
+        'where' can also be a dictionary of field names and values, records
+        are returned when all of the fields match their values, or an
+        expression (see expressions.py) either as a string or an Expression.
+        The conditions in an expression are used to skip partitions, using
+        their manifests, unless a 'partition_filter' is set.
+
+        'prefilter' is a cheap test applied to the raw lines before they are
+        parsed (see prefilter.py), lines which fail it are skipped without
+        being parsed. If 'where' is a dictionary or an expression and no
+        'prefilter' is set, one is created from the values in 'where'.
+
+        'cursor' resumes reading from a position saved from the 'cursor'
+        property of an earlier Reader, either as a dictionary or as a JSON
+        string. Workers and the threaded reader read ahead of the records
+        which have been returned, so cursors from these Readers shouldn't
+        be used to resume.
+
+        'order_by' returns the records sorted by one or more columns, in
+        'descending' order if set, records without a value are returned
+        last in either order. With a 'limit', only the records which
+        will be returned are held in memory (see dictset.top_n), otherwise
+        all of the records are sorted (see dictset.sort_dictset). No records
+        are returned until all of the records have been read.
         """
-        self.reader = reader(path=from_path, date_range=date_range, **kwargs)
+        if isinstance(cursor, str):
+            cursor = json.loads(cursor) if cursor else None
+        self._cursor: dict = dict(cursor or {})
         self.format = data_format
-        self.formatter = FORMATTERS.get(self.format.lower())
-        if not self.formatter:
+        formatter = FORMATTERS.get(self.format.lower())
+        if not formatter:
             raise TypeError(F"data format unsupported: {self.format}.")
+        self.formatter: Callable = formatter
         self.select = select.copy()
+        if isinstance(where, dict):
+            if prefilter is None and self.format.lower() == 'json':
+                prefilter = where
+            where = EqualityPredicate(where)
+        if isinstance(where, str):
+            where = parse(where)
+        if isinstance(where, Expression):
+            if prefilter is None and self.format.lower() == 'json':
+                prefilter = where.equalities() or None
+            # only for readers which can skip partitions
+            if where.conditions() and kwargs.get('partition_filter') is None and _accepts(reader, 'partition_filter'):
+                kwargs['partition_filter'] = where.conditions()
         self.where: Callable = where
+        # readers which don't track their position can't take a cursor
+        if cursor or _accepts(reader, 'cursor'):
+            kwargs['cursor'] = self._cursor
+        self.reader = reader(path=from_path, date_range=date_range, **kwargs)
+        self._source = self.reader
+        self.prefilter = build_prefilter(prefilter)
+        if self.prefilter:
+            self.reader = filter(self.prefilter, self.reader)
         self.limit: int = limit
+        self.workers = workers
+        self._parallel: Optional[Iterator] = None
+        self._ordered: Optional[Iterator] = None
+
+        # the columns used to order the records are needed until they're
+        # ordered, so are selected until then
+        select = self.select
+        if order_by:
+            order_columns = [order_by] if isinstance(order_by, str) else list(order_by)
+            if select != ['*']:
+                select = select + [column for column in order_columns if column not in select]
+
+        if workers > 0:
+            try:
+                pickle.dumps(where)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                raise ValueError("'where' must be picklable to use workers, lambdas can't be used.")
+            self._parallel = _parallel_reader(
+                    lines=self.reader,
+                    data_format=self.format,
+                    where=self.where,
+                    select=select,
+                    workers=workers,
+                    preserve_order=preserve_order,
+                    batch_size=batch_size)
+
+        if order_by:
+            self._ordered = self._ordered_records(order_columns, descending, limit)
 
         logger.debug(F"Reader(reader={reader.__name__}, from_path='{from_path}', date_range={date_range})")
 
@@ -109,8 +204,13 @@ class Reader():
         This wraps the primary filter and select logic
         """
         if self.limit == 0:
+            self.close()
             raise StopIteration()
         self.limit -= 1
+        if self._ordered:
+            return self._ordered.__next__()
+        if self._parallel:
+            return self._parallel.__next__()
         while True:
             record = self.reader.__next__()
             record = self.formatter(record)
@@ -120,6 +220,25 @@ class Reader():
                 record = select_record_fields(record, self.select)
             return record
 
+    def _ordered_records(
+            self,
+            order_by: List[str],
+            descending: bool,
+            limit: int) -> Iterator[dict]:
+        records: Iterator[dict]
+        if self._parallel:
+            records = self._parallel
+        else:
+            records = (record for record in map(self.formatter, self.reader) if self.where(record))
+        if limit >= 0:
+            records = top_n(records, order_by, limit, descending)
+        else:
+            records = sort_dictset(records, order_by, descending)
+        for record in records:
+            if self.select != ['*']:
+                record = select_record_fields(record, self.select)
+            yield record
+
     """
     Context Manager
 
@@ -134,7 +253,29 @@ class Reader():
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        pass  # exist needs to exist to be a context manager
+        self.close()
+
+    def close(self):
+        """
+        Stop any outstanding work in the worker pool and the reader, such
+        as the threads of the threaded_reader
+        """
+        if self._parallel:
+            self._parallel.close()
+        if hasattr(self._source, 'close'):
+            try:
+                self._source.close()
+            except ValueError:  # the reader is running in another thread
+                pass
+
+    @property
+    def cursor(self) -> dict:
+        """
+        The position after the last line read - the partition, the file or
+        blob and the offset of the next line - as a dictionary which can be
+        saved as JSON and passed to a new Reader to resume reading.
+        """
+        return dict(self._cursor)
 
     def read_line(self):
         try:
@@ -142,10 +283,38 @@ class Reader():
         except StopIteration:
             return None
 
+    """
+    Batches
+
+    Read records in batches, either as lists of records or as dictionaries
+    of columns:
+
+        for batch in Reader("file").iter_batches(1000, columnar=True):
+            print(batch['column'])
+    """
+    def iter_batches(self, size: int = 1000, columnar: bool = False) -> Iterator:
+        for batch in generator_chunker(self, size):
+            if columnar:
+                yield _records_to_columns(batch)
+            else:
+                yield batch
+
     """
     Exports
+
+    The exports are built a batch at a time, 'max_memory' sets a limit (in
+    bytes) on the size of the data being built, a MemoryError is raised if
+    it is exceeded. The size is only measured when 'max_memory' is set.
+
+    to_pandas collects the batches into a list per column and creates the
+    DataFrame once, the limit is on the size of the DataFrame and the lists
+    hold references to the values rather than copies of them. to_arrow
+    combines the tables for each batch without copying them.
     """
-    def to_pandas(self):
+    def to_pandas(
+            self,
+            batch_size: int = 10000,
+            max_memory: Optional[int] = None):
         """
         Only import Pandas if needed
         """
@@ -153,19 +322,127 @@ class Reader():
             import pandas as pd  # type:ignore
         except ImportError:
             raise ImportError("Pandas must be installed to use 'to_pandas'")
-        return pd.DataFrame(self)
+        columns: dict = {}
+        rows = 0
+        memory_used = 0
+        for batch in self.iter_batches(batch_size, columnar=True):
+            if max_memory:
+                memory_used += pd.DataFrame(batch).memory_usage(deep=True).sum()
+                if memory_used > max_memory:
+                    raise MemoryError(F"to_pandas exceeded max_memory of {max_memory} bytes")
+            size = len(next(iter(batch.values()), []))
+            # batches may not all have the same columns
+            for key in batch:
+                if key not in columns:
+                    columns[key] = [None] * rows
+            for key, values in columns.items():
+                values.extend(batch[key] if key in batch else [None] * size)
+            rows += size
+        return pd.DataFrame(columns)
 
+    def to_arrow(
+            self,
+            batch_size: int = 10000,
+            max_memory: Optional[int] = None):
         """
-        cursor = {
-            select: list = ['*'],
-            from_path: str = None,
-            where: Callable = select_all,
-            limit: int = -1,
-            reader: Callable = blob_reader,
-            data_format: str = "json",
-            date_range: Tuple[datetime.date] = (None, None),
-
-            current_file:
-            current_index:
-        }
+        Only import PyArrow if needed
         """
+        try:
+            import pyarrow as pa  # type:ignore
+        except ImportError:
+            raise ImportError("PyArrow must be installed to use 'to_arrow'")
+        tables = []
+        memory_used = 0
+        for columns in self.iter_batches(batch_size, columnar=True):
+            table = pa.Table.from_pydict(columns)
+            if max_memory:
+                memory_used += table.nbytes
+                if memory_used > max_memory:
+                    raise MemoryError(F"to_arrow exceeded max_memory of {max_memory} bytes")
+            tables.append(table)
+        if not tables:
+            return pa.table({})
+        # batches may not all have the same columns
+        try:
+            return pa.concat_tables(tables, promote_options='default')
+        except TypeError:  # older versions of pyarrow
+            return pa.concat_tables(tables, promote=True)
+
+
+def _accepts(function: Callable, parameter: str) -> bool:
+    """ tests if a function can be called with a keyword parameter """
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):  # some callables can't be inspected
+        return True
+    return any(p.name == parameter or p.kind == p.VAR_KEYWORD for p in parameters)
+
+
+def _records_to_columns(records: list) -> dict:
+    """
+    Converts a list of records to a dictionary of lists, records without
+    a column have None for that column.
+    """
+    keys = dict.fromkeys(key for record in records for key in record)
+    return {key: [record.get(key) for record in records] for key in keys}
+
+
+def _process_batch(
+        lines: list,
+        data_format: str,
+        where: Callable,
+        select: list) -> list:
+    """
+    Parse, filter and select a batch of lines, this runs in the worker
+    processes so only the surviving records are sent back.
+    """
+    formatter = FORMATTERS[data_format.lower()]
+    records = []
+    for line in lines:
+        record = formatter(line)
+        if not where(record):
+            continue
+        if select != ['*']:
+            record = select_record_fields(record, select)
+        records.append(record)
+    return records
+
+
+def _parallel_reader(
+        lines: Iterator,
+        data_format: str,
+        where: Callable,
+        select: list,
+        workers: int,
+        preserve_order: bool = True,
+        batch_size: int = 1000) -> Iterator[dict]:
+    """
+    Sends batches of lines to a pool of processes, at most two batches
+    per worker are in-flight at a time. Closing the generator cancels
+    any work which hasn't started.
+    """
+    executor = ProcessPoolExecutor(max_workers=workers)
+    max_in_flight = workers * 2
+    pending: deque = deque()
+
+    def _completed():
+        if preserve_order:
+            return [pending.popleft()]
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+        return done
+
+    try:
+        for batch in generator_chunker(lines, batch_size):
+            pending.append(executor.submit(_process_batch, batch, data_format, where, select))
+            while len(pending) >= max_in_flight:
+                for future in _completed():
+                    yield from future.result()
+        while pending:
+            for future in _completed():
+                yield from future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -1,72 +1,201 @@
-import queue, threading, sys
+"""
+Threaded Blob Reader
 
+Speeds up reading sets of blobs - such as multiple days worth of
+log-per-day files - by downloading several blobs at the same time.
 
-def threaded_reader(project=None, bucket=None, blobs=[], max_threads=4, chunk_size=16*1024*1024):
+Each blob is read in its own thread, so reading a single blob
+wouldn't benefit from this approach.
+
+The amount of data which has been read but not yet consumed is
+bounded by 'max_buffer_bytes', when the buffer is full the threads
+wait for the consumer to catch up.
+
+Records can be returned in the order of the blobs ('ordered'), or
+in the order they are read, which is faster if you don't care about
+the order of the records.
+"""
+import queue
+import datetime
+import threading
+from typing import Tuple, Optional, Iterator, List
+from .blob_reader import find_blobs_in_date_range, _inner_blob_reader
+from ..dictset import generator_chunker
+
+
+class _Done():
+    """ sentinel - a thread has finished reading a blob """
+    pass
+
+
+class _ByteBudget():
     """
-    Speed up reading sets of files - such as multiple days worth
-    of log-per-day files.
-    
-    If you care about the order of the records, don't use this.
-    
-    Each file is in it's own thread, so reading a single file 
-    wouldn't benefit from this approach.
+    A semaphore counted in bytes rather than slots.
+
+    Waits are bypassed for the blob the consumer is currently reading
+    ('head'), otherwise in ordered mode later blobs could fill the
+    buffer while the consumer is waiting for the first one.
     """
-    
-    thread_pool = []
-    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.head = -1
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def acquire(self, size: int, index: int) -> bool:
+        with self.condition:
+            while (not self.closed and
+                   index != self.head and
+                   self.used > 0 and
+                   self.used + size > self.limit):
+                self.condition.wait()
+            if self.closed:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size: int):
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+    def set_head(self, index: int):
+        with self.condition:
+            self.head = index
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def threaded_reader(
+        path: str,
+        project: str,
+        date_range: Tuple[Optional[datetime.date], Optional[datetime.date]] = (None, None),
+        max_threads: int = 4,
+        max_buffer_bytes: int = 64*1024*1024,
+        ordered: bool = False,
+        chunk_size: int = 16*1024*1024,
+        lines_per_chunk: int = 1000,
+        partition_filter: Optional[list] = None,
+        read_ahead: int = 0,
+        **kwargs) -> Iterator:
+    """
+    Blob reader which reads a number of blobs at the same time, can be
+    used in place of blob_reader:
+
+        Reader(reader=threaded_reader, from_path='bucket/path', project='project')
+
+    Parameters:
+    - max_threads: the number of blobs to read at once (no more than 8)
+    - max_buffer_bytes: the amount of read but unconsumed data to hold
+    - ordered: return the records in blob order
+    - partition_filter: skip blobs which their manifests show can't match
+    - read_ahead: the number of ranges to download ahead within each blob
+    """
+    # validate request
+    if not project:
+        raise ValueError('Threaded Reader requires Project to be set')
+    if not path:
+        raise ValueError('Threaded Reader requires Path to be set')
+    if kwargs.get('cursor'):
+        raise ValueError('Threaded Reader can not resume from a cursor')
+
+    blobs = [blob for partition, blob in find_blobs_in_date_range(
+            path=path,
+            project=project,
+            date_range=date_range,
+            partition_filter=partition_filter)]
+    if not blobs:
+        return
+
+    work_queue: queue.SimpleQueue = queue.SimpleQueue()
+    for index, blob in enumerate(blobs):
+        work_queue.put((index, blob))
+
+    # in ordered mode each blob has its own reply queue, otherwise
+    # they all share the same one
+    reply_queues: List[queue.SimpleQueue]
+    if ordered:
+        reply_queues = [queue.SimpleQueue() for blob in blobs]
+    else:
+        shared_queue: queue.SimpleQueue = queue.SimpleQueue()
+        reply_queues = [shared_queue] * len(blobs)
+
+    budget = _ByteBudget(max_buffer_bytes)
+    stop = threading.Event()
+
     def thread_process():
         """
         The process inside the threads.
-        
-        1) Get any files off the file queue
-        2) Read the file in chunks - helps with parallelizing
-        3) Put the chunk onto a reply queue
+
+        1) Get a blob off the work queue, exit when there are none left
+        2) Read the blob in chunks of lines
+        3) Wait for space in the buffer and put the chunk on the reply queue
         """
-        file = file_queue.get() # this will wait until there's a record
-        while file:
-            #file_reader = read_file(file) #testing on non-gcs environment
-            file_reader = gcs.blob_reader(project, bucket, file, chunk_size=chunk_size)
-            for chunk in generator_chunker(file_reader, 100):
-                reply_queue.put(chunk)
-            if file_queue.empty():
-                sys.exit()
+        while not stop.is_set():
+            try:
+                index, blob = work_queue.get_nowait()
+            except queue.Empty:
+                return
+            reply_queue = reply_queues[index]
+            reader = _inner_blob_reader(
+                    blob_name=blob.name,
+                    project=project,
+                    bucket=blob.bucket.name,
+                    chunk_size=chunk_size,
+                    blob=blob,
+                    read_ahead=read_ahead)
+            try:
+                for chunk in generator_chunker(reader, lines_per_chunk):
+                    size = sum(len(line) for line in chunk)
+                    if stop.is_set() or not budget.acquire(size, index):
+                        return
+                    reply_queue.put((chunk, size))
+                reply_queue.put(_Done())
+            except Exception as err:  # pass the error to the consumer
+                reply_queue.put(err)
+                return
+            finally:
+                # stop any downloads running ahead of the reader
+                reader.close()
+
+    def drain(reply_queue: queue.SimpleQueue, expected: int):
+        completed = 0
+        while completed < expected:
+            item = reply_queue.get()
+            if isinstance(item, _Done):
+                completed += 1
+            elif isinstance(item, Exception):
+                raise item
             else:
-                file = file_queue.get()
-        sys.exit()
-
-    # establish the queues
-    file_queue = queue.SimpleQueue()
-    reply_queue = queue.SimpleQueue()
-
-    # scale the number of threads, if we have more than the number
-    # of files we're reading, will have threads that never complete
-    t = len(blobs)
-    if t > max_threads:
-        t = max_threads
-    # set a hard limit
-    if t > 8: 
-        t = 8
-
-    # start the threads
-    for _ in range(t):
+                chunk, size = item
+                yield from chunk
+                budget.release(size)
+
+    # scale the number of threads, we don't want more threads than
+    # the number of blobs we're reading, and set a hard limit
+    thread_count = min(max_threads, len(blobs), 8)
+    thread_pool = []
+    for _ in range(thread_count):
         thread = threading.Thread(target=thread_process)
         thread.daemon = True
         thread.start()
         thread_pool.append(thread)
 
-    # put the files in the file queue
-    for blob in blobs:
-        file_queue.put_nowait(blob)
-    
-    # when the threads are all complete and all the records 
-    # have been read from the reply queue, we're done
-    while any([ t.is_alive() for t in thread_pool ]) or not(reply_queue.empty()):
-        records = reply_queue.get()
-        yield from records
-        
-    del file_queue
-    del reply_queue
-    for t in thread_pool:
-        t.kill()
-    for t in thread_pool:
-        t.join()
+    try:
+        if ordered:
+            for index, reply_queue in enumerate(reply_queues):
+                budget.set_head(index)
+                yield from drain(reply_queue, 1)
+        else:
+            yield from drain(shared_queue, len(blobs))
+    finally:
+        # stop the threads, wake any waiting for buffer space
+        stop.set()
+        budget.close()
+        for thread in thread_pool:
+            thread.join()
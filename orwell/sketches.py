@@ -0,0 +1,292 @@
+"""
+SKETCHES
+
+Probabilistic summaries of large datasets which use a small, fixed amount
+of memory regardless of the size of the data they summarize.
+
+HyperLogLog    - approximate count of distinct values
+CountMinSketch - approximate counts of values, and the most frequent values
+KLLSketch      - approximate quantiles (percentiles, medians)
+
+Sketches of different parts of a dataset (e.g. partitions, or the results
+from different processes) can be merged to give a sketch of the whole
+dataset. Sketches can be converted to dictionaries to save them as JSON.
+
+Sketches can be fed from a dictset as it is being iterated:
+
+    latency = KLLSketch()
+    for record in sketch_column(dictset, 'latency', latency):
+        ...
+    print(latency.quantile(0.99))
+
+Values are hashed with blake2b so sketches built in different processes
+can be merged.
+"""
+import math
+import base64
+import hashlib
+from array import array
+from typing import Iterator, Any, List, Tuple, Optional, Union
+from .helpers.bloom_filter import _value_to_bytes
+
+
+def _hash64(value: Any) -> int:
+    return int.from_bytes(hashlib.blake2b(_value_to_bytes(value), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog():
+
+    def __init__(self, precision: int = 14):
+        """
+        Parameters:
+        - precision: 2^precision registers are used, the standard error
+          is about 1.04 / sqrt(2^precision) - 0.8% at the default of 14,
+          which uses 16Kb
+        """
+        if not 4 <= precision <= 18:
+            raise ValueError('HyperLogLog precision must be between 4 and 18')
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def update(self, value: Any):
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        rank = remaining_bits - (hashed & ((1 << remaining_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / registers)
+        estimate = alpha * registers * registers / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * registers and zeros:
+            # small range correction
+            estimate = registers * math.log(registers / zeros)
+        return round(estimate)
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        if other.precision != self.precision:
+            raise ValueError('HyperLogLogs must have the same precision to merge')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "precision": self.precision,
+            "registers": base64.b64encode(self.registers).decode()
+        }
+
+    @staticmethod
+    def from_dict(dictionary: dict) -> 'HyperLogLog':
+        sketch = HyperLogLog(dictionary['precision'])
+        sketch.registers = bytearray(base64.b64decode(dictionary['registers']))
+        return sketch
+
+
+class CountMinSketch():
+
+    def __init__(
+            self,
+            width: int = 2048,
+            depth: int = 5,
+            top_k: int = 0):
+        """
+        Parameters:
+        - width: counters per row, counts are overestimated by up to
+          e / width of the total count
+        - depth: rows, the overestimate is within this bound with a
+          probability of 1 - e^-depth
+        - top_k: the number of most frequent values to track
+        """
+        self.width = width
+        self.depth = depth
+        self.top_k = top_k
+        self.rows = [array('Q', bytes(8 * width)) for i in range(depth)]
+        self.total = 0
+        self.heavy_hitters: dict = {}
+        self._threshold = 0
+
+    def _positions(self, value: Any) -> List[int]:
+        digest = hashlib.blake2b(_value_to_bytes(value), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.width for i in range(self.depth)]
+
+    def update(self, value: Any, count: int = 1):
+        positions = self._positions(value)
+        for row, position in zip(self.rows, positions):
+            row[position] += count
+        self.total += count
+        if self.top_k:
+            self._track(value, min(row[position] for row, position in zip(self.rows, positions)))
+
+    def _track(self, value: Any, estimate: int):
+        """ keep the 'top_k' values with the highest estimates """
+        if value in self.heavy_hitters or len(self.heavy_hitters) < self.top_k:
+            self.heavy_hitters[value] = estimate
+        elif estimate > self._threshold:
+            # the threshold is the lowest estimate being tracked, it is
+            # only recalculated when a value is replaced
+            lowest = min(self.heavy_hitters, key=self.heavy_hitters.get)  # type:ignore
+            if estimate > self.heavy_hitters[lowest]:
+                del self.heavy_hitters[lowest]
+                self.heavy_hitters[value] = estimate
+            self._threshold = min(self.heavy_hitters.values())
+
+    def estimate(self, value: Any) -> int:
+        return min(row[position] for row, position in zip(self.rows, self._positions(value)))
+
+    def top(self, count: Optional[int] = None) -> List[Tuple[Any, int]]:
+        """ the most frequent values and their estimated counts """
+        ranked = sorted(self.heavy_hitters.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:count or self.top_k]
+
+    def merge(self, other: 'CountMinSketch') -> 'CountMinSketch':
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('CountMinSketches must have the same width and depth to merge')
+        for row, other_row in zip(self.rows, other.rows):
+            for position, count in enumerate(other_row):
+                if count:
+                    row[position] += count
+        self.total += other.total
+        candidates = set(self.heavy_hitters) | set(other.heavy_hitters)
+        self.heavy_hitters = {}
+        self._threshold = 0
+        for value in candidates:
+            self._track(value, self.estimate(value))
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "width": self.width,
+            "depth": self.depth,
+            "top_k": self.top_k,
+            "total": self.total,
+            "rows": [base64.b64encode(row.tobytes()).decode() for row in self.rows],
+            "heavy_hitters": [[value, count] for value, count in self.heavy_hitters.items()]
+        }
+
+    @staticmethod
+    def from_dict(dictionary: dict) -> 'CountMinSketch':
+        sketch = CountMinSketch(dictionary['width'], dictionary['depth'], dictionary['top_k'])
+        sketch.total = dictionary['total']
+        for row, encoded in zip(sketch.rows, dictionary['rows']):
+            row[:] = array('Q', base64.b64decode(encoded))
+        sketch.heavy_hitters = {value: count for value, count in dictionary['heavy_hitters']}
+        if sketch.heavy_hitters:
+            sketch._threshold = min(sketch.heavy_hitters.values())
+        return sketch
+
+
+class KLLSketch():
+
+    def __init__(self, k: int = 200):
+        """
+        Parameters:
+        - k: controls the size and accuracy of the sketch, the rank error
+          is about 1.65 / k - under 1% at the default of 200
+        """
+        self.k = k
+        self.levels: List[list] = [[]]
+        self.count = 0
+        self._coin = False
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def update(self, value: Union[int, float]):
+        self.levels[0].append(value)
+        self.count += 1
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def _compress(self):
+        """
+        Halve each level which is over its capacity by keeping every other
+        sorted value, the kept values move up a level where they have twice
+        the weight. This cascades up the levels until all of them fit.
+        """
+        level = self._over_capacity()
+        while level is not None:
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            values = sorted(self.levels[level])
+            # alternate which half is kept, so there's no bias
+            self._coin = not self._coin
+            self.levels[level + 1].extend(values[int(self._coin)::2])
+            self.levels[level] = []
+            level = self._over_capacity()
+
+    def _over_capacity(self) -> Optional[int]:
+        """ the lowest level which is over its capacity, if any """
+        for level, values in enumerate(self.levels):
+            if len(values) >= self._capacity(level):
+                return level
+        return None
+
+    def _weighted(self) -> List[Tuple[Union[int, float], int]]:
+        return sorted((value, 1 << level) for level, values in enumerate(self.levels) for value in values)
+
+    def quantile(self, quantile: float) -> Optional[Union[int, float]]:
+        """ the approximate value at a quantile (0.0 to 1.0) """
+        weighted = self._weighted()
+        if not weighted:
+            return None
+        total = sum(weight for value, weight in weighted)
+        target = quantile * total
+        cumulative = 0
+        for value, weight in weighted:
+            cumulative += weight
+            if cumulative >= target:
+                return value
+        return weighted[-1][0]
+
+    def rank(self, value: Union[int, float]) -> float:
+        """ the approximate proportion of values less than or equal to a value """
+        weighted = self._weighted()
+        total = sum(weight for item, weight in weighted)
+        if not total:
+            return 0.0
+        return sum(weight for item, weight in weighted if item <= value) / total
+
+    def merge(self, other: 'KLLSketch') -> 'KLLSketch':
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, values in enumerate(other.levels):
+            self.levels[level].extend(values)
+        self.count += other.count
+        self._compress()
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "k": self.k,
+            "count": self.count,
+            "levels": self.levels
+        }
+
+    @staticmethod
+    def from_dict(dictionary: dict) -> 'KLLSketch':
+        sketch = KLLSketch(dictionary['k'])
+        sketch.count = dictionary['count']
+        sketch.levels = [list(values) for values in dictionary['levels']]
+        return sketch
+
+
+def sketch_column(
+        dictset: Iterator[dict],
+        column: str,
+        sketch: Union[HyperLogLog, CountMinSketch, KLLSketch]) -> Iterator[dict]:
+    """
+    Adds the values of a column to a sketch as the records are iterated,
+    the records are returned unchanged. Nulls are not added.
+    """
+    update = sketch.update
+    for record in dictset:
+        value = record.get(column)
+        if value is not None:
+            update(value)
+        yield record
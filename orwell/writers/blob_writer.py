@@ -1,10 +1,19 @@
+import json
+import base64
+import hashlib
 import datetime
 from ..helpers import BlobPaths
+from ..helpers.storage_pool import StoragePool
+from ..helpers.manifest import MANIFEST_SUFFIX
+from ..helpers.sequences import SequenceCache, highest_sequence
+from typing import Optional
 try:
-    from google.cloud import storage  # type:ignore
+    from google.api_core.exceptions import PreconditionFailed  # type:ignore
 except ImportError:
     pass
-from typing import Optional
+
+# the last sequence written to each path
+sequences = SequenceCache()
 
 
 def blob_writer(
@@ -12,8 +21,18 @@ def blob_writer(
         target_path: str,
         date: Optional[datetime.date] = None,
         add_extention: str = '',
+        manifest: Optional[dict] = None,
+        reservation: Optional[dict] = None,
         **kwargs):
+    """
+    Uploads a partition to GCS, named with the next sequence at the path.
 
+    'reservation' is a dictionary the name of the blob is recorded in, if
+    the upload is retried with the same dictionary the same name is used.
+    If an earlier attempt was saved but the response was lost, the blob
+    which was saved is recognised by its checksum rather than the
+    partition being saved again under another name.
+    """
     # default the date to today
     if date is None:
         date = datetime.datetime.today()
@@ -27,20 +46,54 @@ def blob_writer(
     bucket, gcs_path, filename, extention = BlobPaths.get_parts(target_path)
 
     # get a reference to the gcs bucket
-    client = storage.Client(project=project)
-    gcs_bucket = client.get_bucket(bucket)
-    
-    # avoid collisions
-    collision_tests = 0
-    maybe_colliding_filename = BlobPaths.build_path(f"{gcs_path}{filename}-{collision_tests:04d}{extention}{add_extention}", date)
-    blob = gcs_bucket.blob(maybe_colliding_filename)
-
-    while blob.exists():
-        collision_tests += 1
-        maybe_colliding_filename = BlobPaths.build_path(f"{gcs_path}{filename}-{collision_tests:04d}{extention}{add_extention}", date)
+    gcs_bucket = StoragePool.get_bucket(project, bucket)
+
+    # avoid collisions - the sequences at the path are listed the first
+    # time it's written to, the upload fails if the blob already exists
+    prefix = BlobPaths.build_path(f"{gcs_path}{filename}-", date)
+    suffix = f"{extention}{add_extention}"
+    key = (project, bucket, prefix, suffix)
+
+    def _find_highest():
+        client = StoragePool.get_client(project)
+        blobs = client.list_blobs(bucket_or_name=gcs_bucket, prefix=prefix)
+        return highest_sequence((blob.name for blob in blobs), prefix, suffix)
+
+    if reservation is None:
+        reservation = {}
+    while True:
+        retrying = 'name' in reservation
+        if not retrying:
+            sequence = sequences.next(key, _find_highest)
+            reservation['name'] = f"{prefix}{sequence:04d}{suffix}"
+        maybe_colliding_filename = reservation['name']
         blob = gcs_bucket.blob(maybe_colliding_filename)
+        try:
+            # save the blob
+            blob.upload_from_filename(source_file_name, if_generation_match=0)
+            break
+        except PreconditionFailed:
+            if retrying and _is_saved(gcs_bucket, maybe_colliding_filename, source_file_name):
+                break
+            # another writer has used the name, list the sequences again
+            sequences.forget(key)
+            del reservation['name']
 
-    # save the blob
-    blob.upload_from_filename(source_file_name)
+    # save the manifest alongside the partition
+    if manifest is not None:
+        manifest_blob = gcs_bucket.blob(maybe_colliding_filename + MANIFEST_SUFFIX)
+        manifest_blob.upload_from_string(json.dumps(manifest), content_type='application/json')
 
     return maybe_colliding_filename
+
+
+def _is_saved(gcs_bucket, blob_name: str, source_file_name: str) -> bool:
+    """ tests if a blob has the same content as a file, by their MD5 """
+    blob = gcs_bucket.get_blob(blob_name)
+    if blob is None or not blob.md5_hash:
+        return False
+    digest = hashlib.md5()  # nosec - a checksum, not for security
+    with open(source_file_name, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode() == blob.md5_hash
@@ -1,33 +1,75 @@
 from ..helpers import BlobPaths
-from os.path import exists
+from ..helpers.manifest import MANIFEST_SUFFIX
+from ..helpers.sequences import SequenceCache, highest_sequence
 import os
+import json
 import shutil
 from typing import Optional
 import datetime
 
+# the last sequence written to each path
+sequences = SequenceCache()
+
 
 def file_writer(
         source_file_name: str,
         target_path: str,
         date: Optional[datetime.date] = None,
         add_extention: str = '',
+        manifest: Optional[dict] = None,
+        reservation: Optional[dict] = None,
         **kwargs):
-    
+    """
+    Copies a partition to the file system, named with the next sequence at
+    the path. 'reservation' is a dictionary the name of the file is
+    recorded in, if the copy is retried with the same dictionary the same
+    file is written to.
+    """
+
     if date is None:
         date = datetime.datetime.today()
 
     filename, extention = BlobPaths.split_filename(target_path)
 
-    # avoid collisions
-    collision_tests = 0
-    maybe_colliding_filename = BlobPaths.build_path(f"{filename}-{collision_tests:04d}{extention}{add_extention}", date)
-    while exists(maybe_colliding_filename):
-        collision_tests += 1
-        maybe_colliding_filename = BlobPaths.build_path(f"{filename}-{collision_tests:04d}{extention}{add_extention}", date)
-    unique_filename = maybe_colliding_filename
-
-    bucket, path, filename, ext = BlobPaths.get_parts(unique_filename)
-    os.makedirs(bucket + '/' + path, exist_ok=True)
-    
+    # avoid collisions - the sequences in the folder are listed the first
+    # time it's written to, the file is only created if it doesn't exist
+    prefix = BlobPaths.build_path(f"{filename}-", date)
+    suffix = f"{extention}{add_extention}"
+    folder = os.path.dirname(prefix)
+    key = (os.path.abspath(prefix), suffix)
+
+    def _find_highest():
+        try:
+            names = os.listdir(folder or '.')
+        except FileNotFoundError:
+            return -1
+        return highest_sequence(names, os.path.basename(prefix), suffix)
+
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    if reservation is None:
+        reservation = {}
+    if 'name' in reservation:
+        # an earlier attempt created the file, so it can be overwritten
+        saved_filename = reservation['name']
+        target = os.open(saved_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    while 'name' not in reservation:
+        sequence = sequences.next(key, _find_highest)
+        saved_filename = f"{prefix}{sequence:04d}{suffix}"
+        try:
+            target = os.open(saved_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            reservation['name'] = saved_filename
+        except FileExistsError:
+            # another writer has used the name, list the sequences again
+            sequences.forget(key)
+
     # save
-    return shutil.copy(source_file_name, unique_filename)
+    with os.fdopen(target, 'wb') as target_file, open(source_file_name, 'rb') as source_file:
+        shutil.copyfileobj(source_file, target_file)
+
+    # save the manifest alongside the partition
+    if manifest is not None:
+        with open(saved_filename + MANIFEST_SUFFIX, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+    return saved_filename
@@ -0,0 +1,116 @@
+"""
+Upload Pool
+
+Saving a partition to its destination (for example, uploading it to GCS)
+can take much longer than writing it, the pool saves closed partitions in
+background threads so the Writer can carry on writing the next partition.
+
+- 'workers' partitions are saved at the same time
+- a failed save is retried 'retries' times, waiting 'backoff_seconds'
+  before the first retry and doubling the wait before each retry after that
+- at most 'max_pending' partitions are waiting to be saved, submitting
+  another waits until one has been saved, so the temporary files can't
+  fill the local disk if saving falls behind
+
+The partition and its manifest are saved by the same call to the writer, so
+are retried together. The writer is passed a 'reservation' dictionary, which
+it records the name it saves the partition as in, so retries save the
+partition with the same name rather than saving it again with a new one.
+Writers which don't take a 'reservation' aren't passed one.
+
+The temporary file is removed once it has been saved, partitions which
+can't be saved keep their temporary file and are listed in 'failed', they
+can be submitted again with retry_failed.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from ..readers.reader import _accepts
+
+
+class UploadPool():
+
+    def __init__(
+            self,
+            writer: Callable,
+            workers: int = 4,
+            retries: int = 3,
+            backoff_seconds: float = 1.0,
+            max_pending: int = 8):
+        self.writer = writer
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self._reserves = _accepts(writer, 'reservation')
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._backlog = threading.BoundedSemaphore(max_pending)
+        self._changed = threading.Condition()
+        self._pending: Dict[str, dict] = {}
+        self._failed: List[dict] = []
+
+    def submit(self, source_file_name: str, **kwargs):
+        """ saves a file with the writer, waits if the backlog is full """
+        self._backlog.acquire()
+        if self._reserves:
+            kwargs.setdefault('reservation', {})
+        with self._changed:
+            self._pending[source_file_name] = kwargs
+        self._executor.submit(self._upload, source_file_name, kwargs)
+
+    def _upload(self, source_file_name: str, kwargs: dict):
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.writer(source_file_name=source_file_name, **kwargs)
+                    break
+                except Exception as error:
+                    if attempt == self.retries:
+                        with self._changed:
+                            self._failed.append({
+                                "source_file_name": source_file_name,
+                                "error": error,
+                                "attempts": attempt + 1,
+                                "kwargs": kwargs})
+                        return
+                    time.sleep(self.backoff_seconds * (2 ** attempt))
+            try:
+                os.remove(source_file_name)
+            except OSError:  # nosec - if it fails, it doesn't /really/ matter
+                pass
+        finally:
+            with self._changed:
+                self._pending.pop(source_file_name, None)
+                self._changed.notify_all()
+            self._backlog.release()
+
+    @property
+    def pending(self) -> List[str]:
+        """ the temporary files waiting to be saved """
+        with self._changed:
+            return list(self._pending)
+
+    @property
+    def failed(self) -> List[dict]:
+        """ the files which couldn't be saved, with the last error """
+        with self._changed:
+            return list(self._failed)
+
+    def retry_failed(self):
+        """ submits the files which couldn't be saved again """
+        with self._changed:
+            failed, self._failed = self._failed, []
+        for upload in failed:
+            self.submit(upload["source_file_name"], **upload["kwargs"])
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits for the pending files to be saved or to fail, returns False
+        if files are still pending after 'timeout' seconds.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._pending, timeout)
+
+    def shutdown(self):
+        self.wait()
+        self._executor.shutdown(wait=True)
@@ -27,15 +27,54 @@ Paths for the data writer can contain datetime string formatting,
 the string will be formatted before being created into folders. The
 changing of dates is handled by the worker thread, this may lag a 
 second before it forces the folder to change.
+
+A manifest can be written alongside each partition, recording the number
+of records in the partition and, for the fields in 'manifest_fields', the
+minimum and maximum values and the number of nulls. The fields in
+'bloom_fields' also have a Bloom filter of their values. Readers use the
+manifests to skip partitions which can't contain the records they are
+looking for.
+
+Writers can be shared between threads. Records are serialized before
+taking the Writer's lock, so only the write itself is done one thread at
+a time; append_many writes a list of records while holding the lock
+once. When committing on write, threads share commits (group commit) -
+a thread waiting for a commit finds its record has been committed by the
+thread before it, so under load there are far fewer commits than writes.
+
+In 'async' mode append only puts the record on a bounded queue, a
+background thread validates, serializes and writes the records and closes
+the partitions, so callers don't wait for a partition to be saved. When the
+queue is full, append waits for space, drops the record or raises
+queue.Full, as set by 'when_full'. The records are serialized after append
+returns, so shouldn't be changed once they've been appended. flush waits for
+the queued records to be written and close flushes and closes the Writer.
+Errors in the background thread are raised by the next flush or close.
+
+Closed partitions are saved by the writer (for example, blob_writer) as
+they are closed unless 'upload_workers' is set, then they are saved by a
+pool of threads (see upload_pool.py) which retries failed saves, and
+writing carries on into the next partition. wait_for_uploads waits for the
+saves to finish, pending_uploads and failed_uploads list the partitions
+which are waiting to be saved and which couldn't be saved.
+
+    writer = Writer(mode='async', when_full='drop')
+    writer.append(record)               # or 'await writer.append_async(record)'
+    writer.close()
 """
 import lzma
 import time
 import os
+import queue
+import asyncio
 import threading
 import tempfile
 import datetime
 from .blob_writer import blob_writer
-from typing import Callable, Optional, Any, Union
+from .upload_pool import UploadPool
+from ..helpers.manifest import ManifestBuilder
+from ..dictset import _fingerprint_record
+from typing import Callable, Optional, Any, Union, List, Iterable, Tuple
 from gva.data.validator import Schema  # type:ignore
 try:
     import ujson as json
@@ -56,6 +95,16 @@ class Writer():
         use_worker_thread: bool = True,
         idle_timeout_seconds: int = 60,
         date: Optional[datetime.date] = None,
+        write_manifest: bool = False,
+        manifest_fields: Optional[List[str]] = None,
+        bloom_fields: Optional[List[str]] = None,
+        mode: str = 'sync',
+        queue_size: int = 10000,
+        when_full: str = 'block',
+        upload_workers: int = 0,
+        upload_retries: int = 3,
+        upload_backoff_seconds: float = 1.0,
+        max_pending_uploads: int = 8,
         **kwargs):
         """
         DataWriter
@@ -72,6 +121,20 @@ class Writer():
         - idle_timeout_seconds: the time with no new writes to a partition before
           closing it and creating a new partition regardless of the records
         - compress: compress the completed file using LZMA
+        - write_manifest: write a manifest alongside each partition
+        - manifest_fields: the fields to record min, max and nulls for
+        - bloom_fields: the fields to create a Bloom filter for
+        - mode: 'sync' writes records as they are appended, 'async' queues
+          them to be written by a background thread
+        - queue_size: the number of records which can be queued in 'async' mode
+        - when_full: 'block', 'drop' or 'raise' when the queue is full
+        - upload_workers: the number of partitions to save at the same time
+          in background threads, 0 saves partitions as they are closed
+        - upload_retries: the number of times to retry saving a partition
+        - upload_backoff_seconds: the wait before the first retry, doubling
+          for each retry after that
+        - max_pending_uploads: the number of closed partitions which can be
+          waiting to be saved before closing another partition waits
         """
         self.to_path = to_path
         self.partition_size = partition_size
@@ -87,6 +150,39 @@ class Writer():
         self.compress = compress
         self.file_name: Optional[str] = None
         self.date = date
+        self.write_manifest = write_manifest
+        self.manifest_fields = manifest_fields
+        self.bloom_fields = bloom_fields
+        self.manifest_builder: Optional[ManifestBuilder] = None
+        # guards the partition, shared by appending threads and the worker
+        self._lock = threading.RLock()
+        # group commit - writes are numbered, commits record the last
+        # write they included
+        self._commit_lock = threading.Lock()
+        self._writes = 0
+        self._committed = 0
+        if mode not in ('sync', 'async'):
+            raise ValueError(F"mode must be 'sync' or 'async', not '{mode}'")
+        if when_full not in ('block', 'drop', 'raise'):
+            raise ValueError(F"when_full must be 'block', 'drop' or 'raise', not '{when_full}'")
+        self.mode = mode
+        self.when_full = when_full
+        self.dropped = 0
+        self._error: Optional[BaseException] = None
+        self._queue: Optional[queue.Queue] = None
+        self._uploads: Optional[UploadPool] = None
+        if upload_workers > 0:
+            self._uploads = UploadPool(
+                    writer=writer,
+                    workers=upload_workers,
+                    retries=upload_retries,
+                    backoff_seconds=upload_backoff_seconds,
+                    max_pending=max_pending_uploads)
+        if mode == 'async':
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._pipeline = threading.Thread(target=_async_writer_thread, args=(self,))
+            self._pipeline.daemon = True
+            self._pipeline.start()
 
         if use_worker_thread:
             self.thread = threading.Thread(target=_worker_thread, args=(self,))
@@ -103,69 +199,230 @@ class Writer():
             pass
         return file_name
 
-    def append(self, record: dict = {}):
+    def _serialize(self, record: dict) -> Optional[Tuple[dict, str, Optional[int]]]:
         """
-        Saves new entries to the partition; creating a new partition
-        if one isn't active.
+        Validate and serialize a record, None if it isn't valid. The
+        record's fingerprint for the manifest is also calculated here, so
+        it isn't calculated while holding the lock.
         """
         # this is a killer - check the new record conforms to the
         # schema before bothering with anything else
         if self.schema and not self.schema.validate(subject=record, raise_exception=True):
             print(F'Validation Failed ({self.schema.last_error}):', record)
+            return None
+        record_fingerprint = _fingerprint_record(record) if self.write_manifest else None
+        return record, json.dumps(record) + '\n', record_fingerprint
+
+    def append(self, record: dict = {}):
+        """
+        Saves new entries to the partition; creating a new partition
+        if one isn't active. In 'async' mode the record is queued, False is
+        returned if it was dropped because the queue was full.
+        """
+        if self._queue is not None:
+            return self._enqueue(record)
+        serialized = self._serialize(record)
+        if serialized is None:
             return False
+        with self._lock:
+            self._write(*serialized)
+            write = self._writes
+        if self.commit_on_write:
+            self._commit(write)
+        return True
 
-        self.last_write = time.time_ns()
+    def append_many(self, records: Iterable[dict]) -> int:
+        """
+        Saves a set of records, the records are written while holding the
+        lock once and are committed together. Returns the number of records
+        written, records which fail validation aren't written. In 'async'
+        mode returns the number of records queued.
+        """
+        if self._queue is not None:
+            return sum(self._enqueue(record) for record in records)
+        batch = [serialized for serialized in map(self._serialize, records) if serialized is not None]
+        return self._write_many(batch)
+
+    def _write_many(self, batch: List[Tuple[dict, str, Optional[int]]]) -> int:
+        """ write serialized records, committing them together """
+        if not batch:
+            return 0
+        with self._lock:
+            for serialized in batch:
+                self._write(*serialized)
+            write = self._writes
+        if self.commit_on_write:
+            self._commit(write)
+        return len(batch)
 
-        # serialize the record
-        serialized = json.dumps(record) + '\n'
+    def _write(self, record: dict, serialized: str, record_fingerprint: Optional[int] = None):
+        """ write a serialized record, the lock must be held """
+        self.last_write = time.time_ns()
         len_serial = len(serialized)
 
-        with threading.Lock():
-            # if this write would exceed the partition
-            self.bytes_left_to_write_in_partition -= len_serial
-            if self.bytes_left_to_write_in_partition <= 0:
-                if len_serial > self.partition_size:
-                    raise ValueError('Record size is larger than partition.')
-                self.on_partition_closed()
-
-            # if we don't have a current file to write to, create one
-            if not self.file_writer:
-                self.file_name = self._get_temp_file_name()
-                self.file_writer = _PartFileWriter(
-                        file_name=self.file_name,  # type:ignore
-                        commit_on_write=self.commit_on_write,
-                        compress=self.compress)
-                self.bytes_left_to_write_in_partition = self.partition_size
-
-            # write the record to the file
-            self.file_writer.append(serialized)
+        # if this write would exceed the partition
+        self.bytes_left_to_write_in_partition -= len_serial
+        if self.bytes_left_to_write_in_partition <= 0:
+            if len_serial > self.partition_size:
+                raise ValueError('Record size is larger than partition.')
+            self.on_partition_closed()
 
+        # if we don't have a current file to write to, create one
+        if not self.file_writer:
+            self.file_name = self._get_temp_file_name()
+            self.file_writer = _PartFileWriter(
+                    file_name=self.file_name,  # type:ignore
+                    compress=self.compress)
+            self.bytes_left_to_write_in_partition = self.partition_size - len_serial
+            if self.write_manifest:
+                self.manifest_builder = ManifestBuilder(
+                        fields=self.manifest_fields,
+                        bloom_fields=self.bloom_fields)
+
+        # write the record to the file
+        self.file_writer.append(serialized)
+        self._writes += 1
+        if self.manifest_builder:
+            self.manifest_builder.add(record, len_serial, record_fingerprint)
+
+    def _commit(self, write: int):
+        """
+        Commit the writes up to and including 'write'. Threads wait for
+        each other to commit, when a thread's turn comes its write may
+        have been committed by an earlier thread.
+        """
+        with self._commit_lock:
+            if self._committed >= write:
+                return
+            with self._lock:
+                file_writer = self.file_writer
+                writes = self._writes
+            # closed partitions have already been committed
+            if file_writer:
+                file_writer.commit()
+            self._committed = writes
+
+    def _enqueue(self, record: dict) -> bool:
+        try:
+            self._queue.put(record, block=self.when_full == 'block')  # type:ignore
+        except queue.Full:
+            if self.when_full == 'raise':
+                raise
+            self.dropped += 1
+            return False
         return True
 
+    async def append_async(self, record: dict = {}) -> bool:
+        """
+        append for asyncio, waiting for space in the queue doesn't block the
+        event loop. In 'sync' mode the record is written in another thread.
+        """
+        if self._queue is not None:
+            try:
+                self._queue.put_nowait(record)
+                return True
+            except queue.Full:
+                if self.when_full != 'block':
+                    return self._enqueue(record)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.append, record)
+
+    def flush(self):
+        """
+        Waits for the queued records to be written and commits them to the
+        partition file, raises any error from writing them.
+        """
+        if self._queue is not None:
+            self._queue.join()
+        with self._lock:
+            if self.file_writer:
+                self.file_writer.commit()
+        error, self._error = self._error, None
+        if error:
+            raise error
+
+    def close(self):
+        """
+        Flushes the Writer, closes the current partition and stops the
+        background threads.
+        """
+        try:
+            self.flush()
+        finally:
+            if self._queue is not None:
+                self._queue.put(None)
+                self._pipeline.join()
+                self._queue = None
+            self.use_worker_thread = False
+            self.on_partition_closed()
+            if self._uploads:
+                self._uploads.shutdown()
+
+    def wait_for_uploads(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits for the closed partitions to be saved, returns False if some
+        are still waiting after 'timeout' seconds.
+        """
+        if self._uploads:
+            return self._uploads.wait(timeout)
+        return True
+
+    @property
+    def pending_uploads(self) -> List[str]:
+        """ the temporary files of the partitions waiting to be saved """
+        return self._uploads.pending if self._uploads else []
+
+    @property
+    def failed_uploads(self) -> List[dict]:
+        """
+        The partitions which couldn't be saved, their temporary files are
+        kept so they can be saved again with retry_failed_uploads.
+        """
+        return self._uploads.failed if self._uploads else []
+
+    def retry_failed_uploads(self):
+        if self._uploads:
+            self._uploads.retry_failed()
+
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        self.on_partition_closed()
+        self.close()
 
     def on_partition_closed(self):
-        # finalize the writer
-        if self.file_writer:
-            self.file_writer.finalize()
-        # save the file to it's destination
-        if self.file_name:
-            self.writer(
-                source_file_name=self.file_name,
-                target_path=self.to_path,
-                add_extention='.lzma' if self.compress else '',
-                date=self.date,
-                **self.kwargs)
-        try:
-            os.remove(self.file_name)
-        except (OSError, TypeError):
-            pass
-        self.file_writer = None
-        self.file_name = None
+        with self._lock:
+            # finalize the writer
+            if self.file_writer:
+                self.file_writer.finalize()
+            # save the file to it's destination
+            if self.file_name:
+                kwargs = self.kwargs
+                if self.manifest_builder:
+                    kwargs = {**kwargs, "manifest": self.manifest_builder.to_dict()}
+                if self._uploads:
+                    # the pool removes the file once it has been saved
+                    self._uploads.submit(
+                        self.file_name,
+                        target_path=self.to_path,
+                        add_extention='.lzma' if self.compress else '',
+                        date=self.date,
+                        **kwargs)
+                    self.file_name = None
+                else:
+                    self.writer(
+                        source_file_name=self.file_name,
+                        target_path=self.to_path,
+                        add_extention='.lzma' if self.compress else '',
+                        date=self.date,
+                        **kwargs)
+            try:
+                os.remove(self.file_name)
+            except (OSError, TypeError):
+                pass
+            self.file_writer = None
+            self.file_name = None
+            self.manifest_builder = None
 
     def __del__(self):
         self.on_partition_closed()
@@ -181,20 +438,19 @@ class _PartFileWriter():
     def __init__(
             self,
             file_name: str,  # type:ignore
-            commit_on_write: bool = False,
             compress: bool = False):
         self.file: Any = open(file_name, mode='wb')
         if compress:
             self.file = lzma.open(self.file, mode='wb')
-        self.commit_on_write = commit_on_write
 
     def append(self, record: str = ""):
         self.file.write(record.encode())
-        if self.commit_on_write:
-            try:
-                self.file.flush()
-            except ValueError:
-                pass
+
+    def commit(self):
+        try:
+            self.file.flush()
+        except ValueError:  # the file has been closed, which flushed it
+            pass
 
     def finalize(self):
         try:
@@ -207,6 +463,43 @@ class _PartFileWriter():
         self.finalize()
 
 
+def _async_writer_thread(data_writer: Writer):
+    """
+    Writes the records queued in 'async' mode, the records waiting in the
+    queue are written together (see append_many) so are committed together.
+    A None on the queue stops the thread.
+    """
+    records_queue: queue.Queue = data_writer._queue  # type:ignore
+    running = True
+    while running:
+        items = [records_queue.get()]
+        while len(items) < 1000:
+            try:
+                items.append(records_queue.get_nowait())
+            except queue.Empty:
+                break
+        running = None not in items
+        try:
+            batch = []
+            for record in items:
+                if record is None:
+                    continue
+                # an invalid record doesn't stop the others being written
+                try:
+                    serialized = data_writer._serialize(record)
+                except Exception as error:
+                    data_writer._error = error
+                    continue
+                if serialized is not None:
+                    batch.append(serialized)
+            data_writer._write_many(batch)
+        except Exception as error:
+            data_writer._error = error
+        finally:
+            for _ in items:
+                records_queue.task_done()
+
+
 def _worker_thread(data_writer: Writer):
     """
     Method to run an a separate thread performing the following tasks
@@ -223,15 +516,12 @@ def _worker_thread(data_writer: Writer):
     """
     while data_writer.use_worker_thread:
         if (time.time_ns() - data_writer.last_write) > (data_writer.idle_timeout_seconds * 1e9):
-            with threading.Lock():
-                data_writer.on_partition_closed()
+            data_writer.on_partition_closed()
 #        if not data_writer.formatted_path == datetime.datetime.today().strftime(data_writer.path):
 #            change_partition = True
 
         # try flushing writes
-        try:
+        with data_writer._lock:
             if data_writer.file_writer:
-                data_writer.file_writer.file.flush()
-        except ValueError:  # nosec - if it fails, it doesn't /really/ matter
-            pass
+                data_writer.file_writer.commit()
         time.sleep(1)
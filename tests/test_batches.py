@@ -0,0 +1,57 @@
+import os
+import sys
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import pytest
+from orwell.dictset import select_from_dictset, distinct, group_by
+numpy = pytest.importorskip('numpy')
+from orwell.batches import (
+        ColumnBatch, to_batches, to_dictset, select_from_batches, set_batch_column,
+        distinct_batches, limit_batches, group_batches)
+
+
+RECORDS = [{'id': i, 'status': [200, 500, None][i % 3], 'latency': i / 4, 'user': ['bob', 'alice', None, 'eve'][i % 4],
+            'tags': ['a', 'b'] if i % 5 == 0 else None} for i in range(100)]
+
+
+def test_column_batches():
+
+    batch = ColumnBatch.from_records(RECORDS)
+    assert batch.get('id').dtype == numpy.int64
+    assert batch.get('latency').dtype == numpy.float64
+    assert batch.get('user').dtype == object
+    assert batch.to_records() == RECORDS
+    assert list(to_dictset(to_batches(RECORDS, 7))) == RECORDS
+
+    condition = "status != 500 and (latency > 10 or user in ('alice', 'eve'))"
+    selected = list(to_dictset(select_from_batches(to_batches(RECORDS, 7), ['id', 'status'], condition)))
+    assert selected == list(select_from_dictset(RECORDS, ['id', 'status'], condition))
+    selected = list(to_dictset(select_from_batches(to_batches(RECORDS, 7), condition=lambda r: r['id'] > 95)))
+    assert selected == RECORDS[96:]
+
+    seconds = next(set_batch_column(to_batches(RECORDS), 'seconds', lambda batch: batch.get('latency') * 60))
+    assert seconds.column('seconds')[:3] == [0.0, 15.0, 30.0]
+
+    unique = list(to_dictset(distinct_batches(to_batches(RECORDS, 7), ['status', 'tags'])))
+    assert unique == list(distinct(RECORDS, ['status', 'tags']))
+    for columns in (['status'], ['status', 'latency'], ['user', 'status'], ['*']):
+        unique = list(to_dictset(distinct_batches(to_batches(RECORDS, 7), columns)))
+        assert unique == list(distinct(to_dictset(to_batches(RECORDS, 7)), columns))
+    # missing values are nulls, and equal values are the same, unlike distinct
+    records = [{'id': 1, 'value': 1}, {'id': 2, 'value': 1.0}, {'id': 3, 'value': None}, {'id': 4}]
+    unique = list(to_dictset(distinct_batches(to_batches(records, 2), ['value'])))
+    assert [record['id'] for record in unique] == [1, 3]
+    assert [record['id'] for record in distinct(records, ['value'])] == [1, 2, 3, 4]
+    flags = [{'flag': True}, {'flag': 1}]
+    assert len(list(to_dictset(distinct_batches(to_batches(flags), ['flag'])))) == 1
+    assert len(list(distinct(flags, ['flag']))) == 2
+    assert sum(len(batch) for batch in limit_batches(to_batches(RECORDS, 7), 20)) == 20
+
+    aggregations = [('count', '*'), ('count', 'status'), ('sum', 'id'), ('min', 'latency'), ('max', 'user'),
+                    ('mean', 'latency'), ('first', 'tags'), ('last', 'status')]
+    for columns in (['user'], ['status', 'user'], ['id']):
+        expected = sorted(group_by(RECORDS, columns, aggregations), key=str)
+        assert sorted(group_batches(to_batches(RECORDS, 7), columns, aggregations), key=str) == expected
+
+
+if __name__ == "__main__":
+    test_column_batches()
@@ -0,0 +1,168 @@
+import os
+import sys
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import random
+import functools
+import orwell.dictset
+from orwell.dictset import join_dictsets, merge_join, sort_dictset, group_by, merge_groups, distinct, JOINS
+from orwell.dictset import top_n, merge_top_n
+from orwell.dictset import dictsets_match, fingerprint, fingerprint_partitions, diff_dictsets, diff_partitions
+
+
+LEFT = [{'id': i, 'group': i % 3, 'name': f'left-{i}'} for i in range(10)] + [{'name': 'no id'}]
+RIGHT = [{'id': i, 'group': i % 3, 'value': i * 10} for i in range(0, 10, 2)] + [{'id': 4, 'group': 1, 'value': 41}]
+
+
+def _ids(dictset):
+    return sorted((r.get('id', -1), r.get('value', -1)) for r in dictset)
+
+
+def test_join_types():
+
+    for memory_limit in (256*1024*1024, 10):
+        inner = list(join_dictsets(LEFT, RIGHT, 'id', memory_limit=memory_limit))
+        assert _ids(inner) == [(0, 0), (2, 20), (4, 40), (4, 41), (6, 60), (8, 80)]
+        assert {'id': 2, 'group': 2, 'name': 'left-2', 'value': 20} in inner
+
+        left = list(join_dictsets(LEFT, RIGHT, 'id', JOINS.LEFT_JOIN, memory_limit=memory_limit))
+        assert len(left) == 12
+
+        semi = list(join_dictsets(LEFT, RIGHT, 'id', JOINS.SEMI_JOIN, memory_limit=memory_limit))
+        assert _ids(semi) == [(0, -1), (2, -1), (4, -1), (6, -1), (8, -1)]
+
+        anti = list(join_dictsets(LEFT, RIGHT, 'id', JOINS.ANTI_JOIN, memory_limit=memory_limit))
+        assert _ids(anti) == [(-1, -1), (1, -1), (3, -1), (5, -1), (7, -1), (9, -1)]
+
+        composite = list(join_dictsets(LEFT, RIGHT, ['id', 'group'], memory_limit=memory_limit))
+        assert _ids(composite) == [(0, 0), (2, 20), (4, 40), (4, 41), (6, 60), (8, 80)]
+
+    # only a sample of the right table is measured when it fits in memory
+    serialized = []
+    serialize = orwell.dictset._serialize
+    orwell.dictset._serialize = lambda record: serialized.append(record) or serialize(record)
+    try:
+        right = [{'id': i} for i in range(640)]
+        assert len(list(join_dictsets(right, right, 'id'))) == 640
+        assert len(serialized) == 640 // orwell.dictset.JOIN_SAMPLE_RATE
+    finally:
+        orwell.dictset._serialize = serialize
+
+
+def test_sort_dictset():
+
+    records = [{'id': i, 'value': random.choice([None, 'a', 'b', 1, 2.5, True])} for i in range(500)]
+    for memory_limit in (256*1024*1024, 500):
+        ordered = list(sort_dictset(records, ['value', 'id'], memory_limit=memory_limit))
+        assert len(ordered) == 500
+        values = [r['value'] for r in ordered]
+        # numbers, then strings, then nulls
+        assert values.index(None) > max(i for i, v in enumerate(values) if isinstance(v, str))
+        assert all(ordered[i]['id'] < ordered[i + 1]['id'] for i in range(499) if ordered[i]['value'] == ordered[i + 1]['value'])
+
+        descending = list(sort_dictset(records, 'id', descending=True, memory_limit=memory_limit))
+        assert [r['id'] for r in descending] == list(range(499, -1, -1))
+
+        # nulls and missing values sort last in descending order too
+        descending = list(sort_dictset(records + [{'id': 500}], 'value', descending=True, memory_limit=memory_limit))
+        values = [r.get('value') for r in descending]
+        assert values.index(None) == len(values) - values.count(None)
+        assert values.index(None) > max(i for i, v in enumerate(values) if isinstance(v, (int, float)))
+
+
+def test_merge_join():
+
+    left = list(sort_dictset(LEFT, 'id'))
+    right = list(sort_dictset(RIGHT, 'id'))
+    for join_type in (JOINS.INNER_JOIN, JOINS.LEFT_JOIN, JOINS.SEMI_JOIN, JOINS.ANTI_JOIN):
+        merged = list(merge_join(left, right, 'id', join_type))
+        hashed = list(join_dictsets(LEFT, RIGHT, 'id', join_type))
+        assert _ids(merged) == _ids(hashed), join_type
+
+
+def test_group_by():
+
+    records = [{'status': i % 3, 'latency': i, 'user': None if i % 5 == 0 else f'user-{i}'} for i in range(30)]
+    aggregations = [('count', '*'), ('count', 'user'), ('sum', 'latency'), ('min', 'latency'),
+                    ('max', 'latency'), ('mean', 'latency', 'average'), ('first', 'user'), ('last', 'user')]
+
+    for max_groups in (1000, 1):
+        groups = {g['status']: g for g in group_by(records, 'status', aggregations, max_groups=max_groups)}
+        assert groups[0] == {'status': 0, 'COUNT(*)': 10, 'COUNT(user)': 8, 'SUM(latency)': 135, 'MIN(latency)': 0,
+                             'MAX(latency)': 27, 'average': 13.5, 'FIRST(user)': None, 'LAST(user)': 'user-27'}
+
+    # partial results from two halves combine to the same answer
+    partials = list(group_by(records[:17], 'status', aggregations, partial=True))
+    partials += list(group_by(records[17:], 'status', aggregations, partial=True))
+    merged = {g['status']: g for g in merge_groups(partials, 'status', aggregations)}
+    assert merged == groups
+
+    composite = list(group_by(records, ['status', 'user'], [('count', '*')]))
+    assert len(composite) == 27
+
+
+def test_distinct():
+
+    records = [{'id': i % 5000, 'group': i % 7} for i in range(20000)]
+    assert len(list(distinct(records, ['id']))) == 5000
+    assert len(list(distinct(records, ['group']))) == 7
+    assert len(list(distinct(records, ['id', 'group']))) == len({(r['id'], r['group']) for r in records})
+
+    # the approximate mode may drop a few distinct records, but never keeps duplicates
+    approximate = list(distinct(records, ['id'], approximate=True, expected_records=5000, false_positive_rate=0.01))
+    assert 4900 < len(approximate) <= 5000
+    assert len({r['id'] for r in approximate}) == len(approximate)
+
+
+def test_fingerprints():
+
+    records = [{'id': i, 'value': i % 3} for i in range(100)]
+    assert dictsets_match(records, reversed(records))
+    # duplicates don't cancel each other out
+    assert not dictsets_match(records + records[:1] * 2, records)
+    assert fingerprint(records) == fingerprint([{'value': r['value'], 'id': r['id']} for r in records])
+
+    changed = records[:50] + [{'id': 50, 'value': -1}] + records[51:] + records[:1]
+    assert sorted(diff_dictsets(records, changed), key=str) == [
+        ('+', {'id': 0, 'value': 0}), ('+', {'id': 50, 'value': -1}), ('-', {'id': 50, 'value': 2})]
+
+    # the order of the keys doesn't matter, in nested records too
+    nested = [{'id': 1, 'tags': {'a': 1, 'b': [{'x': 1, 'y': 2}]}}]
+    reordered = [{'tags': {'b': [{'y': 2, 'x': 1}], 'a': 1}, 'id': 1}]
+    assert fingerprint(nested) == fingerprint(reordered)
+    assert list(diff_dictsets(nested, reordered)) == []
+
+    before = {'a': functools.partial(list, records), 'b': functools.partial(list, records[:10])}
+    after = {'a': functools.partial(list, changed), 'b': functools.partial(list, records[:10][::-1]),
+             'c': functools.partial(list, records[:1])}
+    assert fingerprint_partitions(before, workers=2) == fingerprint_partitions(before)
+    differences = list(diff_partitions(before, after, workers=2))
+    assert len(differences) == 4
+    assert {name for name, change, record in differences} == {'a', 'c'}
+
+
+def test_top_n():
+
+    records = [{'id': i, 'latency': random.choice([None, 1, 2, 3, 4.5, 5])} for i in range(500)]
+    for descending in (True, False):
+        expected = list(sort_dictset(records, ['latency'], descending=descending))[:20]
+        assert list(top_n(records, 'latency', 20, descending)) == expected
+        halves = [top_n(records[:250], 'latency', 20, descending), top_n(records[250:], 'latency', 20, descending)]
+        assert list(merge_top_n(halves, 'latency', 20, descending)) == expected
+    assert len(list(top_n(records, ['latency', 'id'], 1000))) == 500
+
+    # records without a value, or with a null value, are never the top
+    records = [{'id': 1, 'latency': 5}, {'id': 2}, {'id': 3, 'latency': 9}, {'id': 4, 'latency': None}]
+    assert [r['id'] for r in top_n(records, 'latency', 2)] == [3, 1]
+    assert [r['id'] for r in top_n(records, 'latency', 2, descending=False)] == [1, 3]
+    assert [r['id'] for r in top_n(records, 'latency', 4)] == [3, 1, 2, 4]
+    assert list(top_n(records, 'id', 0)) == []
+
+
+if __name__ == "__main__":
+    test_join_types()
+    test_sort_dictset()
+    test_merge_join()
+    test_group_by()
+    test_distinct()
+    test_fingerprints()
+    test_top_n()
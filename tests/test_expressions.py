@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import pickle
+import tempfile
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from orwell import Reader, Query
+from orwell.readers import file_reader
+from orwell.expressions import Condition, parse
+from orwell.dictset import select_from_dictset
+
+
+RECORDS = [{'status': [200, 500, 404][i % 3], 'latency': i / 10, 'user': ['bob', 'alice', None][i % 3]} for i in range(60)]
+
+
+def test_expressions():
+
+    built = Condition('status', '==', 500) & ('latency', '>', 2.0) | ~Condition('user', 'in', ['bob', 'alice'])
+    parsed = parse("status == 500 and latency > 2.0 or not user in ('bob', 'alice')")
+    assert built == parsed
+    assert parse(repr(parsed)) == parsed
+
+    expected = [r for r in RECORDS if (r['status'] == 500 and r['latency'] > 2.0) or r['user'] not in ('bob', 'alice')]
+    assert list(select_from_dictset(RECORDS, condition=parsed)) == expected
+    assert list(select_from_dictset(RECORDS, condition=pickle.loads(pickle.dumps(parsed)))) == expected
+
+    # nulls and mismatched types are false rather than errors
+    assert [r['user'] for r in filter(parse("user >= 'b'"), RECORDS)] == ['bob'] * 20
+    assert not parse("missing < 3")({})
+    assert parse("`odd name` != null")({'odd name': 1})
+
+    columns = {'status': [r['status'] for r in RECORDS], 'latency': [r['latency'] for r in RECORDS],
+               'user': [r['user'] for r in RECORDS]}
+    mask = parsed.mask(columns)
+    assert [record for record, keep in zip(RECORDS, mask) if keep] == expected
+    try:
+        import numpy
+        columns['status'] = numpy.array(columns['status'])
+        columns['latency'] = numpy.array(columns['latency'])
+        assert list(parsed.mask(columns)) == mask
+    except ImportError:  # numpy is optional
+        pass
+
+    assert parsed.columns() == {'status', 'latency', 'user'}
+    assert parsed.literals() == [500, 2.0, 'bob', 'alice']
+    assert parse("status == 500 and latency > 2.0").conditions() == [('status', '==', 500), ('latency', '>', 2.0)]
+    assert parse("status == 500 and latency > 2.0").equalities() == {'status': 500}
+    assert parse("status == 500 or latency > 2.0").conditions() == []
+
+    for bad in ("status ==", "status = 5", "(status == 5", "status in 5", "status == 5 5"):
+        try:
+            parse(bad)
+            assert False, bad
+        except ValueError:
+            pass
+
+
+def test_expressions_in_reader():
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'data.jsonl'), 'w') as f:
+        for record in RECORDS:
+            f.write(json.dumps(record) + '\n')
+
+    expected = [r for r in RECORDS if r['status'] == 500 and r['latency'] > 2.0]
+    assert list(Reader(from_path=folder, reader=file_reader, where="status == 500 and latency > 2.0")) == expected
+    assert list(Reader(from_path=folder, reader=file_reader, where="status == 500 and latency > 2.0", workers=2)) == expected
+
+    query = Query(from_path=folder, reader=file_reader).where("status == 500").where(lambda r: r['latency'] > 2.0)
+    assert list(query) == expected
+    assert "prefilter={'status': 500}" in query.explain()
+    assert "partition_filter=[('status', '==', 500)]" in query.explain()
+
+
+if __name__ == "__main__":
+    test_expressions()
+    test_expressions_in_reader()
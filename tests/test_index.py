@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from orwell.index import Index
+
+
+RECORDS = [{'id': i % 50, 'name': f'name-{i % 7}', 'row': i} for i in range(200)] + [{'name': 'no id', 'row': -1}]
+
+
+def test_index():
+    folder = tempfile.mkdtemp()
+    built = Index.build(RECORDS, 'id')
+    built.save(os.path.join(folder, 'saved.index'))
+
+    with Index.open(os.path.join(folder, 'saved.index')) as saved, \
+            Index.build_file(RECORDS, 'id', os.path.join(folder, 'direct.index'), memory_limit=500) as direct:
+        for index in (built, saved, direct):
+            assert len(index) == 200
+            # every record with the value is kept, in the order they were indexed
+            assert [r['row'] for r in index.get(7)] == [7, 57, 107, 157]
+            assert index.get(50) == [] and 50 not in index and 49 in index
+            assert [r['id'] for r in index.range(10, 12)] == [10] * 4 + [11] * 4 + [12] * 4
+            assert [r['id'] for r in index.range(10, 12, include_low=False, include_high=False)] == [11] * 4
+            assert len(list(index.range(high=1))) == 8
+            assert len(list(index.range(low=48))) == 8
+
+    names = Index.build(RECORDS, 'name')
+    assert len(list(names.prefix('name-'))) == 200
+    assert {r['name'] for r in names.prefix('name-3')} == {'name-3'}
+    assert list(names.prefix('none')) == []
+
+
+if __name__ == "__main__":
+    test_index()
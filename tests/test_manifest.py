@@ -0,0 +1,48 @@
+import os
+import sys
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from orwell.helpers.manifest import ManifestBuilder, manifest_may_match
+
+
+def test_manifest_zone_map():
+
+    builder = ManifestBuilder(fields=['ts', 'name', 'mixed'], bloom_fields=['name'])
+    for i in range(100):
+        builder.add({'ts': i + 100, 'name': f'name-{i}', 'mixed': i if i % 2 else str(i)}, 10)
+    manifest = builder.to_dict()
+
+    assert manifest['records'] == 100
+    assert manifest['bytes'] == 1000
+    assert manifest['fields']['ts'] == {'nulls': 0, 'min': 100, 'max': 199}
+    assert 'min' not in manifest['fields']['mixed']
+
+    assert manifest_may_match(manifest, [('ts', '==', 150)])
+    assert not manifest_may_match(manifest, [('ts', '==', 250)])
+    assert not manifest_may_match(manifest, [('ts', '<', 100)])
+    assert manifest_may_match(manifest, [('ts', '<=', 100)])
+    assert not manifest_may_match(manifest, [('ts', '>', 199)])
+    assert not manifest_may_match(manifest, [('ts', '>', 150), ('ts', '<', 100)])
+
+    assert manifest_may_match(manifest, [('name', '==', 'name-42')])
+    assert not manifest_may_match(manifest, [('name', '==', 'name-0000')])
+
+    # fields not in the manifest, and values which can't be compared, may match
+    assert manifest_may_match(manifest, [('unknown', '==', 1)])
+    assert manifest_may_match(manifest, [('ts', '==', 'text')])
+    assert manifest_may_match(manifest, [('mixed', '==', 1000)])
+
+    # True == 1, so a bloom filter of bools may match 1
+    builder = ManifestBuilder(bloom_fields=['flag'])
+    builder.add({'flag': True})
+    assert manifest_may_match(builder.to_dict(), [('flag', '==', 1)])
+    assert manifest_may_match(builder.to_dict(), [('flag', '==', True)])
+
+    # all of the values are null
+    builder = ManifestBuilder(fields=['empty'])
+    builder.add({})
+    assert not manifest_may_match(builder.to_dict(), [('empty', '==', 1)])
+    assert manifest_may_match(builder.to_dict(), [('empty', '==', None)])
+
+
+if __name__ == "__main__":
+    test_manifest_zone_map()
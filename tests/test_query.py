@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import tempfile
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from orwell import Query, Reader
+from orwell.readers import file_reader
+from orwell.dictset import select_from_dictset, set_column, distinct, limit
+
+
+def _create_test_data(records: int = 1000):
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'data.jsonl'), 'w') as f:
+        for i in range(records):
+            f.write(json.dumps({'id': i, 'group': i % 10, 'name': f'name-{i}'}) + '\n')
+    return folder
+
+
+def test_query_matches_dictset_pipeline():
+    folder = _create_test_data()
+
+    query = (Query(from_path=folder, reader=file_reader)
+             .set_column('double', lambda r: r['id'] * 2, depends_on=['id'])
+             .where({'group': 3})
+             .where(lambda r: r['id'] > 500, columns=['id'])
+             .select(['id', 'double'])
+             .limit(5))
+
+    expected = Reader(from_path=folder, reader=file_reader)
+    expected = set_column(expected, 'double', lambda r: r['id'] * 2)
+    expected = select_from_dictset(expected, condition=lambda r: r['group'] == 3 and r['id'] > 500)
+    expected = select_from_dictset(expected, ['id', 'double'])
+    expected = limit(expected, 5)
+    assert list(query) == list(expected)
+
+    # the filters, projection and limit are run by the reader
+    plan = query.explain()
+    assert plan.splitlines() == [
+        "Fused[SetColumn(double), Select(['id', 'double'])]",
+        "  Reader(from_path=" + repr(folder) + ", where=_AllOf, select=['id'], limit=5, prefilter={'group': 3})"]
+    plan = (Query(from_path=folder, reader=file_reader).where({'group': 3}).select(['id']).limit(5)).explain()
+    assert plan == "Reader(from_path=" + repr(folder) + ", where={'group': 3}, select=['id'], limit=5)"
+
+    # filters which may depend on earlier steps aren't moved
+    query = Query(from_path=folder, reader=file_reader).distinct(['group']).where(lambda r: r['id'] > 5).limit(3)
+    assert list(query) == [{'id': 6, 'group': 6, 'name': 'name-6'}, {'id': 7, 'group': 7, 'name': 'name-7'},
+                           {'id': 8, 'group': 8, 'name': 'name-8'}]
+    assert list(query) == list(limit(select_from_dictset(distinct(Reader(from_path=folder, reader=file_reader), ['group']),
+                                                         condition=lambda r: r['id'] > 5), 3))
+
+    # a missing field equals null, the prefilter mustn't drop it
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'data.jsonl'), 'w') as f:
+        f.write('{"id": 1, "x": null}\n{"id": 2}\n{"id": 3, "x": 1}\n')
+    for where in ('x == null', {'x': None}):
+        query = Query(from_path=folder, reader=file_reader).where(where).where(lambda r: r['id'] > 0, columns=['id'])
+        assert [r['id'] for r in query] == [1, 2]
+
+    # distinct treats missing values differently to nulls, so the Reader
+    # mustn't fill in the missing columns
+    query = Query(from_path=folder, reader=file_reader).distinct(['x']).select(['id'])
+    assert list(query) == [{'id': 1}, {'id': 2}, {'id': 3}]
+    assert list(query) == list(select_from_dictset(distinct(Reader(from_path=folder, reader=file_reader), ['x']), ['id']))
+
+
+def test_query_explain_analyze():
+    folder = _create_test_data()
+
+    lookup = Query(from_path=folder, reader=file_reader).where({'group': 1}).select(['id', 'name'])
+    query = Query(from_path=folder, reader=file_reader).where({'group': 1}).join(lookup, 'id').distinct(['group'])
+    assert len(list(query)) == 1
+
+    plan = query.explain(analyze=True).splitlines()
+    assert plan[0].startswith("Distinct(['group'])  (records=1, time=")
+    assert plan[1].startswith("  Join(INNER, id)  (records=100, time=")
+    assert plan[2].startswith("    Reader(from_path=" + repr(folder) + ", where={'group': 1})  (records=100, time=")
+    assert plan[3].startswith("    Reader(from_path=" + repr(folder) + ", where={'group': 1}, select=['id', 'name'])  (records=100")
+
+
+if __name__ == "__main__":
+    test_query_matches_dictset_pipeline()
+    test_query_explain_analyze()
@@ -0,0 +1,203 @@
+import os
+import re
+import sys
+import json
+import lzma
+import tempfile
+import pytest
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from orwell import Reader, Query
+from orwell.readers import file_reader
+
+
+def _create_test_data(records: int = 1000):
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'data.jsonl'), 'w') as f:
+        for i in range(records):
+            f.write(json.dumps({'id': i, 'group': i % 10}) + '\n')
+    return folder
+
+
+def _in_group_three(record):
+    return record['group'] == 3
+
+
+def test_reader_with_workers():
+    folder = _create_test_data()
+
+    serial = list(Reader(from_path=folder, reader=file_reader, where=_in_group_three))
+    parallel = list(Reader(from_path=folder, reader=file_reader, where=_in_group_three, workers=2, batch_size=50))
+    assert len(serial) == 100
+    assert serial == parallel
+
+    unordered = list(Reader(from_path=folder, reader=file_reader, where=_in_group_three, workers=2, batch_size=50, preserve_order=False))
+    assert sorted(r['id'] for r in unordered) == [r['id'] for r in serial]
+
+    selected = list(Reader(select=['id'], from_path=folder, reader=file_reader, where=_in_group_three, workers=2, limit=5))
+    assert selected == [{'id': 3}, {'id': 13}, {'id': 23}, {'id': 33}, {'id': 43}]
+
+
+def test_reader_prefilter():
+    folder = _create_test_data()
+
+    records = list(Reader(from_path=folder, reader=file_reader, where={'id': 42}))
+    assert records == [{'id': 42, 'group': 2}]
+
+    # the prefilter can let through extra lines, 'where' removes them
+    records = list(Reader(from_path=folder, reader=file_reader, where=_in_group_three, prefilter='"id": 1'))
+    assert [r['id'] for r in records] == [13, 103, 113, 123, 133, 143, 153, 163, 173, 183, 193]
+
+    records = list(Reader(from_path=folder, reader=file_reader, prefilter=re.compile(r'"id": 99\d\b')))
+    assert [r['id'] for r in records] == list(range(990, 1000))
+
+    # True == 1, so the prefilter mustn't look for the text of either
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'data.jsonl'), 'w') as f:
+        f.write('{"flag": true}\n{"flag": 1}\n{"flag": false}\n')
+    for where in ({'flag': 1}, 'flag == 1', {'flag': True}, 'flag == true'):
+        assert len(list(Reader(from_path=folder, reader=file_reader, where=where))) == 2
+
+    # a missing field equals None, so the prefilter mustn't look for null
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'data.jsonl'), 'w') as f:
+        f.write('{"x": null}\n{"y": 1}\n{"x": 1}\n')
+    for where in ({'x': None}, 'x == null'):
+        assert len(list(Reader(from_path=folder, reader=file_reader, where=where))) == 2
+
+
+def test_reader_batches():
+    folder = _create_test_data(records=25)
+
+    batches = list(Reader(from_path=folder, reader=file_reader).iter_batches(10))
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert batches[2][0] == {'id': 20, 'group': 0}
+
+    batches = list(Reader(select=['id'], from_path=folder, reader=file_reader).iter_batches(10, columnar=True))
+    assert batches[2] == {'id': [20, 21, 22, 23, 24]}
+
+
+def _create_uneven_data():
+    # the columns differ between the batches
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'data.jsonl'), 'w') as f:
+        for i in range(25):
+            f.write(json.dumps({'id': i, 'name': 'x' * i} if i < 10 else {'id': i, 'score': i / 2}) + '\n')
+    return folder
+
+
+def test_reader_to_pandas():
+    pytest.importorskip('pandas')
+    folder = _create_uneven_data()
+
+    frame = Reader(from_path=folder, reader=file_reader).to_pandas(batch_size=10)
+    assert list(frame.columns) == ['id', 'name', 'score']
+    assert list(frame['id']) == list(range(25))
+    assert frame['name'][9] == 'x' * 9 and frame['name'].isna().sum() == 15
+    assert frame['score'].isna().sum() == 10 and frame['score'][24] == 12
+
+    with pytest.raises(MemoryError):
+        Reader(from_path=folder, reader=file_reader).to_pandas(batch_size=10, max_memory=100)
+
+
+def test_reader_to_arrow():
+    pytest.importorskip('pyarrow')
+    folder = _create_uneven_data()
+
+    table = Reader(from_path=folder, reader=file_reader).to_arrow(batch_size=10)
+    assert table.num_rows == 25
+    assert sorted(table.column_names) == ['id', 'name', 'score']
+    assert table.column('id').to_pylist() == list(range(25))
+    assert table.column('score').to_pylist()[:10] == [None] * 10
+
+    with pytest.raises(MemoryError):
+        Reader(from_path=folder, reader=file_reader).to_arrow(batch_size=10, max_memory=100)
+
+
+def test_reader_memory_mapped():
+    folder = _create_test_data()
+
+    records = list(Reader(from_path=folder, reader=file_reader, use_mmap=True))
+    assert records == list(Reader(from_path=folder, reader=file_reader))
+
+    records = list(Reader(from_path=folder, reader=file_reader, use_mmap=True, where={'id': 7}))
+    assert records == [{'id': 7, 'group': 7}]
+
+    lines = list(Reader(from_path=folder, reader=file_reader, use_mmap=True, data_format='text', limit=1))
+    assert lines == ['{"id": 0, "group": 0}']
+
+
+def test_reader_compressed():
+    folder = _create_test_data()
+    with open(os.path.join(folder, 'data.jsonl'), 'rb') as source:
+        with lzma.open(os.path.join(folder, 'compressed.jsonl.lzma'), 'wb') as target:
+            target.write(source.read())
+
+    # a small chunk size so the file is decompressed over many chunks
+    records = list(Reader(from_path=folder, reader=file_reader, chunk_size=100, extention='.lzma'))
+    assert len(records) == 1000
+    assert records[-1] == {'id': 999, 'group': 9}
+
+
+def test_reader_resume_from_cursor():
+    folder = _create_test_data()
+    with open(os.path.join(folder, 'data.jsonl'), 'rb') as source:
+        with lzma.open(os.path.join(folder, 'more.jsonl.lzma'), 'wb') as target:
+            target.write(source.read())
+    expected = list(Reader(from_path=folder, reader=file_reader))
+    assert len(expected) == 2000
+
+    for options in ({}, {'use_mmap': True}, {'chunk_size': 64}):
+        for stop_after in (0, 1, 999, 1000, 1500):
+            reader = Reader(from_path=folder, reader=file_reader, **options)
+            records = [reader.read_line() for i in range(stop_after)]
+            cursor = json.dumps(reader.cursor)
+            records += list(Reader(from_path=folder, reader=file_reader, cursor=cursor, **options))
+            assert records == expected, (options, stop_after)
+
+
+def test_reader_with_custom_reader():
+    # readers which only take a path and date range still work
+    def reader(path, date_range):
+        for i in range(10):
+            yield json.dumps({'id': i, 'group': i % 3})
+
+    assert len(list(Reader(reader=reader))) == 10
+    assert list(Reader(reader=reader, where={'group': 1}, select=['id'])) == [{'id': 1}, {'id': 4}, {'id': 7}]
+    assert list(Reader(reader=reader, where='group == 1 and id > 1', select=['id'])) == [{'id': 4}, {'id': 7}]
+    query = Query(reader=reader).where('group == 1').where(lambda record: record['id'] > 1).select(['id'])
+    assert list(query) == [{'id': 4}, {'id': 7}]
+
+
+def test_reader_order_by():
+    folder = _create_test_data()
+
+    slowest = list(Reader(select=['id'], from_path=folder, reader=file_reader, order_by='group', descending=True, limit=3))
+    assert slowest == [{'id': 9}, {'id': 19}, {'id': 29}]
+    ordered = list(Reader(from_path=folder, reader=file_reader, where=_in_group_three, order_by=['id'], descending=True))
+    assert [r['id'] for r in ordered] == list(range(993, 0, -10))
+    parallel = list(Reader(select=['id'], from_path=folder, reader=file_reader, where=_in_group_three, order_by='id', limit=2, workers=2))
+    assert parallel == [{'id': 3}, {'id': 13}]
+
+    # records without the column come last, in either order
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'data.jsonl'), 'w') as f:
+        f.write('{"id": 1, "latency": 5}\n{"id": 2}\n{"id": 3, "latency": 9}\n{"id": 4, "latency": null}\n')
+    for descending in (True, False):
+        for limit in (2, -1):
+            ordered = list(Reader(select=['id'], from_path=folder, reader=file_reader, order_by='latency',
+                                  descending=descending, limit=limit))
+            expected = [{'id': 3}, {'id': 1}] if descending else [{'id': 1}, {'id': 3}]
+            assert ordered == (expected if limit == 2 else expected + [{'id': 2}, {'id': 4}])
+
+
+if __name__ == "__main__":
+    test_reader_with_workers()
+    test_reader_prefilter()
+    test_reader_batches()
+    test_reader_to_pandas()
+    test_reader_to_arrow()
+    test_reader_memory_mapped()
+    test_reader_compressed()
+    test_reader_resume_from_cursor()
+    test_reader_with_custom_reader()
+    test_reader_order_by()
@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from orwell.sketches import HyperLogLog, CountMinSketch, KLLSketch, sketch_column
+
+
+def test_sketches():
+
+    records = [{'user': f'user-{i % 5000}', 'latency': i % 1000} for i in range(20000)]
+    records += [{'user': 'busy', 'latency': None}] * 3000
+
+    distinct = HyperLogLog()
+    frequent = CountMinSketch(top_k=3)
+    latency = KLLSketch()
+    dictset = sketch_column(records, 'user', distinct)
+    dictset = sketch_column(dictset, 'user', frequent)
+    dictset = sketch_column(dictset, 'latency', latency)
+    assert len(list(dictset)) == 23000
+
+    assert abs(distinct.count() - 5001) < 5001 * 0.03
+    value, count = frequent.top(1)[0]
+    assert value == 'busy' and 3000 <= count < 3000 + 23000 * 0.003
+    assert frequent.estimate('user-1') >= 4
+    assert latency.count == 20000
+    assert abs(latency.quantile(0.5) - 500) < 30
+    assert abs(latency.rank(900) - 0.9) < 0.03
+
+    # sketches of halves merge to a sketch of the whole, and survive
+    # being saved as JSON
+    first, second = HyperLogLog(), HyperLogLog()
+    low, high = KLLSketch(), KLLSketch()
+    for i in range(10000):
+        first.update(i)
+        second.update(i + 5000)
+        low.update(i)
+        high.update(i + 10000)
+    second = HyperLogLog.from_dict(json.loads(json.dumps(second.to_dict())))
+    high = KLLSketch.from_dict(json.loads(json.dumps(high.to_dict())))
+    assert abs(first.merge(second).count() - 15000) < 15000 * 0.03
+    assert abs(low.merge(high).quantile(0.25) - 5000) < 300
+
+    reloaded = CountMinSketch.from_dict(json.loads(json.dumps(frequent.to_dict())))
+    assert reloaded.merge(frequent).top(1)[0] == ('busy', count * 2)
+
+    # the number of values kept is bounded, however many are added
+    large = KLLSketch()
+    for i in range(200000):
+        large.update(i)
+    assert sum(len(values) for values in large.levels) < 3 * large.k + 2 * len(large.levels)
+    assert abs(large.quantile(0.5) - 100000) < 200000 * 0.03
+
+
+if __name__ == "__main__":
+    test_sketches()
@@ -0,0 +1,180 @@
+"""
+Tests the blob reader and writer against a local stand-in for the GCS
+client, registered with the StoragePool.
+"""
+import os
+import sys
+import json
+import datetime
+import tempfile
+import base64
+import hashlib
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from orwell import Reader
+from orwell.readers import blob_reader
+from orwell.writers import blob_writer
+from orwell.helpers.storage_pool import StoragePool
+from google.api_core.exceptions import PreconditionFailed  # type:ignore
+
+
+class LocalBlob():
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.content = b''
+        self.generation = None
+        self.md5_hash = None
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    def exists(self):
+        return self.name in self.bucket.blobs
+
+    def download_as_string(self, start=0, end=None):
+        self.bucket.client.calls += 1
+        return self.content[start:None if end is None else end + 1]
+
+    def upload_from_string(self, content, content_type=None):
+        self.content = content.encode() if isinstance(content, str) else content
+        self.generation = 1
+        self.md5_hash = base64.b64encode(hashlib.md5(self.content).digest()).decode()
+        self.bucket.blobs[self.name] = self
+
+    def upload_from_filename(self, file_name, if_generation_match=None):
+        self.bucket.client.calls += 1
+        if if_generation_match == 0 and self.exists():
+            raise PreconditionFailed('blob exists')
+        with open(file_name, 'rb') as f:
+            self.upload_from_string(f.read())
+
+
+class LocalBucket():
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.blobs = {}
+
+    def blob(self, name):
+        return self.blobs.get(name) or LocalBlob(self, name)
+
+    def get_blob(self, name):
+        self.client.calls += 1
+        return self.blobs.get(name)
+
+
+class LocalClient():
+
+    def __init__(self):
+        self.buckets = {}
+        self.calls = 0
+
+    def bucket(self, name):
+        return self.buckets.setdefault(name, LocalBucket(self, name))
+
+    def list_blobs(self, bucket_or_name, prefix=''):
+        self.calls += 1
+        return [blob for name, blob in sorted(bucket_or_name.blobs.items()) if name.startswith(prefix)]
+
+
+def test_blob_reader_and_writer_with_local_client():
+
+    client = LocalClient()
+    StoragePool.set_client('project', client)
+    assert StoragePool.get_bucket('project', 'bucket') is StoragePool.get_bucket('project', 'bucket')
+
+    source = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+    for i in range(100):
+        source.write(json.dumps({'id': i}) + '\n')
+    source.close()
+
+    date = datetime.date(2021, 3, 1)
+    for _ in range(2):
+        blob_writer(source_file_name=source.name, target_path='bucket/data/%date/data.jsonl', date=date, project='project')
+    assert sorted(client.bucket('bucket').blobs) == ['data/2021-03-01/data-0000.jsonl', 'data/2021-03-01/data-0001.jsonl']
+    # one listing, then one upload for each blob
+    assert client.calls == 3
+
+    # another writer has used the next name
+    client.bucket('bucket').blob('data/2021-03-01/data-0002.jsonl').upload_from_string('{}')
+    name = blob_writer(source_file_name=source.name, target_path='bucket/data/%date/data.jsonl', date=date, project='project')
+    assert name == 'data/2021-03-01/data-0003.jsonl'
+    for name in ('data/2021-03-01/data-0002.jsonl', 'data/2021-03-01/data-0003.jsonl'):
+        client.bucket('bucket').blobs.pop(name)
+
+    # a retry of an upload which was saved, but the response was lost,
+    # recognises the blob rather than saving it again
+    reservation: dict = {}
+    upload = LocalBlob.upload_from_filename
+
+    def lost_response(self, *args, **kwargs):
+        upload(self, *args, **kwargs)
+        raise ConnectionError('response lost')
+
+    LocalBlob.upload_from_filename = lost_response  # type:ignore
+    try:
+        blob_writer(source_file_name=source.name, target_path='bucket/data/%date/data.jsonl', date=date, project='project', reservation=reservation)
+        assert False
+    except ConnectionError:
+        pass
+    finally:
+        LocalBlob.upload_from_filename = upload  # type:ignore
+    name = blob_writer(source_file_name=source.name, target_path='bucket/data/%date/data.jsonl', date=date, project='project', reservation=reservation)
+    assert name == reservation['name'] == 'data/2021-03-01/data-0004.jsonl'
+    assert len(client.bucket('bucket').blobs) == 3
+    client.bucket('bucket').blobs.pop(name)
+
+    client.calls = 0
+    records = list(Reader(from_path='bucket/data/%date/data.jsonl', project='project', date_range=(date, date), chunk_size=100))
+    assert len(records) == 200
+    assert records[99] == {'id': 99}
+    # one listing, and the blobs are downloaded without looking them up again
+    assert client.calls == 1 + 2 * 11
+
+    StoragePool.reset()
+
+
+def test_blob_read_ahead():
+    blob_reader_module = importlib.import_module('orwell.readers.blob_reader')
+    client = LocalClient()
+    StoragePool.set_client('project', client)
+    content = ''.join(json.dumps({'id': i}) + '\n' for i in range(100))
+    client.bucket('bucket').blob('data/read_ahead.jsonl').upload_from_string(content)
+
+    # the ranges are smaller than the lines, so lines are split across them
+    for read_ahead in (0, 1, 3):
+        lines = list(blob_reader_module._inner_blob_reader(
+                project='project', bucket='bucket', blob_name='data/read_ahead.jsonl',
+                chunk_size=7, read_ahead=read_ahead))
+        assert lines == content.splitlines(), read_ahead
+
+    executors = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            executors.append(self)
+
+    blob_reader_module.ThreadPoolExecutor = RecordingExecutor
+    try:
+        reader = blob_reader_module._inner_blob_reader(
+                project='project', bucket='bucket', blob_name='data/read_ahead.jsonl',
+                chunk_size=7, read_ahead=2)
+        assert next(reader) == '{"id": 0}'
+        reader.close()
+    finally:
+        blob_reader_module.ThreadPoolExecutor = ThreadPoolExecutor
+    # closing the reader early shuts down the downloads
+    assert len(executors) == 1 and executors[0]._shutdown
+
+    StoragePool.reset()
+
+
+if __name__ == "__main__":
+    test_blob_reader_and_writer_with_local_client()
+    test_blob_read_ahead()
@@ -0,0 +1,89 @@
+"""
+Tests the threaded reader against a local stand-in for the GCS client,
+registered with the StoragePool.
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from orwell import Reader
+from orwell.readers import threaded_reader
+from orwell.helpers.storage_pool import StoragePool
+from test_storage_pool import LocalClient
+
+DATE = datetime.date(2021, 3, 1)
+PATH = 'bucket/data/%date/data.jsonl'
+
+
+def _create_blobs(blobs: int = 4, records: int = 100):
+    client = LocalClient()
+    StoragePool.set_client('project', client)
+    bucket = client.bucket('bucket')
+    for b in range(blobs):
+        lines = ''.join(json.dumps({'blob': b, 'id': i}) + '\n' for i in range(records))
+        bucket.blob(F'data/2021-03-01/data-{b:04d}.jsonl').upload_from_string(lines)
+    return client
+
+
+def _read(**kwargs):
+    return threaded_reader(path=PATH, project='project', date_range=(DATE, DATE), **kwargs)
+
+
+def test_threaded_reader_order():
+    _create_blobs()
+    expected = [json.dumps({'blob': b, 'id': i}) for b in range(4) for i in range(100)]
+
+    ordered = list(_read(ordered=True, chunk_size=64, lines_per_chunk=7, max_buffer_bytes=256))
+    assert ordered == expected
+
+    unordered = list(_read(ordered=False, chunk_size=64, lines_per_chunk=7, read_ahead=2))
+    assert sorted(unordered) == sorted(expected)
+    for b in range(4):
+        # each blob's records are in order, even if the blobs are interleaved
+        assert [line for line in unordered if json.loads(line)['blob'] == b] == expected[b * 100:(b + 1) * 100]
+    StoragePool.reset()
+
+
+def test_threaded_reader_backpressure():
+    client = _create_blobs()
+    client.calls = 0
+    reader = _read(max_threads=2, chunk_size=64, lines_per_chunk=5, max_buffer_bytes=1)
+    next(reader)
+    time.sleep(0.2)
+    # the threads wait for the consumer rather than reading every blob
+    total_downloads = 4 * len(json.dumps({'blob': 0, 'id': 10}) + '\n') * 100 // 64
+    assert client.calls < total_downloads / 4
+    reader.close()
+    StoragePool.reset()
+
+
+def test_threaded_reader_errors_and_limits():
+    client = _create_blobs()
+
+    def broken(*args, **kwargs):
+        raise ConnectionError('download failed')
+
+    client.bucket('bucket').blobs['data/2021-03-01/data-0002.jsonl'].download_as_string = broken
+    try:
+        list(_read(ordered=True))
+        assert False
+    except ConnectionError:
+        pass
+
+    _create_blobs()
+    threads = threading.active_count()
+    reader = Reader(reader=threaded_reader, from_path=PATH, project='project', date_range=(DATE, DATE),
+                    max_buffer_bytes=1, limit=5)
+    assert len(list(reader)) == 5
+    # closing the reader stops its threads
+    assert threading.active_count() == threads
+    StoragePool.reset()
+
+
+if __name__ == "__main__":
+    test_threaded_reader_order()
+    test_threaded_reader_backpressure()
+    test_threaded_reader_errors_and_limits()
@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import threading
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+from orwell import Writer
+from orwell.writers import file_writer
+from orwell.dictset import fingerprint
+from orwell.helpers.manifest import partition_fingerprint
+
+
+def test_writer_threads():
+    partitions = []
+    manifests = []
+
+    def capture_writer(source_file_name, manifest, **kwargs):
+        with open(source_file_name, 'r') as file:
+            partitions.append([json.loads(line) for line in file])
+        manifests.append(manifest)
+
+    def producer(writer, thread):
+        for i in range(0, 500, 10):
+            if thread % 2:
+                writer.append_many({'thread': thread, 'i': j} for j in range(i, i + 10))
+            else:
+                for j in range(i, i + 10):
+                    writer.append({'thread': thread, 'i': j})
+
+    writer = Writer(writer=capture_writer, partition_size=4096, commit_on_write=True, use_worker_thread=False,
+                    write_manifest=True)
+    threads = [threading.Thread(target=producer, args=(writer, thread)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.finalize()
+
+    assert len(partitions) > 1
+    assert all(sum(len(json.dumps(record, separators=(',', ':'))) + 1 for record in partition) <= 4096 for partition in partitions)
+    records = [record for partition in partitions for record in partition]
+    assert len(records) == 4000
+    for thread in range(8):
+        # each thread's records are written in the order they were appended
+        assert [record['i'] for record in records if record['thread'] == thread] == list(range(500))
+    # the fingerprints of the files combine to the fingerprint of all of the records
+    assert partition_fingerprint(manifests) == fingerprint(records)
+    assert partition_fingerprint(manifests + [{'records': 0}]) is None
+
+
+def test_async_writer():
+    partitions = []
+
+    def capture_writer(source_file_name, **kwargs):
+        with open(source_file_name, 'r') as file:
+            partitions.append([json.loads(line) for line in file])
+
+    async def append_records(writer):
+        for i in range(100, 200):
+            assert await writer.append_async({'i': i})
+
+    writer = Writer(writer=capture_writer, partition_size=1024, mode='async', queue_size=50, use_worker_thread=False)
+    for i in range(100):
+        assert writer.append({'i': i})
+    asyncio.run(append_records(writer))
+    assert writer.append_many({'i': i} for i in range(200, 300)) == 100
+    writer.flush()
+    assert len(partitions) > 1
+    writer.close()
+    assert [record['i'] for partition in partitions for record in partition] == list(range(300))
+
+    try:
+        Writer(mode='async', when_full='wait')
+        assert False
+    except ValueError:
+        pass
+
+
+def test_background_uploads():
+    partitions = []
+    attempts = []
+
+    reservations = {}
+
+    def flaky_writer(source_file_name, **kwargs):
+        attempts.append(source_file_name)
+        # retries are passed the same reservation, so save to the same name
+        assert reservations.setdefault(source_file_name, kwargs['reservation']) is kwargs['reservation']
+        # every partition fails the first time it is saved
+        if attempts.count(source_file_name) == 1 or kwargs.get('broken'):
+            raise ConnectionError('upload failed')
+        with open(source_file_name, 'r') as file:
+            partitions.append([json.loads(line) for line in file])
+
+    writer = Writer(writer=flaky_writer, partition_size=256, use_worker_thread=False,
+                    upload_workers=4, upload_backoff_seconds=0, max_pending_uploads=2)
+    for i in range(100):
+        writer.append({'i': i})
+    writer.close()
+    assert writer.pending_uploads == [] and writer.failed_uploads == []
+    assert sorted(record['i'] for partition in partitions for record in partition) == list(range(100))
+    assert not any(os.path.exists(file_name) for file_name in attempts)
+
+    writer = Writer(writer=flaky_writer, use_worker_thread=False, upload_workers=1,
+                    upload_retries=2, upload_backoff_seconds=0, broken=True)
+    writer.append({'i': 0})
+    writer.close()
+    assert len(writer.failed_uploads) == 1
+    failed = writer.failed_uploads[0]
+    assert failed['attempts'] == 3 and isinstance(failed['error'], ConnectionError)
+    assert os.path.exists(failed['source_file_name'])
+    os.remove(failed['source_file_name'])
+
+    # writers without a reservation parameter aren't passed one
+    saved = []
+
+    def simple_writer(source_file_name, target_path, add_extention, date):
+        saved.append(source_file_name)
+
+    writer = Writer(writer=simple_writer, use_worker_thread=False, upload_workers=1)
+    writer.append({'i': 0})
+    writer.close()
+    assert len(saved) == 1 and writer.failed_uploads == []
+
+
+def test_file_writer_names():
+    folder = tempfile.mkdtemp()
+    target_path = os.path.join(folder, 'data.jsonl')
+    # a partition from an earlier run
+    open(os.path.join(folder, 'data-0004.jsonl'), 'w').close()
+
+    source = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+    source.write('{"id": 1}\n')
+    source.close()
+
+    names = [file_writer(source.name, target_path, manifest={'records': 1}) for _ in range(2)]
+    assert names == [os.path.join(folder, 'data-0005.jsonl'), os.path.join(folder, 'data-0006.jsonl')]
+    assert os.path.exists(names[0] + '.manifest')
+
+    # another writer has used the next name
+    open(os.path.join(folder, 'data-0007.jsonl'), 'w').close()
+    assert file_writer(source.name, target_path) == os.path.join(folder, 'data-0008.jsonl')
+    with open(names[1], 'r') as file:
+        assert file.read() == '{"id": 1}\n'
+    os.remove(source.name)
+
+
+if __name__ == "__main__":
+    test_writer_threads()
+    test_async_writer()
+    test_background_uploads()
+    test_file_writer_names()